@@ -1,15 +1,199 @@
 """
-Dumps all data from the specified m3g file when the module is called directly
+Dumps data from m3g files when the module is called directly
+
+Objects are written as soon as they are read. Directories are searched for .m3g
+files, and with --jobs several files are read in parallel processes.
 """
 
-from sys import argv
-from rich import console
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import sys
+
+from rich.console import Console
+from rich.logging import RichHandler
+
+from PyM3G.probe import probe
 from PyM3G.reader import M3GReader
+from PyM3G.util import M3GStatus, find_files, obj2dict
+
+from PyM3G.objects.image2d import Image2D
+from PyM3G.objects.triangle_strip_array import TriangleStripArray
+from PyM3G.objects.vertex_array import VertexArray
+from PyM3G.objects.vertex_buffer import VertexBuffer
+
+
+def parse_ids(text):
+    """Parse an id list like '1,4,7-9' into a set of object ids"""
+    ids = set()
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        ids.update(range(int(first), int(last or first) + 1))
+    return ids
+
+
+class Summary:
+    """Per-type object counts and geometry and texture totals of one file"""
+
+    def __init__(self):
+        self.types = {}
+        self.vertices = 0
+        self.triangles = 0
+        self.texture_bytes = 0
+        self._vertex_counts = {}
+
+    def add(self, obj_id, obj):
+        """Account for one object, called as the objects are read"""
+        name = obj.__class__.__name__ if obj is not None else "Unknown"
+        self.types[name] = self.types.get(name, 0) + 1
+        if isinstance(obj, VertexArray):
+            self._vertex_counts[obj_id] = obj.vertex_count
+        elif isinstance(obj, VertexBuffer):
+            self.vertices += self._vertex_counts.get(obj.positions, 0)
+        elif isinstance(obj, TriangleStripArray):
+            self.triangles += sum(obj.strip_lengths) - 2 * len(obj.strip_lengths)
+        elif isinstance(obj, Image2D):
+            self.texture_bytes += len(obj.palette) + len(obj.pixels)
+
+    def to_dict(self, path, reader):
+        """Returns the summary as a JSON serializable dict"""
+        return {
+            "file": path,
+            "status": reader.status.name,
+            "objects": len(reader.objects),
+            "types": self.types,
+            "vertices": self.vertices,
+            "triangles": self.triangles,
+            "texture_bytes": self.texture_bytes,
+            "errors": len(reader.errors),
+        }
+
+
+def dump_file(path, options, write):
+    """
+    Read one file and pass its output lines to write. Returns the reader status,
+    or FAILED when the file could not be read at all.
+    """
+    ids = options["ids"]
+    output = options["format"]
+    if output == "probe":
+        try:
+            result = probe(path, census=True)
+        except OSError as err:
+            logging.getLogger("m3g").error("Could not read '%s': %r", path, err)
+            return M3GStatus.FAILED
+        write(json.dumps(result.to_dict()))
+        return result.status
+    summary = Summary()
+
+    def on_object(obj_id, obj):
+        if output == "summary":
+            summary.add(obj_id, obj)
+        elif ids is None or obj_id in ids:
+            if output == "jsonl":
+                record = {"file": path, "id": obj_id}
+                if obj is None:
+                    record["type"] = None
+                else:
+                    record.update(obj2dict(obj, options["payload"]))
+                write(json.dumps(record))
+            else:
+                write(f"({obj_id}) {obj}")
+
+    if output == "text" and options["banner"]:
+        write(f"==> {path} <==")
+    try:
+        reader = M3GReader(
+            path,
+            options["log_level"],
+            threads=options["threads"],
+            strict=not options["tolerant"],
+            on_object=on_object,
+        )
+    except Exception as err:
+        logging.getLogger("m3g").error("Could not read '%s': %r", path, err)
+        return M3GStatus.FAILED
+    if output == "summary":
+        write(json.dumps(summary.to_dict(path, reader)))
+    return reader.status
+
+
+def _dump_collected(path, options):
+    lines = []
+    status = dump_file(path, options, lines.append)
+    return status, lines
+
+
+def _write_line(line):
+    sys.stdout.write(line)
+    sys.stdout.write("\n")
+
+
+def _setup_logging():
+    logging.basicConfig(
+        level="NOTSET",
+        format="%(message)s",
+        datefmt="[%X]",
+        handlers=[RichHandler(console=Console(file=sys.stderr))],
+    )
+
+
+def main(argv=None):
+    """Command line entry point, returns the exit code"""
+    parser = ArgumentParser(prog="python -m PyM3G", description=__doc__.strip())
+    parser.add_argument("paths", nargs="+", help="m3g files or directories")
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=("text", "jsonl", "summary", "probe"),
+        default="text",
+        help="text dump, one JSON object per line, one JSON summary per file, or "
+        "one JSON line per file with the header and object census only",
+    )
+    parser.add_argument("-i", "--ids", type=parse_ids, help="only these object ids")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="files to read in parallel"
+    )
+    parser.add_argument(
+        "-t", "--threads", type=int, default=1, help="decompression threads per file"
+    )
+    parser.add_argument(
+        "--payload", action="store_true", help="include array data in JSON output"
+    )
+    parser.add_argument(
+        "--tolerant", action="store_true", help="keep reading past bad objects"
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    _setup_logging()
+    files = find_files(args.paths)
+    options = {
+        "format": args.format,
+        "ids": args.ids,
+        "payload": args.payload,
+        "tolerant": args.tolerant,
+        "threads": args.threads,
+        "log_level": args.log_level,
+        "banner": len(files) > 1,
+    }
+    failed = 0
+    if args.jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(
+            max_workers=args.jobs, initializer=_setup_logging
+        ) as pool:
+            for status, lines in pool.map(
+                _dump_collected, files, [options] * len(files)
+            ):
+                for line in lines:
+                    _write_line(line)
+                failed += status != M3GStatus.SUCCESS
+    else:
+        for path in files:
+            failed += dump_file(path, options, _write_line) != M3GStatus.SUCCESS
+    return 1 if failed else 0
 
-c = console.Console()
 
-m3g = M3GReader(argv[1], "WARNING")
-idx = 0
-for obj in m3g.objects:
-    c.print(f"({idx}) {obj}")
-    idx = idx + 1
+if __name__ == "__main__":
+    sys.exit(main())
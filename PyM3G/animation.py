@@ -0,0 +1,373 @@
+"""
+Evaluation and baking of keyframe animation
+
+Tracks are grouped by AnimationController, so the mapping from world time to
+sequence time is computed once per controller for all sample times. Each
+KeyframeSequence is then evaluated for the whole batch of sample times at once
+and the weighted tracks are blended per animated property.
+"""
+
+from bisect import bisect_right
+from math import acos, cos, sin, sqrt
+
+from PyM3G.objects.animation_controller import AnimationController
+from PyM3G.objects.animation_track import AnimationTrack
+from PyM3G.objects.keyframe_sequence import KeyframeSequence
+
+LINEAR = 176
+SLERP = 177
+SPLINE = 178
+SQUAD = 179
+STEP = 180
+
+CONSTANT = 192
+LOOP = 193
+
+ORIENTATION = 268
+
+
+def decoded_values(sequence):
+    """Returns the keyframe values of a sequence as float tuples"""
+    count = sequence.component_count
+    flat = sequence.vector_value
+    if sequence.encoding == 0:
+        columns = [flat[comp::count] for comp in range(count)]
+    else:
+        divisor = 255.0 if sequence.encoding == 1 else 65535.0
+        columns = [
+            [
+                sequence.vector_bias[comp]
+                + sequence.vector_scale[comp] * value / divisor
+                for value in flat[comp::count]
+            ]
+            for comp in range(count)
+        ]
+    return list(zip(*columns))
+
+
+def valid_keyframes(sequence):
+    """
+    Returns the times and decoded values of the keyframes inside the valid range of
+    a sequence. A range that wraps around (first > last) continues past the end of
+    the sequence, with the wrapped keyframes shifted by one duration.
+    """
+    values = decoded_values(sequence)
+    if not values:
+        return [], []
+    last_index = len(values) - 1
+    first = min(sequence.valid_range_first, last_index)
+    last = min(sequence.valid_range_last, last_index)
+    if first <= last:
+        indices = list(range(first, last + 1))
+        times = [sequence.time[index] for index in indices]
+    else:
+        indices = list(range(first, last_index + 1)) + list(range(last + 1))
+        times = [sequence.time[index] for index in range(first, last_index + 1)]
+        times += [sequence.time[index] + sequence.duration for index in range(last + 1)]
+    return times, [values[index] for index in indices]
+
+
+def controller_times(controller, world_times):
+    """
+    Map world times to sequence times through an AnimationController, giving None
+    where the controller is not active
+    """
+    start = controller.active_interval_start
+    end = controller.active_interval_end
+    always = start == end
+    ref_sequence = controller.reference_sequence_time
+    ref_world = controller.reference_world_time
+    speed = controller.speed
+    return [
+        ref_sequence + speed * (time - ref_world)
+        if always or start <= time < end
+        else None
+        for time in world_times
+    ]
+
+
+def _normalize(quat):
+    length = sqrt(sum(comp * comp for comp in quat))
+    if length == 0.0:
+        return (0.0, 0.0, 0.0, 1.0)
+    return tuple(comp / length for comp in quat)
+
+
+def _quat_multiply(a, b):
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+        aw * bw - ax * bx - ay * by - az * bz,
+    )
+
+
+def _quat_log(quat):
+    x, y, z, w = quat
+    length = sqrt(x * x + y * y + z * z)
+    if length < 1e-9:
+        return (0.0, 0.0, 0.0, 0.0)
+    angle = acos(max(-1.0, min(1.0, w))) / length
+    return (x * angle, y * angle, z * angle, 0.0)
+
+
+def _quat_exp(quat):
+    x, y, z, _ = quat
+    angle = sqrt(x * x + y * y + z * z)
+    if angle < 1e-9:
+        return (0.0, 0.0, 0.0, 1.0)
+    factor = sin(angle) / angle
+    return (x * factor, y * factor, z * factor, cos(angle))
+
+
+def _slerp(a, b, s):
+    dot = sum(p * q for p, q in zip(a, b))
+    if dot < 0.0:
+        b = tuple(-comp for comp in b)
+        dot = -dot
+    if dot > 0.9995:
+        return _normalize(tuple(p + s * (q - p) for p, q in zip(a, b)))
+    theta = acos(dot)
+    wa = sin((1.0 - s) * theta) / sin(theta)
+    wb = sin(s * theta) / sin(theta)
+    return tuple(wa * p + wb * q for p, q in zip(a, b))
+
+
+class _Curve:
+    """The keyframes of one sequence prepared for batch evaluation"""
+
+    def __init__(self, sequence):
+        self.interpolation = sequence.interpolation
+        self.looping = sequence.repeat_mode == LOOP and sequence.duration > 0
+        self.duration = sequence.duration
+        self.times, self.values = valid_keyframes(sequence)
+        if self.interpolation in (SLERP, SQUAD):
+            self.values = [_normalize(value) for value in self.values]
+        if self.interpolation == SPLINE:
+            self._spline_tangents()
+        elif self.interpolation == SQUAD:
+            self._squad_controls()
+
+    def _neighbours(self, index):
+        """Returns previous and next keyframe indices and times, or None at ends"""
+        count = len(self.times)
+        prev_index, next_index = index - 1, index + 1
+        prev_time = next_time = None
+        if prev_index >= 0:
+            prev_time = self.times[prev_index]
+        elif self.looping and count > 1:
+            prev_index = count - 1
+            prev_time = self.times[-1] - self.duration
+        if next_index < count:
+            next_time = self.times[next_index]
+        elif self.looping and count > 1:
+            next_index = 0
+            next_time = self.times[0] + self.duration
+        if prev_time is None or next_time is None:
+            return None
+        return prev_index, prev_time, next_index, next_time
+
+    def _spline_tangents(self):
+        """Kochanek-Bartels tangents adjusted for uneven keyframe spacing"""
+        width = len(self.values[0]) if self.values else 0
+        self.tangents_in = []
+        self.tangents_out = []
+        for index, time in enumerate(self.times):
+            around = self._neighbours(index)
+            if around is None or around[3] == around[1]:
+                zero = (0.0,) * width
+                self.tangents_in.append(zero)
+                self.tangents_out.append(zero)
+                continue
+            prev_index, prev_time, next_index, next_time = around
+            span = next_time - prev_time
+            tangent = [
+                (n - p) / 2
+                for n, p in zip(self.values[next_index], self.values[prev_index])
+            ]
+            incoming = 2 * (time - prev_time) / span
+            outgoing = 2 * (next_time - time) / span
+            self.tangents_in.append(tuple(incoming * comp for comp in tangent))
+            self.tangents_out.append(tuple(outgoing * comp for comp in tangent))
+
+    def _squad_controls(self):
+        """Intermediate quaternions for spherical quadrangle interpolation"""
+        self.controls = []
+        for index, value in enumerate(self.values):
+            around = self._neighbours(index)
+            if around is None:
+                self.controls.append(value)
+                continue
+            inverse = (-value[0], -value[1], -value[2], value[3])
+            to_next = _quat_log(_quat_multiply(inverse, self.values[around[2]]))
+            to_prev = _quat_log(_quat_multiply(inverse, self.values[around[0]]))
+            self.controls.append(
+                _quat_multiply(
+                    value,
+                    _quat_exp(tuple(-(n + p) / 4 for n, p in zip(to_next, to_prev))),
+                )
+            )
+
+    def _segment(self, time):
+        """Returns the keyframe pair around a time and the position between them"""
+        times = self.times
+        count = len(times)
+        if self.looping:
+            time = times[0] + (time - times[0]) % self.duration
+        index = bisect_right(times, time) - 1
+        if index < 0:
+            return 0, 0, 0.0
+        if index >= count - 1:
+            if not self.looping or count == 1:
+                return count - 1, count - 1, 0.0
+            start, end = times[-1], times[0] + self.duration
+            return count - 1, 0, (time - start) / (end - start) if end > start else 0.0
+        start, end = times[index], times[index + 1]
+        return index, index + 1, (time - start) / (end - start) if end > start else 0.0
+
+    def _interpolate(self, first, second, position):
+        values = self.values
+        if first == second or self.interpolation == STEP or position <= 0.0:
+            return values[first]
+        mode = self.interpolation
+        if mode == SLERP:
+            return _slerp(values[first], values[second], position)
+        if mode == SQUAD:
+            return _slerp(
+                _slerp(values[first], values[second], position),
+                _slerp(self.controls[first], self.controls[second], position),
+                2 * position * (1 - position),
+            )
+        if mode == SPLINE:
+            s2 = position * position
+            s3 = s2 * position
+            h00, h10 = 2 * s3 - 3 * s2 + 1, s3 - 2 * s2 + position
+            h01, h11 = 3 * s2 - 2 * s3, s3 - s2
+            return tuple(
+                h00 * a + h10 * ta + h01 * b + h11 * tb
+                for a, ta, b, tb in zip(
+                    values[first],
+                    self.tangents_out[first],
+                    values[second],
+                    self.tangents_in[second],
+                )
+            )
+        return tuple(
+            a + position * (b - a) for a, b in zip(values[first], values[second])
+        )
+
+    def sample(self, sequence_times):
+        """Evaluate the curve at a batch of sequence times (None stays None)"""
+        if not self.times:
+            return [None] * len(sequence_times)
+        interpolate = self._interpolate
+        segment = self._segment
+        return [
+            None if time is None else interpolate(*segment(time))
+            for time in sequence_times
+        ]
+
+
+def sample_sequence(sequence, sequence_times):
+    """Evaluate a KeyframeSequence at a batch of sequence times"""
+    return _Curve(sequence).sample(sequence_times)
+
+
+class AnimationBake:
+    """
+    Dense property curves of a baked animation. curves maps an object id to a dict
+    of property id to one value tuple per sample time, or None where no track of
+    that property was active.
+    """
+
+    def __init__(self, times):
+        self.times = times
+        self.curves = {}
+
+    def curve(self, obj_id, property_id):
+        """Returns the samples of one animated property of one object"""
+        return self.curves.get(obj_id, {}).get(property_id)
+
+
+def _blend(property_id, samples):
+    """Blend weighted per-track samples of one property"""
+    blended = []
+    for values in zip(*(track for _, track in samples)):
+        total = None
+        for (weight, _), value in zip(samples, values):
+            if value is None:
+                continue
+            if total is None:
+                total = [0.0] * len(value)
+            elif property_id == ORIENTATION and sum(
+                t * v for t, v in zip(total, value)
+            ) < 0.0:
+                value = tuple(-comp for comp in value)
+            for comp, item in enumerate(value[: len(total)]):
+                total[comp] += weight * item
+        if total is not None and property_id == ORIENTATION:
+            total = _normalize(total)
+        blended.append(None if total is None else tuple(total))
+    return blended
+
+
+def bake(reader, times):
+    """
+    Evaluate every AnimationTrack of a reader at the given world times and blend
+    the tracks per object and property. Returns an AnimationBake.
+    """
+    times = list(times)
+    result = AnimationBake(times)
+    sequence_times = {}
+    curves = {}
+    evaluated = {}
+    track_samples = {}
+    for track_id, track in enumerate(reader.objects, 1):
+        if not isinstance(track, AnimationTrack):
+            continue
+        controller = reader.get_object_by_id(track.animation_controller)
+        sequence = reader.get_object_by_id(track.keyframe_sequence)
+        if not isinstance(controller, AnimationController) or not isinstance(
+            sequence, KeyframeSequence
+        ):
+            continue
+        if controller.weight == 0.0:
+            continue
+        if track.animation_controller not in sequence_times:
+            sequence_times[track.animation_controller] = controller_times(
+                controller, times
+            )
+        key = (track.keyframe_sequence, track.animation_controller)
+        if key not in evaluated:
+            if track.keyframe_sequence not in curves:
+                curves[track.keyframe_sequence] = _Curve(sequence)
+            evaluated[key] = curves[track.keyframe_sequence].sample(
+                sequence_times[track.animation_controller]
+            )
+        track_samples[track_id] = (controller.weight, evaluated[key])
+
+    for obj_id, obj in enumerate(reader.objects, 1):
+        tracks = getattr(obj, "animation_tracks", None)
+        if not tracks:
+            continue
+        properties = {}
+        for track_id in tracks:
+            track = reader.get_object_by_id(track_id)
+            if track_id in track_samples and isinstance(track, AnimationTrack):
+                properties.setdefault(track.property_id, []).append(
+                    track_samples[track_id]
+                )
+        if properties:
+            result.curves[obj_id] = {
+                property_id: _blend(property_id, samples)
+                for property_id, samples in properties.items()
+            }
+    return result
+
+
+def bake_range(reader, start, end, step):
+    """Bake all animation from world time start up to end at a fixed time step"""
+    count = max(0, int((end - start) / step))
+    return bake(reader, [start + index * step for index in range(count + 1)])
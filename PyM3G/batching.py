@@ -0,0 +1,522 @@
+"""
+Draw call batching: canonical appearances, render state sorting and static mesh
+merging
+
+Appearances are compared by value: two appearances are equal when they have
+the same layer and their components (CompositingMode, PolygonMode, Material,
+Fog and Texture2D, with Image2D compared by content) are equal field by field.
+Components with animation tracks, and objects skipped by the reader, are only
+ever equal to themselves.
+
+Static meshes, plain Mesh nodes that no animation, alignment, user id or
+reference from outside the scene graph can move or find, are merged per vertex
+format into new meshes with their world transforms baked into the vertices.
+Every render state becomes a single submesh of the merged mesh, and submeshes
+are sorted by layer and state. Blended submeshes are not merged, as merging
+would fix the draw order of their triangles.
+"""
+
+from array import array
+from copy import copy
+from math import floor
+
+from PyM3G.geometry import gather, normal_columns, scaled_columns, strip_triangles
+from PyM3G.layout import compact_objects
+from PyM3G.lighting import world_normals
+from PyM3G.textures import image_digest
+from PyM3G.transform import (
+    inverse,
+    multiply,
+    node_children,
+    root_nodes,
+    scene_nodes,
+    transform_points,
+)
+from PyM3G.vertex_cache import build_strips, make_strip_array, stitch_strips
+
+from PyM3G.objects.appearance import Appearance
+from PyM3G.objects.compositing_mode import CompositingMode
+from PyM3G.objects.group import Group
+from PyM3G.objects.image2d import Image2D
+from PyM3G.objects.mesh import Mesh
+from PyM3G.objects.node import Node
+from PyM3G.objects.sprite import Sprite
+from PyM3G.objects.vertex_array import VertexArray
+from PyM3G.objects.vertex_buffer import VertexBuffer
+from PyM3G.objects.world import World
+
+REPLACE = 68
+MAX_VERTICES = 65535
+
+
+def value_key(reader, obj_id, memo=None):
+    """
+    Returns a hashable key of an object's field values, with referenced objects
+    replaced by their own value keys. Equal keys mean equal objects. memo caches
+    the keys of a reader's objects between calls.
+    """
+    if memo is None:
+        memo = {}
+    if obj_id in memo:
+        return memo[obj_id]
+    obj = reader.get_object_by_id(obj_id)
+    if obj is None:
+        key = None
+    elif getattr(obj, "animation_tracks", None) or not hasattr(obj, "references"):
+        key = ("id", obj_id)
+    elif isinstance(obj, Image2D) and not obj.is_mutable:
+        key = ("Image2D", image_digest(obj))
+    else:
+        memo[obj_id] = ("id", obj_id)
+        refs = obj.references()
+        stripped = copy(obj)
+        stripped.remap_references({ref: 0 for ref in refs})
+        key = (
+            type(obj).__name__,
+            stripped.encode(),
+            tuple(value_key(reader, ref, memo) for ref in refs),
+        )
+    memo[obj_id] = key
+    return key
+
+
+def canonicalize_appearances(reader):
+    """
+    Point every Mesh submesh and Sprite3D at the first of all Appearances equal
+    to its own. Returns a dict mapping each duplicate appearance id to its
+    canonical id.
+    """
+    memo = {}
+    first = {}
+    remap = {}
+    for obj_id, obj in enumerate(reader.objects, 1):
+        if isinstance(obj, Appearance):
+            canonical = first.setdefault(value_key(reader, obj_id, memo), obj_id)
+            if canonical != obj_id:
+                remap[obj_id] = canonical
+    for obj in reader.objects:
+        if isinstance(obj, Mesh):
+            obj.appearance = [remap.get(app, app) for app in obj.appearance]
+        elif isinstance(obj, Sprite):
+            obj.appearance = remap.get(obj.appearance, obj.appearance)
+    return remap
+
+
+def _scene_roots(reader, world):
+    if world is None:
+        world = next(
+            (i for i, obj in enumerate(reader.objects, 1) if isinstance(obj, World)),
+            None,
+        )
+    if isinstance(reader.get_object_by_id(world), World):
+        return [world]
+    return root_nodes(reader)
+
+
+def _is_blended(reader, appearance):
+    compositing_mode = reader.get_object_by_id(appearance.compositing_mode)
+    return (
+        isinstance(compositing_mode, CompositingMode)
+        and compositing_mode.blending != REPLACE
+    )
+
+
+def draw_order(reader, world=None):
+    """
+    Returns the draw calls of the visible Mesh submeshes and Sprite3Ds below a
+    World (the file's first World by default, or all root nodes if there is
+    none) as (node id, submesh index, appearance id) tuples, sorted by layer,
+    opaque before blended, and appearance
+    """
+    calls = []
+    for node_id, scene_node in scene_nodes(reader, _scene_roots(reader, world)).items():
+        node = scene_node.node
+        if not scene_node.visible:
+            continue
+        if isinstance(node, Mesh):
+            pairs = enumerate(zip(node.index_buffer, node.appearance))
+            calls += [
+                (node_id, submesh, app_id)
+                for submesh, (index_id, app_id) in pairs
+                if index_id and app_id
+            ]
+        elif isinstance(node, Sprite) and node.appearance:
+            calls.append((node_id, 0, node.appearance))
+
+    def sort_key(call):
+        appearance = reader.get_object_by_id(call[2])
+        layer = appearance.layer if isinstance(appearance, Appearance) else 0
+        blended = isinstance(appearance, Appearance) and _is_blended(reader, appearance)
+        return (layer, blended, call[2])
+
+    return sorted(calls, key=sort_key)
+
+
+def state_changes(calls):
+    """Returns the number of appearance changes along a list of draw calls"""
+    changes = 0
+    current = None
+    for _, _, app_id in calls:
+        if app_id != current:
+            changes += 1
+            current = app_id
+    return changes
+
+
+def _dynamic_nodes(reader, roots, referenced):
+    """
+    Returns the ids of the nodes below the roots that can move or be changed at
+    run time, together with their whole subtrees
+    """
+    dynamic = set()
+    stack = [(root, False) for root in roots]
+    seen = set()
+    while stack:
+        node_id, inherited = stack.pop()
+        node = reader.get_object_by_id(node_id)
+        if node_id in seen or not isinstance(node, Node):
+            continue
+        seen.add(node_id)
+        moving = bool(node.animation_tracks) or bool(node.has_alignment)
+        if node_id not in roots:
+            moving = moving or inherited
+        if moving or node.user_id or node_id in referenced:
+            dynamic.add(node_id)
+        stack.extend((child, moving) for child in node_children(node))
+    return dynamic
+
+
+def _external_references(reader):
+    """Returns the ids of objects referenced other than as a Group child"""
+    referenced = set()
+    for obj in reader.objects:
+        if not hasattr(obj, "references"):
+            continue
+        refs = set(obj.references())
+        if isinstance(obj, Group):
+            refs.difference_update(obj.children)
+        referenced.update(refs)
+    return referenced
+
+
+def _vertex_format(reader, vertex_buffer):
+    """
+    Returns the streams a vertex buffer has as a hashable key, or None if its
+    streams cannot be merged
+    """
+    if not isinstance(vertex_buffer, VertexBuffer) or vertex_buffer.animation_tracks:
+        return None
+    arrays = [vertex_buffer.positions, vertex_buffer.normals, vertex_buffer.colors]
+    arrays += vertex_buffer.tex_coords
+    for va_id in arrays:
+        vertex_array = reader.get_object_by_id(va_id)
+        if va_id and (
+            not isinstance(vertex_array, VertexArray) or vertex_array.animation_tracks
+        ):
+            return None
+    if not vertex_buffer.positions:
+        return None
+    colors = reader.get_object_by_id(vertex_buffer.colors)
+    return (
+        bool(vertex_buffer.normals),
+        colors.component_count if colors else tuple(vertex_buffer.default_color),
+        tuple(
+            reader.get_object_by_id(va_id).component_count
+            for va_id in vertex_buffer.tex_coords
+        ),
+    )
+
+
+def _mesh_columns(reader, mesh, matrix):
+    """
+    Returns the vertex streams of a mesh as columns: positions and normals in
+    the merged space, then raw colors, then scaled texture coordinates
+    """
+    vertex_buffer = reader.get_object_by_id(mesh.vertex_buffer)
+    positions = reader.get_object_by_id(vertex_buffer.positions)
+    columns = list(
+        transform_points(
+            matrix,
+            *scaled_columns(
+                positions, vertex_buffer.position_scale, vertex_buffer.position_bias
+            ),
+        )
+    )
+    if vertex_buffer.normals:
+        normals = reader.get_object_by_id(vertex_buffer.normals)
+        columns += world_normals(matrix, normal_columns(normals))
+    if vertex_buffer.colors:
+        colors = reader.get_object_by_id(vertex_buffer.colors)
+        count = colors.component_count
+        columns += [list(colors.vertices[comp::count]) for comp in range(count)]
+    for unit, va_id in enumerate(vertex_buffer.tex_coords):
+        tex_coords = reader.get_object_by_id(va_id)
+        columns += scaled_columns(
+            tex_coords,
+            vertex_buffer.tex_coord_scale[unit],
+            vertex_buffer.tex_coord_bias[unit],
+            tex_coords.component_count,
+        )
+    return columns
+
+
+def _vertex_array(typecode, columns):
+    """Returns a VertexArray interleaving integer columns"""
+    count = len(columns[0])
+    width = len(columns)
+    vertices = array(typecode, bytes(array(typecode).itemsize * count * width))
+    for comp, column in enumerate(columns):
+        vertices[comp::width] = array(typecode, column)
+    vertex_array = VertexArray()
+    vertex_array.component_size = vertices.itemsize
+    vertex_array.component_count = width
+    vertex_array.encoding = 0
+    vertex_array.vertex_count = count
+    vertex_array.vertices = vertices
+    return vertex_array
+
+
+def _quantize(columns):
+    """
+    Returns a 16-bit VertexArray for float columns and the uniform scale and
+    per-component bias (padded to three) that restore them
+    """
+    lows = [min(column) for column in columns]
+    highs = [max(column) for column in columns]
+    bias = [(low + high) / 2 for low, high in zip(lows, highs)]
+    scale = max(high - low for low, high in zip(lows, highs)) / 65534 or 1.0
+    shorts = [
+        [max(-32768, min(32767, floor((value - offset) / scale + 0.5)))
+         for value in column]
+        for column, offset in zip(columns, bias)
+    ]  # fmt: skip
+    return _vertex_array("h", shorts), scale, (bias + [0.0, 0.0])[:3]
+
+
+class _Batch:
+    """The vertices and per-state triangles of one merged mesh"""
+
+    def __init__(self, vertex_format):
+        self.vertex_format = vertex_format
+        width = 3 + 3 * vertex_format[0]
+        if not isinstance(vertex_format[1], tuple):
+            width += vertex_format[1]
+        width += sum(vertex_format[2])
+        self.columns = [[] for _ in range(width)]
+        self.vertices = {}
+        self.triangles = {}
+
+    def room(self, mesh_id, triangles):
+        """Returns whether the vertices of a triangle list fit the batch"""
+        mapping = self.vertices.get(mesh_id, {})
+        new = sum(1 for index in set(triangles) if index not in mapping)
+        return len(self.columns[0]) + new <= MAX_VERTICES
+
+    def add(self, state, mesh_id, columns, triangles):
+        """Add a submesh's triangles, copying the vertices it uses once"""
+        mapping = self.vertices.setdefault(mesh_id, {})
+        used = [index for index in dict.fromkeys(triangles) if index not in mapping]
+        start = len(self.columns[0])
+        mapping.update(zip(used, range(start, start + len(used))))
+        for out, column in zip(self.columns, columns):
+            out.extend(gather(column, used))
+        remapped = array("I", map(mapping.__getitem__, triangles))
+        self.triangles.setdefault(state, array("I")).extend(remapped)
+
+    def build(self, reader, alpha, scope):
+        """Add the merged VertexBuffer, strips and Mesh to a reader"""
+        has_normals, colors, tex_components = self.vertex_format
+        columns = self.columns
+        vertex_buffer = VertexBuffer()
+        positions, vertex_buffer.position_scale, vertex_buffer.position_bias = (
+            _quantize(columns[:3])
+        )
+        vertex_buffer.positions = reader.add_object(positions)
+        columns = columns[3:]
+        vertex_buffer.normals = 0
+        if has_normals:
+            normals = [
+                [max(-32767, min(32767, round(value * 32767))) for value in column]
+                for column in columns[:3]
+            ]
+            vertex_buffer.normals = reader.add_object(_vertex_array("h", normals))
+            columns = columns[3:]
+        vertex_buffer.colors = 0
+        if isinstance(colors, tuple):
+            vertex_buffer.default_color = colors
+        else:
+            color_array = _vertex_array("b", columns[:colors])
+            vertex_buffer.colors = reader.add_object(color_array)
+            columns = columns[colors:]
+        vertex_buffer.tex_coords = []
+        vertex_buffer.tex_coord_scale = []
+        vertex_buffer.tex_coord_bias = []
+        for count in tex_components:
+            tex_coords, scale, bias = _quantize(columns[:count])
+            vertex_buffer.tex_coords.append(reader.add_object(tex_coords))
+            vertex_buffer.tex_coord_scale.append(scale)
+            vertex_buffer.tex_coord_bias.append(bias)
+            columns = columns[count:]
+        vertex_buffer.texcoord_array_count = len(tex_components)
+
+        mesh = Mesh()
+        mesh.alpha_factor = alpha
+        mesh.scope = scope
+        mesh.has_component_transform = False
+        mesh.has_general_transform = False
+        mesh.has_alignment = False
+        mesh.vertex_buffer = reader.add_object(vertex_buffer)
+        for state, triangles in self.triangles.items():
+            strips = build_strips(triangles)
+            strip_array = make_strip_array([stitch_strips(strips)])
+            mesh.index_buffer.append(reader.add_object(strip_array))
+            mesh.appearance.append(state)
+        mesh.submesh_count = len(mesh.index_buffer)
+        return reader.add_object(mesh)
+
+
+def _merge_static(reader, root, order):
+    """
+    Merge the static meshes below one root Group. Returns the ids of the merged
+    meshes and the new mesh ids.
+    """
+    nodes = scene_nodes(reader, [root])
+    referenced = _external_references(reader)
+    dynamic = _dynamic_nodes(reader, [root], referenced)
+    to_root = inverse(nodes[root].matrix)
+    root_alpha = nodes[root].alpha
+    parents = {}
+    for node_id, scene_node in nodes.items():
+        for child in node_children(scene_node.node):
+            parents.setdefault(child, node_id)
+
+    formats = {}
+    for node_id, scene_node in nodes.items():
+        mesh = scene_node.node
+        if (
+            type(mesh) is not Mesh
+            or node_id in dynamic
+            or not scene_node.visible
+            or not isinstance(reader.get_object_by_id(parents.get(node_id)), Group)
+            or not root_alpha
+        ):
+            continue
+        vertex_format = _vertex_format(
+            reader, reader.get_object_by_id(mesh.vertex_buffer)
+        )
+        appearances = [
+            reader.get_object_by_id(app_id)
+            for index_id, app_id in zip(mesh.index_buffer, mesh.appearance)
+            if index_id
+        ]
+        if vertex_format is None or any(
+            isinstance(appearance, Appearance) and _is_blended(reader, appearance)
+            for appearance in appearances
+        ):
+            continue
+        key = (vertex_format, scene_node.alpha / root_alpha, mesh.scope)
+        formats.setdefault(key, []).append(node_id)
+
+    merged = []
+    created = []
+    rank = {call: position for position, call in enumerate(order)}
+    for (vertex_format, alpha, scope), mesh_ids in formats.items():
+        submeshes = []
+        for mesh_id in mesh_ids:
+            mesh = nodes[mesh_id].node
+            for submesh, (index_id, app_id) in enumerate(
+                zip(mesh.index_buffer, mesh.appearance)
+            ):
+                if index_id and app_id:
+                    position = rank.get((mesh_id, submesh, app_id), len(rank))
+                    submeshes.append((position, mesh_id, index_id, app_id))
+        if len(submeshes) < 2:
+            continue
+        submeshes.sort()
+        batch = _Batch(vertex_format)
+        columns = {}
+        for _, mesh_id, index_id, app_id in submeshes:
+            matrix = multiply(to_root, nodes[mesh_id].matrix)
+            if mesh_id not in columns:
+                columns[mesh_id] = _mesh_columns(reader, nodes[mesh_id].node, matrix)
+            triangles = strip_triangles(reader.get_object_by_id(index_id))
+            if not batch.room(mesh_id, triangles):
+                created.append(batch.build(reader, alpha, scope))
+                batch = _Batch(vertex_format)
+            # Baking the transform into the vertices keeps the winding on
+            # screen, so mirrored meshes need no flip.
+            batch.add(app_id, mesh_id, columns[mesh_id], triangles)
+        created.append(batch.build(reader, alpha, scope))
+        merged += mesh_ids
+
+    root_node = reader.get_object_by_id(root)
+    for mesh_id in merged:
+        parent = reader.get_object_by_id(parents[mesh_id])
+        parent.children = [child for child in parent.children if child != mesh_id]
+    root_node.children = list(root_node.children) + created
+    return merged, created
+
+
+def _geometry(reader, mesh):
+    """Returns the ids of the vertex buffer, arrays and strips of a mesh"""
+    ids = [mesh.vertex_buffer] + list(mesh.index_buffer)
+    vertex_buffer = reader.get_object_by_id(mesh.vertex_buffer)
+    if isinstance(vertex_buffer, VertexBuffer):
+        ids += [vertex_buffer.positions, vertex_buffer.normals, vertex_buffer.colors]
+        ids += vertex_buffer.tex_coords
+    return [
+        obj_id
+        for obj_id in ids
+        if obj_id and not getattr(reader.get_object_by_id(obj_id), "user_id", 0)
+    ]
+
+
+def batch_meshes(reader, world=None, merge=True, compact=True):
+    """
+    Batch the draw calls of a scene below a World (the file's first World by
+    default, or all root Groups if there is none): canonicalize appearances,
+    then with merge replace the static meshes of each vertex format with merged
+    meshes, added as children of the root, that have one submesh per render
+    state. Replaced meshes are detached from the scene graph and the new
+    objects are appended to the file.
+
+    With compact, the new objects are moved in front of the root that uses them
+    and the replaced meshes are removed, along with the vertex buffers, arrays
+    and strips nothing else uses anymore (see layout.compact_objects). This
+    renumbers the objects; without it the new meshes stay forward references.
+
+    Returns a report dict with the draw call and state change counts before
+    and after, the number of duplicate appearances, the merged mesh ids (as
+    they were before compacting), the created mesh ids and under "ids" the
+    mapping of old to new object ids (None if not compacted).
+    """
+    before = draw_order(reader, world)
+    remap = canonicalize_appearances(reader)
+    merged, created = [], []
+    if merge:
+        order = draw_order(reader, world)
+        for root in _scene_roots(reader, world):
+            if isinstance(reader.get_object_by_id(root), Group):
+                root_merged, root_created = _merge_static(reader, root, order)
+                merged += root_merged
+                created += root_created
+    ids = None
+    if compact and merged:
+        dropped = list(merged)
+        for mesh_id in merged:
+            dropped += _geometry(reader, reader.get_object_by_id(mesh_id))
+        ids = compact_objects(reader, dropped)
+        created = [ids[mesh_id] for mesh_id in created]
+        if world:
+            world = ids[world]
+    after = draw_order(reader, world)
+    return {
+        "draw_calls_before": len(before),
+        "draw_calls_after": len(after),
+        "state_changes_before": state_changes(before),
+        "state_changes_after": state_changes(after),
+        "duplicate_appearances": len(remap),
+        "merged_meshes": merged,
+        "created_meshes": created,
+        "ids": ids,
+    }
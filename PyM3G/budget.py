@@ -0,0 +1,182 @@
+"""
+A memory budget for the bulk payloads of parsed files
+
+The Payload fields of objects (VertexArray.vertices, Image2D.palette and
+pixels, TriangleStripArray.indices, KeyframeSequence.time and vector_value)
+usually take almost all of the memory of a parsed file, but are rarely used.
+A PayloadBudget given to one or more M3GReaders tracks these objects with the
+section and offset they were read from. When the tracked payloads take more
+than limit bytes, those of the least recently used objects are dropped, while
+all other fields stay in memory. Reading a dropped field decodes the object
+from the source file again and puts its payloads back.
+
+Payloads that were set or changed in place are never dropped, as the file no
+longer holds their value. Files with Fishlabs obfuscation are not tracked.
+"""
+
+from collections import OrderedDict
+from os import stat
+from threading import RLock
+import weakref
+import zlib
+
+from PyM3G.schema import EVICTED, payload_fields
+
+
+class PayloadSource:
+    """The file the tracked objects of a reader were read from"""
+
+    def __init__(self, path, sections):
+        self.path = path
+        self.sections = list(sections)
+        info = stat(path)
+        self.signature = (info.st_size, info.st_mtime_ns)
+
+    def read(self, section, start, size):
+        """Returns the data of the object at an offset of a section"""
+        info = stat(self.path)
+        if (info.st_size, info.st_mtime_ns) != self.signature:
+            raise ValueError(f"{self.path} changed since it was read")
+        offset, compression, length = self.sections[section]
+        with open(self.path, "rb") as file:
+            if compression == 0:
+                file.seek(offset + start)
+                return file.read(size)
+            file.seek(offset)
+            data = file.read(length)
+        return zlib.decompressobj().decompress(data, start + size)[start:]
+
+
+def payload_size(value):
+    """Returns the size in bytes of a payload value (a typed array or bytes)"""
+    if hasattr(value, "itemsize"):
+        return len(value) * value.itemsize
+    return len(value)
+
+
+def object_payload_size(obj):
+    """Returns the size in bytes of the payloads of an object held in memory"""
+    return sum(
+        payload_size(value)
+        for value in (obj.__dict__.get(name) for name in payload_fields(type(obj)))
+        if value is not None and value is not EVICTED
+    )
+
+
+def _checksum(values):
+    crc = 0
+    for value in values:
+        crc = zlib.crc32(value, crc)
+    return crc
+
+
+class PayloadBudget:
+    """
+    Keeps the tracked payloads within limit bytes (see the module docstring).
+    evictions and reloads count the objects whose payloads were dropped and
+    read back, resident the bytes of tracked payloads in memory.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.resident = 0
+        self.evictions = 0
+        self.reloads = 0
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def source(self, reader):
+        """Returns the PayloadSource of the file a reader is reading"""
+        return PayloadSource(reader.path, reader.sections)
+
+    def track(self, obj, source, section, start, size):
+        """Start tracking the payloads of an object read from a source"""
+        names = payload_fields(type(obj))
+        if not names:
+            return
+        values = [obj.__dict__.get(name, b"") for name in names]
+        nbytes = sum(payload_size(value) for value in values)
+        if not nbytes:
+            return
+        obj.__dict__["_budget"] = self
+        obj.__dict__["_payload"] = (source, section, start, size, _checksum(values))
+        with self._lock:
+            self._add(obj, nbytes)
+            self._shrink(id(obj))
+
+    def _add(self, obj, nbytes):
+        key = id(obj)
+
+        def forget(ref):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] is ref:
+                    del self._entries[key]
+                    self.resident -= entry[1]
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.resident -= old[1]
+        self._entries[key] = (weakref.ref(obj, forget), nbytes)
+        self.resident += nbytes
+
+    def _shrink(self, keep):
+        """Drop the least recently used payloads until they fit the limit"""
+        for key in list(self._entries):
+            if self.resident <= self.limit:
+                break
+            if key == keep:
+                continue
+            ref, nbytes = self._entries.pop(key)
+            self.resident -= nbytes
+            obj = ref()
+            if obj is None:
+                continue
+            names = payload_fields(type(obj))
+            values = [obj.__dict__[name] for name in names]
+            if _checksum(values) != obj.__dict__["_payload"][4]:
+                self._untrack(obj)
+                continue
+            for name in names:
+                obj.__dict__[name] = EVICTED
+            self.evictions += 1
+
+    def _reload(self, obj):
+        source, section, start, size, _ = obj.__dict__["_payload"]
+        fresh = type(obj)()
+        fresh.decode(source.read(section, start, size))
+        names = payload_fields(type(obj))
+        for name in names:
+            obj.__dict__[name] = fresh.__dict__[name]
+        self.reloads += 1
+        return sum(payload_size(obj.__dict__[name]) for name in names)
+
+    def _untrack(self, obj):
+        """Reload the payloads of an object if dropped and stop tracking it"""
+        if any(obj.__dict__[name] is EVICTED for name in payload_fields(type(obj))):
+            self._reload(obj)
+        del obj.__dict__["_budget"]
+        del obj.__dict__["_payload"]
+
+    def use(self, obj, name):
+        """Returns a payload field of an object, reloading it if it was dropped"""
+        with self._lock:
+            key = id(obj)
+            if obj.__dict__[name] is EVICTED:
+                self._add(obj, self._reload(obj))
+                self._shrink(key)
+            else:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0]() is obj:
+                    self._entries.move_to_end(key)
+            return obj.__dict__[name]
+
+    def release(self, obj):
+        """Stop tracking an object whose payloads are about to change"""
+        with self._lock:
+            key = id(obj)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]() is obj:
+                del self._entries[key]
+                self.resident -= entry[1]
+            self._untrack(obj)
@@ -0,0 +1,434 @@
+"""
+Quadric error mesh decimation for generating levels of detail
+
+Triangles are simplified with half-edge collapses ordered by quadric error
+(Garland and Heckbert, "Surface Simplification Using Quadric Error Metrics",
+1997) through a lazy heap, so a run takes O(n log n) time. A collapse moves a
+vertex onto a neighbor's position and index, so surviving vertices keep all
+their original attributes.
+
+Vertices with the same position but different attributes (seams between UV
+islands or hard edges), open borders and edges between submeshes are
+constrained: they get extra quadrics that keep them in place, a vertex on such
+an edge may only collapse along it, and a vertex where more than two meet
+never moves. A collapse is rejected if it would flip a triangle, make the
+surface non-manifold or leave a seam vertex without a matching attribute copy.
+"""
+
+from array import array
+from copy import deepcopy
+from heapq import heappop, heappush
+from math import sqrt
+from operator import add
+
+from PyM3G.geometry import gather, scaled_columns, strip_triangles, vertex_attributes
+from PyM3G.vertex_cache import build_strips, make_strip_array, stitch_strips, tipsify
+
+from PyM3G.objects.morphing_mesh import MorphingMesh
+from PyM3G.objects.skinned_mesh import SkinnedMesh
+from PyM3G.objects.vertex_array import VertexArray
+
+BOUNDARY_WEIGHT = 10.0
+# Among collapses of (nearly) equal error, such as in flat regions, favors short
+# edges between vertices of low valence so no vertex collects a large fan
+LENGTH_WEIGHT = 1e-4
+
+
+def _plane_quadric(p, q, r, weight=1.0):
+    """Returns the quadric of the plane through three points, or None"""
+    ux, uy, uz = q[0] - p[0], q[1] - p[1], q[2] - p[2]
+    vx, vy, vz = r[0] - p[0], r[1] - p[1], r[2] - p[2]
+    a, b, c = uy * vz - uz * vy, uz * vx - ux * vz, ux * vy - uy * vx
+    length = sqrt(a * a + b * b + c * c)
+    if length == 0.0:
+        return None
+    a, b, c = a / length, b / length, c / length
+    d = -(a * p[0] + b * p[1] + c * p[2])
+    w = weight
+    return [
+        w * a * a, w * a * b, w * a * c, w * a * d, w * b * b,
+        w * b * c, w * b * d, w * c * c, w * c * d, w * d * d,
+    ]  # fmt: skip
+
+
+def _quadric_error(q, p):
+    x, y, z = p
+    return (
+        q[0] * x * x + 2 * q[1] * x * y + 2 * q[2] * x * z + 2 * q[3] * x
+        + q[4] * y * y + 2 * q[5] * y * z + 2 * q[6] * y
+        + q[7] * z * z + 2 * q[8] * z + q[9]
+    )  # fmt: skip
+
+
+def _distance2(p, q):
+    return (p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 + (p[2] - q[2]) ** 2
+
+
+def _normal(p, q, r):
+    ux, uy, uz = q[0] - p[0], q[1] - p[1], q[2] - p[2]
+    vx, vy, vz = r[0] - p[0], r[1] - p[1], r[2] - p[2]
+    return (uy * vz - uz * vy, uz * vx - ux * vz, ux * vy - uy * vx)
+
+
+class Decimator:
+    """
+    Simplifies an indexed triangle list. points holds one (x, y, z) position per
+    vertex index, groups one submesh number per triangle. Collapses are applied
+    by run, which can be called repeatedly with smaller targets to produce
+    successive levels of detail.
+    """
+
+    def __init__(self, points, triangles, groups=None):
+        ids = {}
+        self.position_of = [ids.setdefault(tuple(p), len(ids)) for p in points]
+        self.positions = list(ids)
+        count = len(self.positions)
+        position_of = self.position_of
+        self.corners = []
+        self.groups = []
+        self.alive = []
+        self.triangles_of = [set() for _ in range(count)]
+        self.adjacent = [{} for _ in range(count)]
+        for tri in range(len(triangles) // 3):
+            corners = list(triangles[tri * 3 : tri * 3 + 3])
+            a, b, c = (position_of[index] for index in corners)
+            if a == b or b == c or a == c:
+                continue
+            tri_id = len(self.corners)
+            self.corners.append(corners)
+            self.groups.append(groups[tri] if groups is not None else 0)
+            self.alive.append(True)
+            for pos in (a, b, c):
+                self.triangles_of[pos].add(tri_id)
+            self._link(a, b, c, 1)
+        self.live = len(self.corners)
+        self.dead = bytearray(count)
+        self.version = array("I", bytes(4 * count))
+        self.error = 0.0
+        self._build_quadrics()
+        self.own_error = [
+            _quadric_error(quadric, point)
+            for quadric, point in zip(self.quadrics, self.positions)
+        ]
+        self.heap = []
+        for pos in range(count):
+            self._push(pos)
+
+    def _build_quadrics(self):
+        """Plane quadrics per position plus penalty planes along constrained edges"""
+        positions = self.positions
+        position_of = self.position_of
+        planes = [
+            _plane_quadric(*(positions[position_of[index]] for index in corners))
+            for corners in self.corners
+        ]
+        zero = [0.0] * 10
+        self.quadrics = [
+            [sum(column) for column in zip(zero, *(planes[t] or zero for t in tris))]
+            for tris in self.triangles_of
+        ]
+        wedges = [set() for _ in positions]
+        groups = [set() for _ in positions]
+        for corners, group in zip(self.corners, self.groups):
+            for index in corners:
+                wedges[position_of[index]].add(index)
+                groups[position_of[index]].add(group)
+        # Only edges between two positions with several attribute copies or
+        # submeshes can be seams or submesh boundaries
+        special = [len(w) > 1 or len(g) > 1 for w, g in zip(wedges, groups)]
+        self.constrained = [set() for _ in positions]
+        self.locked = bytearray(len(positions))
+        for a, edges in enumerate(self.adjacent):
+            for b, count in edges.items():
+                if b < a or (count == 2 and not (special[a] and special[b])):
+                    continue
+                uses = sorted(self.triangles_of[a] & self.triangles_of[b])
+                if count == 2 and self._same_sides(a, b, *uses):
+                    continue
+                if count > 2:
+                    self.locked[a] = self.locked[b] = 1
+                self.constrained[a].add(b)
+                self.constrained[b].add(a)
+                for tri_id in uses:
+                    self._add_edge_quadric(a, b, tri_id)
+        for pos, neighbors in enumerate(self.constrained):
+            if len(neighbors) not in (0, 2):
+                self.locked[pos] = 1
+
+    def _same_sides(self, a, b, first, second):
+        """Returns whether an edge has the same attributes and submesh on both sides"""
+        if self.groups[first] != self.groups[second]:
+            return False
+        position_of = self.position_of
+        sides = []
+        for tri_id in (first, second):
+            ends = {position_of[index]: index for index in self.corners[tri_id]}
+            sides.append((ends[a], ends[b]))
+        return sides[0] == sides[1]
+
+    def _add_edge_quadric(self, a, b, tri_id):
+        """Add a plane through an edge, perpendicular to a triangle, to its ends"""
+        positions = self.positions
+        normal = _normal(
+            *(positions[self.position_of[index]] for index in self.corners[tri_id])
+        )
+        pa, pb = positions[a], positions[b]
+        pc = (pa[0] + normal[0], pa[1] + normal[1], pa[2] + normal[2])
+        quadric = _plane_quadric(pa, pb, pc, BOUNDARY_WEIGHT)
+        if quadric is not None:
+            for pos in (a, b):
+                self.quadrics[pos] = list(map(add, self.quadrics[pos], quadric))
+
+    def _link(self, a, b, c, delta):
+        """Add delta to the triangle counts of the edges of a triangle"""
+        adjacent = self.adjacent
+        for p, q in ((a, b), (b, c), (c, a), (b, a), (c, b), (a, c)):
+            edges = adjacent[p]
+            count = edges.get(q, 0) + delta
+            if count:
+                edges[q] = count
+            else:
+                del edges[q]
+
+    def _push(self, pos):
+        """Push the cheapest collapse of a position onto the heap"""
+        if self.dead[pos] or self.locked[pos]:
+            return
+        targets = self.constrained[pos] or self.adjacent[pos]
+        if not targets:
+            return
+        positions = self.positions
+        own_error = self.own_error
+        q0, q1, q2, q3, q4, q5, q6, q7, q8, q9 = self.quadrics[pos]
+        px, py, pz = positions[pos]
+        adjacent = self.adjacent
+        valence = len(adjacent[pos])
+        best, best_target = None, None
+        for target in targets:
+            x, y, z = positions[target]
+            cost = (
+                x * (q0 * x + 2 * (q1 * y + q2 * z + q3))
+                + y * (q4 * y + 2 * (q5 * z + q6))
+                + z * (q7 * z + 2 * q8)
+                + q9
+                + own_error[target]
+                + LENGTH_WEIGHT
+                * ((x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2)
+                * (valence + len(adjacent[target]))
+            )
+            if best is None or cost < best:
+                best, best_target = cost, target
+        heappush(self.heap, (best, pos, best_target, self.version[pos]))
+
+    def _error(self, u, v):
+        """Returns the quadric error of collapsing u onto v"""
+        return _quadric_error(self.quadrics[u], self.positions[v]) + self.own_error[v]
+
+    def _plan(self, u, v):
+        """
+        Returns the wedge remap and the surviving triangles of collapsing u onto
+        v, or None if the collapse is not allowed
+        """
+        position_of = self.position_of
+        corners = self.corners
+        positions = self.positions
+        mapping = {}
+        shared = []
+        others = []
+        opposite = set()
+        for tri_id in self.triangles_of[u]:
+            tri = corners[tri_id]
+            pos = [position_of[index] for index in tri]
+            if v in pos:
+                wu = tri[pos.index(u)]
+                wv = tri[pos.index(v)]
+                if mapping.setdefault(wu, wv) != wv:
+                    return None
+                shared.append(tri_id)
+                opposite.update(pos)
+            else:
+                others.append(tri_id)
+        if not shared:
+            return None
+        opposite.discard(u)
+        opposite.discard(v)
+        if self.adjacent[u].keys() & self.adjacent[v].keys() != opposite:
+            return None
+        target = positions[v]
+        for tri_id in others:
+            tri = corners[tri_id]
+            pos = [position_of[index] for index in tri]
+            side = pos.index(u)
+            if tri[side] not in mapping:
+                return None
+            points = [positions[p] for p in pos]
+            before = _normal(*points)
+            points[side] = target
+            after = _normal(*points)
+            if sum(a * b for a, b in zip(before, after)) <= 0.0:
+                return None
+        return mapping, shared, others
+
+    def _collapse(self, u, v, plan):
+        mapping, shared, others = plan
+        position_of = self.position_of
+        former = [pos for pos in self.adjacent[u] if pos != v]
+        for tri_id in shared:
+            self.alive[tri_id] = False
+            self.live -= 1
+            pos = [position_of[index] for index in self.corners[tri_id]]
+            for p in pos:
+                self.triangles_of[p].discard(tri_id)
+            self._link(*pos, -1)
+        for tri_id in others:
+            tri = self.corners[tri_id]
+            self._link(*(position_of[index] for index in tri), -1)
+            for side, index in enumerate(tri):
+                if position_of[index] == u:
+                    tri[side] = mapping[index]
+            self._link(*(position_of[index] for index in tri), 1)
+            self.triangles_of[v].add(tri_id)
+        self.triangles_of[u] = set()
+        self.dead[u] = 1
+        self.quadrics[v] = list(map(add, self.quadrics[v], self.quadrics[u]))
+        self.own_error[v] = _quadric_error(self.quadrics[v], self.positions[v])
+        for other in self.constrained[u]:
+            self.constrained[other].discard(u)
+            if other != v:
+                self.constrained[other].add(v)
+                self.constrained[v].add(other)
+        self.constrained[u] = set()
+        # Costs towards v only grew, which run notices when popping them, but
+        # the former neighbors of u lost a candidate and gained v
+        for pos in (v, *former):
+            self.version[pos] += 1
+            self._push(pos)
+
+    def run(self, target_triangles=0, max_error=None):
+        """
+        Collapse edges until at most target_triangles remain or the next
+        collapse would exceed max_error, the root of the summed squared distances
+        to the original planes. Returns the current triangle count.
+        """
+        heap = self.heap
+        limit = None if max_error is None else max_error * max_error
+        while self.live > target_triangles and heap:
+            cost, u, v, version = heap[0]
+            if limit is not None and cost > limit:
+                break
+            heappop(heap)
+            if version != self.version[u] or self.dead[u] or self.dead[v]:
+                continue
+            error = self._error(u, v)
+            actual = error + LENGTH_WEIGHT * _distance2(
+                self.positions[u], self.positions[v]
+            ) * (len(self.adjacent[u]) + len(self.adjacent[v]))
+            if heap and actual > cost and actual > heap[0][0]:
+                heappush(heap, (actual, u, v, version))
+                continue
+            plan = self._plan(u, v)
+            if plan is None:
+                continue
+            self.error = max(self.error, sqrt(max(error, 0.0)))
+            self._collapse(u, v, plan)
+        return self.live
+
+    def triangles(self):
+        """Returns the surviving triangles as a flat list and their groups"""
+        triangles = array("I")
+        groups = []
+        for tri_id, alive in enumerate(self.alive):
+            if alive:
+                triangles.extend(self.corners[tri_id])
+                groups.append(self.groups[tri_id])
+        return triangles, groups
+
+
+def _compact(reader, vertex_buffer, triangles):
+    """
+    Add VertexArrays holding only the vertices a triangle list uses, in order of
+    first use, and return a VertexBuffer copy using them and the remapped list
+    """
+    used = list(dict.fromkeys(triangles))
+    remap = {index: new for new, index in enumerate(used)}
+    copy = deepcopy(vertex_buffer)
+    for slot, old in vertex_attributes(reader, vertex_buffer):
+        width = old.component_count
+        rows = [old.vertices[i * width : i * width + width] for i in used]
+        new = VertexArray()
+        new.component_size = old.component_size
+        new.component_count = width
+        new.encoding = 0
+        new.vertex_count = len(used)
+        new.vertices = array(old.vertices.typecode)
+        for row in rows:
+            new.vertices.extend(row)
+        va_id = reader.add_object(new)
+        if isinstance(slot, tuple):
+            copy.tex_coords[slot[1]] = va_id
+        else:
+            setattr(copy, slot, va_id)
+    return copy, array("I", gather(remap, triangles)), len(used)
+
+
+def decimate_mesh(reader, mesh_id, ratios=(0.5, 0.25, 0.125), max_error=None):
+    """
+    Generate levels of detail of a Mesh, one per ratio of its triangle count
+    (largest first), in one simplification run. max_error stops the run early.
+
+    Every level is added to the reader as a copy of the Mesh with its own
+    compacted VertexArrays, VertexBuffer and TriangleStripArrays; the copies are
+    not attached to the scene graph. Skinned and morphing meshes are rejected
+    since their bone ranges and morph targets depend on the vertex order.
+
+    Returns one report dict per level with the new mesh id, triangle and vertex
+    counts and the largest collapse error.
+    """
+    mesh = reader.get_object_by_id(mesh_id)
+    if isinstance(mesh, (SkinnedMesh, MorphingMesh)):
+        raise ValueError(f"Mesh {mesh_id} is a skinned or morphing mesh")
+    vertex_buffer = reader.get_object_by_id(mesh.vertex_buffer)
+    positions = reader.get_object_by_id(vertex_buffer.positions)
+    xs, ys, zs = scaled_columns(
+        positions, vertex_buffer.position_scale, vertex_buffer.position_bias
+    )
+    triangles = array("I")
+    groups = []
+    for submesh, index_id in enumerate(mesh.index_buffer):
+        strip_array = reader.get_object_by_id(index_id)
+        if strip_array is None:
+            continue
+        submesh_triangles = strip_triangles(strip_array)
+        triangles.extend(submesh_triangles)
+        groups += [submesh] * (len(submesh_triangles) // 3)
+    decimator = Decimator(list(zip(xs, ys, zs)), triangles, groups)
+    reports = []
+    for ratio in sorted(ratios, reverse=True):
+        target = int(len(triangles) // 3 * ratio)
+        decimator.run(target, max_error)
+        lod_triangles, lod_groups = decimator.triangles()
+        lod_buffer, remapped, vertex_count = _compact(
+            reader, vertex_buffer, lod_triangles
+        )
+        lod = deepcopy(mesh)
+        lod.vertex_buffer = reader.add_object(lod_buffer)
+        for submesh in range(len(mesh.index_buffer)):
+            submesh_triangles = array("I")
+            for tri, group in enumerate(lod_groups):
+                if group == submesh:
+                    submesh_triangles.extend(remapped[tri * 3 : tri * 3 + 3])
+            ordered = tipsify(submesh_triangles, vertex_count)
+            strips = build_strips(ordered)
+            strip_array = make_strip_array([stitch_strips(strips)] if strips else [])
+            lod.index_buffer[submesh] = reader.add_object(strip_array)
+        reports.append(
+            {
+                "mesh": reader.add_object(lod),
+                "ratio": ratio,
+                "triangles_before": len(triangles) // 3,
+                "triangles_after": len(lod_triangles) // 3,
+                "vertices_after": vertex_count,
+                "error": decimator.error,
+            }
+        )
+    return reports
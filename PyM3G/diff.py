@@ -0,0 +1,465 @@
+"""
+Structural diff of two M3G files
+
+Every object gets two fingerprints: a local one, hashing its type and encoded
+fields with all references zeroed (so bulk payloads are hashed as the buffers
+they are written from), and a deep one that also covers the deep fingerprints
+of the objects it references. Objects are matched across the files even when
+their ids shift:
+
+1. objects with equal deep fingerprints are unchanged, along with everything
+   they reference;
+2. then objects with equal local fingerprints are paired;
+3. every pair found is put on a worklist, which follows its references field
+   by field and its unmatched referrers upward, pairing referrers whose
+   references all matched the same objects, or else the only referrer of a
+   type left on each side;
+4. finally objects of a type that is left unmatched only once on each side
+   are paired.
+
+Steps 1 and 2 first only pair keys held by a single unmatched object on each
+side, so copies of equal objects are told apart by where they are used, and
+then pair the keys shared by several objects in file order.
+
+Every step hashes or visits each object and reference a constant number of
+times, so a diff costs about as much as reading the two files. Objects left
+over are reported as added or removed, and matched objects that differ get a
+field by field report.
+"""
+
+from argparse import ArgumentParser
+from array import array
+from copy import copy
+from hashlib import blake2b
+import json
+from operator import ne
+import sys
+
+from PyM3G.reader import M3GReader
+from PyM3G.schema import reference_fields
+from PyM3G.util import obj2str
+
+from PyM3G.objects.header import Header
+from PyM3G.objects.placeholder import Placeholder
+
+
+def _references(obj):
+    if obj is None or isinstance(obj, Placeholder):
+        return []
+    return [ref for ref in obj.references() if ref]
+
+
+def local_fingerprint(obj):
+    """Returns a hash of an object's type and fields, ignoring what it references"""
+    digest = blake2b(type(obj).__name__.encode(), digest_size=16)
+    if obj is None or isinstance(obj, Placeholder):
+        return digest.digest()
+    refs = obj.references()
+    if refs:
+        obj = copy(obj)
+        obj.remap_references({ref: 0 for ref in refs})
+    digest.update(obj.encode())
+    return digest.digest()
+
+
+class Fingerprints:
+    """
+    The local and deep fingerprints, references and referrers of all objects
+    of a file
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.local = [local_fingerprint(obj) for obj in objects]
+        self.refs = [_references(obj) for obj in objects]
+        self.users = [[] for _ in objects]
+        for obj_id, refs in enumerate(self.refs, 1):
+            for ref in dict.fromkeys(refs):
+                if 0 < ref <= len(objects) and ref != obj_id:
+                    self.users[ref - 1].append(obj_id)
+        self.deep = [None] * len(objects)
+        for obj_id in range(1, len(objects) + 1):
+            self._deep(obj_id)
+
+    def _deep(self, obj_id):
+        """Hash an object after the objects it references, without recursion"""
+        stack = [obj_id]
+        while stack:
+            index = stack[-1] - 1
+            if self.deep[index] is None:
+                # Marks the object while its references are hashed, ending cycles
+                self.deep[index] = self.local[index]
+                stack.extend(
+                    ref
+                    for ref in self.refs[index]
+                    if 0 < ref <= len(self.objects) and self.deep[ref - 1] is None
+                )
+                continue
+            stack.pop()
+            if self.deep[index] is not self.local[index]:
+                continue
+            digest = blake2b(self.local[index], digest_size=16)
+            for ref in self.refs[index]:
+                if 0 < ref <= len(self.objects):
+                    digest.update(self.deep[ref - 1])
+                else:
+                    digest.update(ref.to_bytes(4, "little"))
+            self.deep[index] = digest.digest()
+
+    def type_name(self, obj_id):
+        """Returns the class name of an object"""
+        return type(self.objects[obj_id - 1]).__name__
+
+
+class Matcher:
+    """Pairs the object ids of an old and a new file"""
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.forward = {}
+        self.backward = {}
+
+    def pair(self, old_id, new_id):
+        """Record a match, returns whether both objects were still free"""
+        if old_id in self.forward or new_id in self.backward:
+            return False
+        if self.old.type_name(old_id) != self.new.type_name(new_id):
+            return False
+        self.forward[old_id] = new_id
+        self.backward[new_id] = old_id
+        return True
+
+    def _pair_by(self, key_of_old, key_of_new, unique=False):
+        """
+        Pair unmatched objects with equal keys, in file order. With unique only
+        keys held by a single unmatched object on each side are paired.
+        """
+        candidates = {}
+        for new_id in range(1, len(self.new.objects) + 1):
+            if new_id not in self.backward:
+                key = key_of_new(new_id)
+                if key is not None:
+                    candidates.setdefault(key, []).append(new_id)
+        for key in candidates:
+            candidates[key].reverse()
+        if unique:
+            counts = {}
+            for old_id in range(1, len(self.old.objects) + 1):
+                if old_id not in self.forward:
+                    key = key_of_old(old_id)
+                    counts[key] = counts.get(key, 0) + 1
+            candidates = {
+                key: found
+                for key, found in candidates.items()
+                if len(found) == 1 and counts.get(key) == 1
+            }
+        paired = []
+        for old_id in range(1, len(self.old.objects) + 1):
+            if old_id in self.forward:
+                continue
+            key = key_of_old(old_id)
+            found = candidates.get(key) if key is not None else None
+            while found:
+                new_id = found.pop()
+                if self.pair(old_id, new_id):
+                    paired.append(old_id)
+                    break
+        return paired
+
+    def _settle(self, pending):
+        """
+        Pair the neighbours of matched objects from a worklist of old ids:
+        references field by field, and unmatched referrers by their matched
+        references or, failing that, by type when only one referrer of that
+        type is left on each side
+        """
+        while pending:
+            old_id = pending.pop()
+            new_id = self.forward[old_id]
+            old_refs = self.old.refs[old_id - 1]
+            new_refs = self.new.refs[new_id - 1]
+            for old_ref, new_ref in zip(old_refs, new_refs):
+                if not (0 < old_ref <= len(self.old.objects)):
+                    continue
+                if not (0 < new_ref <= len(self.new.objects)):
+                    continue
+                if self.pair(old_ref, new_ref):
+                    pending.append(old_ref)
+            pending.extend(self._pair_referrers(old_id, new_id))
+
+    def _pair_referrers(self, old_id, new_id):
+        """Pair the unmatched referrers of a matched pair, returns the paired"""
+        old_users = [u for u in self.old.users[old_id - 1] if u not in self.forward]
+        new_users = [u for u in self.new.users[new_id - 1] if u not in self.backward]
+        if not old_users or not new_users:
+            return []
+        paired = []
+        by_refs = {}
+        for user in new_users:
+            key = self._new_refs_key(user)
+            if key is not None:
+                by_refs.setdefault(key, []).append(user)
+        for user in old_users:
+            for candidate in by_refs.get(self._old_refs_key(user), ()):
+                if self.pair(user, candidate):
+                    paired.append(user)
+                    break
+        old_types = {}
+        for user in old_users:
+            if user not in self.forward:
+                old_types.setdefault(self.old.type_name(user), []).append(user)
+        new_types = {}
+        for user in new_users:
+            if user not in self.backward:
+                new_types.setdefault(self.new.type_name(user), []).append(user)
+        for name, users in old_types.items():
+            if len(users) == 1 and len(new_types.get(name, ())) == 1:
+                if self.pair(users[0], new_types[name][0]):
+                    paired.append(users[0])
+        return paired
+
+    def _old_refs_key(self, obj_id):
+        """The type and the new ids of the references of an old object"""
+        refs = self.old.refs[obj_id - 1]
+        mapped = tuple(self.forward.get(ref) for ref in refs)
+        if not refs or None in mapped:
+            return None
+        return (self.old.type_name(obj_id), mapped)
+
+    def _new_refs_key(self, obj_id):
+        """The type and the references of a new object whose references matched"""
+        refs = self.new.refs[obj_id - 1]
+        if not refs or not all(ref in self.backward for ref in refs):
+            return None
+        return (self.new.type_name(obj_id), tuple(refs))
+
+    def _pair_unique_types(self):
+        """Pair the objects of types left unmatched once on each side"""
+        old_types = {}
+        for old_id in range(1, len(self.old.objects) + 1):
+            if old_id not in self.forward:
+                old_types.setdefault(self.old.type_name(old_id), []).append(old_id)
+        new_types = {}
+        for new_id in range(1, len(self.new.objects) + 1):
+            if new_id not in self.backward:
+                new_types.setdefault(self.new.type_name(new_id), []).append(new_id)
+        paired = []
+        for name, ids in old_types.items():
+            if len(ids) == 1 and len(new_types.get(name, ())) == 1:
+                if self.pair(ids[0], new_types[name][0]):
+                    paired.append(ids[0])
+        return paired
+
+    def match(self):
+        """Match all objects, returns the dict of old id to new id"""
+        old, new = self.old, self.new
+        pending = []
+        for old_id, new_id in zip(
+            _ids_of(old.objects, Header), _ids_of(new.objects, Header)
+        ):
+            if self.pair(old_id, new_id):
+                pending.append(old_id)
+        self._settle(pending)
+        deep = (lambda i: old.deep[i - 1], lambda i: new.deep[i - 1])
+        local = (
+            lambda i: (old.type_name(i), old.local[i - 1]),
+            lambda i: (new.type_name(i), new.local[i - 1]),
+        )
+        for (key_of_old, key_of_new), unique in (
+            (deep, True),
+            (local, True),
+            (deep, False),
+            (local, False),
+        ):
+            self._settle(self._pair_by(key_of_old, key_of_new, unique))
+        self._settle(self._pair_unique_types())
+        return self.forward
+
+
+def _ids_of(objects, cls):
+    return [obj_id for obj_id, obj in enumerate(objects, 1) if isinstance(obj, cls)]
+
+
+def _display(value):
+    if isinstance(value, (array, bytes, bytearray)):
+        return {"length": len(value)}
+    if isinstance(value, tuple):
+        return list(value)
+    if isinstance(value, dict):
+        return {
+            str(key): item.hex() if isinstance(item, bytes) else item
+            for key, item in value.items()
+        }
+    return value
+
+
+def field_changes(old_obj, new_obj, mapping):
+    """
+    Returns a dict of field name to (old value, new value) of the public fields
+    that differ between two objects of the same type. References are compared
+    through mapping (old id to new id), and arrays and byte strings are shown as
+    their length, with the number of differing items over the common length for
+    arrays.
+    """
+    refs = set(reference_fields(type(old_obj))) if hasattr(old_obj, "encode") else ()
+    old_fields = {k: getattr(old_obj, k) for k in vars(old_obj) if k[0] != "_"}
+    new_fields = {k: getattr(new_obj, k) for k in vars(new_obj) if k[0] != "_"}
+    changes = {}
+    for name in dict.fromkeys(list(old_fields) + list(new_fields)):
+        old_value = old_fields.get(name)
+        new_value = new_fields.get(name)
+        if name in refs:
+            if isinstance(old_value, list):
+                mapped = [mapping.get(ref, -ref) if ref else ref for ref in old_value]
+            else:
+                mapped = mapping.get(old_value, -old_value) if old_value else old_value
+            if mapped == new_value:
+                continue
+        elif isinstance(old_value, array) and isinstance(new_value, array):
+            if old_value.tobytes() == new_value.tobytes():
+                continue
+            shown = _display(new_value)
+            shown["differing"] = sum(map(ne, old_value, new_value))
+            changes[name] = (_display(old_value), shown)
+            continue
+        elif old_value == new_value:
+            continue
+        changes[name] = (_display(old_value), _display(new_value))
+    return changes
+
+
+class Modification:
+    """A pair of matched objects that differ"""
+
+    def __init__(self, old_id, new_id, type_name, changes):
+        self.old_id = old_id
+        self.new_id = new_id
+        self.type_name = type_name
+        self.changes = changes
+
+    def __str__(self):
+        fields = ", ".join(
+            f"{name}: {old!r} -> {new!r}" for name, (old, new) in self.changes.items()
+        )
+        return f"({self.old_id} -> {self.new_id}) {self.type_name}: {fields}"
+
+
+class DiffReport:
+    """The added, removed and modified objects of a diff, and the id mapping"""
+
+    def __init__(self, old_path=None, new_path=None):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.mapping = {}
+        self.added = []
+        self.removed = []
+        self.modified = []
+        self.unchanged = 0
+
+    @property
+    def identical(self):
+        """True when no object was added, removed or modified"""
+        return not (self.added or self.removed or self.modified)
+
+    def to_dict(self):
+        """Returns the report as a JSON serializable dict"""
+        return {
+            "old": self.old_path,
+            "new": self.new_path,
+            "unchanged": self.unchanged,
+            "added": [{"id": obj_id, "type": name} for obj_id, name in self.added],
+            "removed": [
+                {"id": obj_id, "type": name} for obj_id, name in self.removed
+            ],
+            "modified": [
+                {
+                    "old_id": item.old_id,
+                    "new_id": item.new_id,
+                    "type": item.type_name,
+                    "changes": {
+                        name: {"old": old, "new": new}
+                        for name, (old, new) in item.changes.items()
+                    },
+                }
+                for item in self.modified
+            ],
+        }
+
+    def __str__(self):
+        return obj2str(
+            "DiffReport",
+            [
+                ("Old", self.old_path),
+                ("New", self.new_path),
+                ("Unchanged", self.unchanged),
+                ("Added", len(self.added)),
+                ("Removed", len(self.removed)),
+                ("Modified", len(self.modified)),
+            ]
+            + [("Added", f"({obj_id}) {name}") for obj_id, name in self.added]
+            + [("Removed", f"({obj_id}) {name}") for obj_id, name in self.removed]
+            + [("Modified", str(item)) for item in self.modified],
+        )
+
+
+def diff(old, new):
+    """
+    Compare two files, given as M3GReaders or paths, and return a DiffReport.
+    Objects are matched by content and graph structure, not by id.
+    """
+    if not isinstance(old, M3GReader):
+        old = M3GReader(old)
+    if not isinstance(new, M3GReader):
+        new = M3GReader(new)
+    old_prints = Fingerprints(old.objects)
+    new_prints = Fingerprints(new.objects)
+    mapping = Matcher(old_prints, new_prints).match()
+    report = DiffReport(old.path, new.path)
+    report.mapping = mapping
+    for old_id, new_id in sorted(mapping.items()):
+        if old_prints.deep[old_id - 1] == new_prints.deep[new_id - 1]:
+            report.unchanged += 1
+            continue
+        old_obj = old.objects[old_id - 1]
+        new_obj = new.objects[new_id - 1]
+        changes = field_changes(old_obj, new_obj, mapping)
+        if changes:
+            report.modified.append(
+                Modification(old_id, new_id, type(old_obj).__name__, changes)
+            )
+        else:
+            report.unchanged += 1
+    matched = set(mapping.values())
+    report.removed = [
+        (obj_id, old_prints.type_name(obj_id))
+        for obj_id in range(1, len(old.objects) + 1)
+        if obj_id not in mapping
+    ]
+    report.added = [
+        (obj_id, new_prints.type_name(obj_id))
+        for obj_id in range(1, len(new.objects) + 1)
+        if obj_id not in matched
+    ]
+    return report
+
+
+def main(argv=None):
+    """Command line entry point, returns 0 for identical files and 1 otherwise"""
+    parser = ArgumentParser(
+        prog="python -m PyM3G.diff", description="Compare two m3g files"
+    )
+    parser.add_argument("old", help="old m3g file")
+    parser.add_argument("new", help="new m3g file")
+    parser.add_argument("--json", action="store_true", help="write the report as JSON")
+    args = parser.parse_args(argv)
+    report = diff(args.old, args.new)
+    if args.json:
+        sys.stdout.write(json.dumps(report.to_dict()) + "\n")
+    else:
+        sys.stdout.write(str(report))
+    return 0 if report.identical else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
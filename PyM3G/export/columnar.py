@@ -0,0 +1,402 @@
+"""
+Columnar export of a whole corpus of m3g files
+
+Every file is read on its own and its objects are appended to typed column
+buffers of a few tables (files, meshes, vertex arrays, images, keyframe
+sequences and animation tracks), keyed by file path and object id. Whenever a
+table has reached chunk_rows rows they are written out and the buffers start
+over, so memory stays bounded by one file plus one chunk per table.
+
+Tables are written as Parquet when pyarrow is installed, otherwise in a simple
+chunked column format that read_columns reads back: an 8 byte signature, then
+per chunk a UInt32 length, a JSON header with the row count and the name, type
+and byte size of each column, and the column data. Numbers are stored as
+little endian arrays, strings as UInt32 end offsets followed by UTF-8 data.
+"""
+
+from array import array
+import json
+from os import makedirs, path as os_path
+from struct import pack, unpack
+
+from PyM3G.reader import M3GReader
+from PyM3G.textures import image_digest
+from PyM3G.util import array_bytes, find_files, read_array
+
+from PyM3G.objects.animation_track import AnimationTrack
+from PyM3G.objects.image2d import Image2D
+from PyM3G.objects.keyframe_sequence import KeyframeSequence
+from PyM3G.objects.mesh import Mesh
+from PyM3G.objects.morphing_mesh import MorphingMesh
+from PyM3G.objects.skinned_mesh import SkinnedMesh
+from PyM3G.objects.triangle_strip_array import TriangleStripArray
+from PyM3G.objects.vertex_array import VertexArray
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+_SIGNATURE = b"M3GCOL\x00\x01"
+
+STRING = "str"
+
+_arrow_types = {
+    "B": "uint8",
+    "I": "uint32",
+    "q": "int64",
+    "f": "float32",
+    STRING: "string",
+}
+
+TABLES = {
+    "files": [
+        ("file", STRING),
+        ("status", STRING),
+        ("file_size", "q"),
+        ("objects", "I"),
+        ("errors", "I"),
+        ("version", STRING),
+        ("authoring_field", STRING),
+    ],
+    "meshes": [
+        ("file", STRING),
+        ("id", "I"),
+        ("type", STRING),
+        ("vertex_buffer", "I"),
+        ("submeshes", "I"),
+        ("vertices", "I"),
+        ("triangles", "I"),
+        ("bones", "I"),
+        ("morph_targets", "I"),
+    ],
+    "vertex_arrays": [
+        ("file", STRING),
+        ("id", "I"),
+        ("component_size", "B"),
+        ("component_count", "B"),
+        ("encoding", "B"),
+        ("vertex_count", "I"),
+    ],
+    "images": [
+        ("file", STRING),
+        ("id", "I"),
+        ("format", "B"),
+        ("mutable", "B"),
+        ("width", "I"),
+        ("height", "I"),
+        ("palette_bytes", "I"),
+        ("pixel_bytes", "I"),
+        ("digest", STRING),
+    ],
+    "keyframe_sequences": [
+        ("file", STRING),
+        ("id", "I"),
+        ("interpolation", "B"),
+        ("repeat_mode", "B"),
+        ("encoding", "B"),
+        ("duration", "I"),
+        ("component_count", "I"),
+        ("keyframe_count", "I"),
+        ("valid_range_first", "I"),
+        ("valid_range_last", "I"),
+    ],
+    "animation_tracks": [
+        ("file", STRING),
+        ("id", "I"),
+        ("target", "I"),
+        ("keyframe_sequence", "I"),
+        ("animation_controller", "I"),
+        ("property_id", "I"),
+    ],
+}
+
+
+class ColumnTable:
+    """Typed column buffers of one table"""
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+        self.rows = 0
+        self.buffers = []
+        self.clear()
+
+    def clear(self):
+        """Start new, empty buffers"""
+        self.rows = 0
+        self.buffers = [
+            [] if kind == STRING else array(kind) for _, kind in self.columns
+        ]
+
+    def append(self, row):
+        """Append one row, a tuple with a value for every column"""
+        for buffer, value in zip(self.buffers, row):
+            buffer.append(value)
+        self.rows += 1
+
+    def extend(self, other):
+        """Append the rows of another table with the same columns"""
+        for buffer, values in zip(self.buffers, other.buffers):
+            buffer.extend(values)
+        self.rows += other.rows
+
+
+class ColumnFileWriter:
+    """Writes table chunks to a file of the simple chunked column format"""
+
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = open(path, "wb")
+        self.file.write(_SIGNATURE)
+
+    def write_chunk(self, rows, buffers):
+        """Write the buffers of one chunk"""
+        parts = []
+        header = {"rows": rows, "columns": []}
+        for (name, kind), buffer in zip(self.columns, buffers):
+            if kind == STRING:
+                encoded = [value.encode("utf-8") for value in buffer]
+                ends = array("I")
+                total = 0
+                for value in encoded:
+                    total += len(value)
+                    ends.append(total)
+                data = array_bytes("I", ends) + b"".join(encoded)
+            else:
+                data = array_bytes(kind, buffer)
+            header["columns"].append([name, kind, len(data)])
+            parts.append(data)
+        encoded_header = json.dumps(header).encode("utf-8")
+        self.file.write(pack("<I", len(encoded_header)))
+        self.file.write(encoded_header)
+        for data in parts:
+            self.file.write(data)
+
+    def close(self):
+        """Finish the file"""
+        self.file.close()
+
+
+class ParquetWriter:
+    """Writes table chunks as row groups of a Parquet file (needs pyarrow)"""
+
+    def __init__(self, path, columns):
+        if pyarrow is None:
+            raise ImportError("Parquet export needs pyarrow")
+        self.columns = columns
+        self.schema = pyarrow.schema(
+            [
+                (name, pyarrow.type_for_alias(_arrow_types[kind]))
+                for name, kind in columns
+            ]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write_chunk(self, rows, buffers):
+        """Write the buffers of one chunk as a row group"""
+        arrays = [
+            pyarrow.array(buffer, type=field.type)
+            for buffer, field in zip(buffers, self.schema)
+        ]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        """Finish the file"""
+        self.writer.close()
+
+
+def read_columns(path):
+    """
+    Read a file of the simple chunked column format. Yields one dict of column
+    name to array (or list of strings) per chunk.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(_SIGNATURE)) != _SIGNATURE:
+            raise ValueError(f"{path} is not a column file")
+        while True:
+            size = file.read(4)
+            if not size:
+                break
+            header = json.loads(file.read(unpack("<I", size)[0]))
+            rows = header["rows"]
+            chunk = {}
+            for name, kind, length in header["columns"]:
+                data = file.read(length)
+                if kind != STRING:
+                    chunk[name] = read_array(kind, data)
+                    continue
+                ends = read_array("I", data[: 4 * rows])
+                text = data[4 * rows :]
+                starts = [0] + ends[:-1].tolist()
+                chunk[name] = [
+                    text[start:end].decode("utf-8") for start, end in zip(starts, ends)
+                ]
+            yield chunk
+
+
+def _triangles(strip_array):
+    if not isinstance(strip_array, TriangleStripArray):
+        return 0
+    return sum(max(0, length - 2) for length in strip_array.strip_lengths)
+
+
+def file_rows(path, reader):
+    """Returns a dict of table name to the rows of one read file"""
+    rows = {name: [] for name in TABLES}
+    header = reader.objects[0] if reader.objects else None
+    version = getattr(header, "version", None)
+    rows["files"].append(
+        (
+            path,
+            reader.status.name,
+            reader.file_size,
+            len(reader.objects),
+            len(reader.errors),
+            f"{version[0]}.{version[1]}" if version else "",
+            getattr(header, "authoring_field", None) or "",
+        )
+    )
+    targets = {}
+    for obj_id, obj in enumerate(reader.objects, 1):
+        for track_id in getattr(obj, "animation_tracks", ()):
+            targets.setdefault(track_id, obj_id)
+
+    for obj_id, obj in enumerate(reader.objects, 1):
+        if isinstance(obj, Mesh):
+            vertex_buffer = reader.get_object_by_id(obj.vertex_buffer)
+            positions = reader.get_object_by_id(
+                getattr(vertex_buffer, "positions", 0)
+            )
+            rows["meshes"].append(
+                (
+                    path,
+                    obj_id,
+                    type(obj).__name__,
+                    obj.vertex_buffer,
+                    len(obj.index_buffer),
+                    getattr(positions, "vertex_count", 0),
+                    sum(
+                        _triangles(reader.get_object_by_id(index_id))
+                        for index_id in obj.index_buffer
+                    ),
+                    len(obj.transform_node) if isinstance(obj, SkinnedMesh) else 0,
+                    len(obj.morph_target) if isinstance(obj, MorphingMesh) else 0,
+                )
+            )
+        elif isinstance(obj, VertexArray):
+            rows["vertex_arrays"].append(
+                (
+                    path,
+                    obj_id,
+                    obj.component_size,
+                    obj.component_count,
+                    obj.encoding,
+                    obj.vertex_count,
+                )
+            )
+        elif isinstance(obj, Image2D):
+            rows["images"].append(
+                (
+                    path,
+                    obj_id,
+                    obj.image_format,
+                    int(bool(obj.is_mutable)),
+                    obj.width,
+                    obj.height,
+                    len(obj.palette),
+                    len(obj.pixels),
+                    image_digest(obj),
+                )
+            )
+        elif isinstance(obj, KeyframeSequence):
+            rows["keyframe_sequences"].append(
+                (
+                    path,
+                    obj_id,
+                    obj.interpolation,
+                    obj.repeat_mode,
+                    obj.encoding,
+                    obj.duration,
+                    obj.component_count,
+                    obj.keyframe_count,
+                    obj.valid_range_first,
+                    obj.valid_range_last,
+                )
+            )
+        elif isinstance(obj, AnimationTrack):
+            rows["animation_tracks"].append(
+                (
+                    path,
+                    obj_id,
+                    targets.get(obj_id, 0),
+                    obj.keyframe_sequence,
+                    obj.animation_controller,
+                    obj.property_id,
+                )
+            )
+    return rows
+
+
+def export_corpus(
+    paths, directory, file_format=None, chunk_rows=65536, strict=False, threads=1
+):
+    """
+    Export every m3g file in paths (files or directories) to one file per table
+    in directory. file_format is "parquet" or "columns", by default parquet when
+    pyarrow is installed. Files are read in tolerant mode unless strict is True;
+    files that can not be read at all only get a row in the files table.
+
+    Returns a dict of table name to the number of rows written.
+    """
+    if file_format is None:
+        file_format = "columns" if pyarrow is None else "parquet"
+    writer_class = ParquetWriter if file_format == "parquet" else ColumnFileWriter
+    extension = "parquet" if file_format == "parquet" else "m3gcol"
+    makedirs(directory, exist_ok=True)
+    tables = {name: ColumnTable(name, columns) for name, columns in TABLES.items()}
+    writers = {
+        name: writer_class(
+            os_path.join(directory, f"{name}.{extension}"), table.columns
+        )
+        for name, table in tables.items()
+    }
+    totals = dict.fromkeys(tables, 0)
+
+    def flush(table):
+        if table.rows:
+            writers[table.name].write_chunk(table.rows, table.buffers)
+            totals[table.name] += table.rows
+            table.clear()
+
+    def file_tables(rows):
+        staged = {name: ColumnTable(name, TABLES[name]) for name in rows}
+        for name, table_rows in rows.items():
+            for row in table_rows:
+                staged[name].append(row)
+        return staged
+
+    try:
+        for path in find_files(paths):
+            # The rows of a file are staged in tables of their own, so a value
+            # that does not fit its column fails the file, not the export.
+            try:
+                reader = M3GReader(path, "CRITICAL", threads=threads, strict=strict)
+                staged = file_tables(file_rows(path, reader))
+            except Exception as err:
+                staged = file_tables(
+                    {"files": [(path, f"FAILED: {err!r}", 0, 0, 1, "", "")]}
+                )
+            reader = None
+            for name, rows in staged.items():
+                table = tables[name]
+                table.extend(rows)
+                if table.rows >= chunk_rows:
+                    flush(table)
+        for table in tables.values():
+            flush(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return totals
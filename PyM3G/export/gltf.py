@@ -0,0 +1,421 @@
+"""
+glTF 2.0 binary (.glb) export
+
+Every VertexArray is written once as a single buffer view straight from its
+typed array. Integer positions, normals and texture coordinates are kept as they
+are stored in the file (KHR_mesh_quantization); the vertex buffer position scale
+and bias go into the node transform and texture coordinate scale and bias into
+KHR_texture_transform, which is then required, as the coordinates are wrong
+without it. Index accessors are shared by the meshes drawing the same strips.
+"""
+
+from array import array
+from math import radians
+from struct import pack
+import json
+import sys
+
+from PyM3G.geometry import component_range, front_facing_triangles, submeshes
+from PyM3G.imaging import encode_png
+from PyM3G.objects.camera import Camera
+from PyM3G.objects.compositing_mode import CompositingMode
+from PyM3G.objects.image2d import Image2D
+from PyM3G.objects.mesh import Mesh
+from PyM3G.objects.node import Node
+from PyM3G.objects.polygon_mode import PolygonMode
+from PyM3G.objects.texture2d import Texture2D
+from PyM3G.transform import (
+    column_major,
+    is_identity,
+    local_matrix,
+    multiply,
+    node_children,
+    root_nodes,
+    scaling,
+    translation,
+)
+
+_GLB_MAGIC = 0x46546C67
+_CHUNK_JSON = 0x4E4F534A
+_CHUNK_BIN = 0x004E4942
+
+_ARRAY_BUFFER = 34962
+_ELEMENT_ARRAY_BUFFER = 34963
+
+_component_types = {"b": 5120, "B": 5121, "h": 5122, "H": 5123, "I": 5125, "f": 5126}
+_vector_types = {1: "SCALAR", 2: "VEC2", 3: "VEC3", 4: "VEC4"}
+
+_wrap_modes = {240: 33071, 241: 10497}
+_filters = {209: 9729, 210: 9728}
+
+_QUANTIZATION = "KHR_mesh_quantization"
+_TEXTURE_TRANSFORM = "KHR_texture_transform"
+_UNLIT = "KHR_materials_unlit"
+
+
+def _little_endian(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _pack_stream(values, comps, keep):
+    """
+    Keep the first keep of comps interleaved components and pad each vertex to a
+    multiple of four bytes, as glTF requires for vertex attributes
+    """
+    padded = keep
+    while (padded * values.itemsize) % 4:
+        padded += 1
+    if padded == comps:
+        return _little_endian(values), None
+    count = len(values) // comps
+    out = array(values.typecode, bytes(count * padded * values.itemsize))
+    for comp in range(keep):
+        out[comp::padded] = values[comp::comps]
+    return _little_endian(out), padded * values.itemsize
+
+
+class GLTFBuilder:
+    """Accumulates the glTF document and binary buffer for one reader"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.blob = bytearray()
+        self.extensions_used = set()
+        self.extensions_required = set()
+        self.doc = {
+            "asset": {"version": "2.0", "generator": "PyM3G"},
+            "scene": 0,
+            "scenes": [{"nodes": []}],
+            "nodes": [],
+            "meshes": [],
+            "cameras": [],
+            "materials": [],
+            "textures": [],
+            "samplers": [],
+            "images": [],
+            "accessors": [],
+            "bufferViews": [],
+            "buffers": [],
+        }
+        self._views = {}
+        self._accessors = {}
+        self._indices = {}
+        self._materials = {}
+        self._textures = {}
+        self._images = {}
+
+    def _append(self, key, item):
+        self.doc[key].append(item)
+        return len(self.doc[key]) - 1
+
+    def add_view(self, data, target=None, stride=None):
+        """Append data to the binary buffer and return its buffer view index"""
+        self.blob.extend(bytes(-len(self.blob) % 4))
+        view = {"buffer": 0, "byteOffset": len(self.blob), "byteLength": len(data)}
+        if target is not None:
+            view["target"] = target
+        if stride is not None:
+            view["byteStride"] = stride
+        self.blob.extend(data)
+        return self._append("bufferViews", view)
+
+    def vertex_accessor(self, va_id, kind):
+        """Returns the accessor index for a VertexArray used as position, etc."""
+        key = (va_id, kind)
+        if key in self._accessors:
+            return self._accessors[key]
+        vertex_array = self.reader.get_object_by_id(va_id)
+        values = vertex_array.vertices
+        comps = vertex_array.component_count
+        keep = 2 if kind == "TEXCOORD" else comps
+        view_key = (va_id, keep)
+        if view_key not in self._views:
+            data, stride = _pack_stream(values, comps, keep)
+            self._views[view_key] = self.add_view(data, _ARRAY_BUFFER, stride)
+        accessor = {
+            "bufferView": self._views[view_key],
+            "componentType": _component_types[values.typecode],
+            "count": vertex_array.vertex_count,
+            "type": _vector_types[keep],
+        }
+        if kind == "COLOR":
+            accessor["componentType"] = _component_types["B"]
+            accessor["normalized"] = True
+        elif values.typecode != "f":
+            self.extensions_used.add(_QUANTIZATION)
+            self.extensions_required.add(_QUANTIZATION)
+            if kind == "NORMAL":
+                accessor["normalized"] = True
+        if kind == "POSITION":
+            ranges = [component_range(vertex_array, comp) for comp in range(comps)]
+            accessor["min"] = [low for low, _ in ranges]
+            accessor["max"] = [high for _, high in ranges]
+        self._accessors[key] = self._append("accessors", accessor)
+        return self._accessors[key]
+
+    def index_accessor(self, triangles, key=None):
+        """
+        Returns the accessor index for a flat triangle index list, written once
+        for all lists with the same key
+        """
+        if key in self._indices:
+            return self._indices[key]
+        if triangles and max(triangles) < 65536:
+            triangles = array("H", triangles)
+        view = self.add_view(_little_endian(triangles), _ELEMENT_ARRAY_BUFFER)
+        index = self._append(
+            "accessors",
+            {
+                "bufferView": view,
+                "componentType": _component_types[triangles.typecode],
+                "count": len(triangles),
+                "type": "SCALAR",
+            },
+        )
+        if key is not None:
+            self._indices[key] = index
+        return index
+
+    def image(self, image):
+        """Returns the glTF image index of an Image2D, encoding it as PNG once"""
+        key = id(image)
+        if key not in self._images:
+            png = encode_png(image.width, image.height, image.to_rgba())
+            self._images[key] = self._append(
+                "images", {"bufferView": self.add_view(png), "mimeType": "image/png"}
+            )
+        return self._images[key]
+
+    def texture(self, tex_id):
+        """Returns the glTF texture index of a Texture2D, or None"""
+        if tex_id in self._textures:
+            return self._textures[tex_id]
+        texture = self.reader.get_object_by_id(tex_id)
+        image = None
+        if isinstance(texture, Texture2D):
+            image = self.reader.get_object_by_id(texture.image)
+        if not isinstance(image, Image2D):
+            self._textures[tex_id] = None
+            return None
+        sampler = {
+            "wrapS": _wrap_modes.get(texture.wrapping_s, 10497),
+            "wrapT": _wrap_modes.get(texture.wrapping_t, 10497),
+        }
+        if texture.image_filter in _filters:
+            sampler["magFilter"] = sampler["minFilter"] = _filters[texture.image_filter]
+        self._textures[tex_id] = self._append(
+            "textures",
+            {"sampler": self._append("samplers", sampler), "source": self.image(image)},
+        )
+        return self._textures[tex_id]
+
+    def material(self, app_id, appearance, vertex_buffer):
+        """
+        Returns the glTF material index of an Appearance drawn with a vertex buffer,
+        since texture coordinate scale and bias live in the material
+        """
+        key = (app_id, id(vertex_buffer))
+        if key in self._materials:
+            return self._materials[key]
+        reader = self.reader
+        gltf = {
+            "name": f"Appearance_{app_id}",
+            "pbrMetallicRoughness": {"metallicFactor": 0.0, "roughnessFactor": 1.0},
+        }
+        material = reader.get_object_by_id(appearance.material)
+        if material is None:
+            self.extensions_used.add(_UNLIT)
+            gltf["extensions"] = {_UNLIT: {}}
+        else:
+            gltf["pbrMetallicRoughness"]["baseColorFactor"] = [
+                channel / 255 for channel in material.diffuse_color
+            ]
+            gltf["emissiveFactor"] = [
+                channel / 255 for channel in material.emissive_color
+            ]
+        texture = None
+        if appearance.textures and vertex_buffer.tex_coords[:1] not in ([], [0]):
+            texture = self.texture(appearance.textures[0])
+        if texture is not None:
+            info = {"index": texture, "texCoord": 0}
+            scale = vertex_buffer.tex_coord_scale[0]
+            bias = vertex_buffer.tex_coord_bias[0]
+            if scale != 1.0 or bias[0] or bias[1]:
+                self.extensions_used.add(_TEXTURE_TRANSFORM)
+                self.extensions_required.add(_TEXTURE_TRANSFORM)
+                info["extensions"] = {
+                    _TEXTURE_TRANSFORM: {
+                        "offset": [bias[0], bias[1]],
+                        "scale": [scale, scale],
+                    }
+                }
+            gltf["pbrMetallicRoughness"]["baseColorTexture"] = info
+        compositing = reader.get_object_by_id(appearance.compositing_mode)
+        if isinstance(compositing, CompositingMode):
+            if compositing.alpha_threshold:
+                gltf["alphaMode"] = "MASK"
+                gltf["alphaCutoff"] = compositing.alpha_threshold / 255
+            elif compositing.blending != 68:
+                gltf["alphaMode"] = "BLEND"
+        polygon = reader.get_object_by_id(appearance.polygon_mode)
+        if isinstance(polygon, PolygonMode) and polygon.culling == 162:
+            gltf["doubleSided"] = True
+        self._materials[key] = self._append("materials", gltf)
+        return self._materials[key]
+
+    def mesh(self, mesh_id, mesh):
+        """Returns the glTF mesh index of a Mesh, or None if it has no geometry"""
+        reader = self.reader
+        vertex_buffer = reader.get_object_by_id(mesh.vertex_buffer)
+        if vertex_buffer is None or not vertex_buffer.positions:
+            return None
+        accessor = self.vertex_accessor
+        attributes = {"POSITION": accessor(vertex_buffer.positions, "POSITION")}
+        if vertex_buffer.normals:
+            attributes["NORMAL"] = accessor(vertex_buffer.normals, "NORMAL")
+        colors = reader.get_object_by_id(vertex_buffer.colors)
+        if colors is not None and colors.component_size == 1:
+            attributes["COLOR_0"] = accessor(vertex_buffer.colors, "COLOR")
+        for unit, va_id in enumerate(vertex_buffer.tex_coords):
+            if va_id:
+                attributes[f"TEXCOORD_{unit}"] = accessor(va_id, "TEXCOORD")
+        primitives = []
+        for (strip_array, appearance), index_id, app_id in zip(
+            submeshes(reader, mesh), mesh.index_buffer, mesh.appearance
+        ):
+            if strip_array is None:
+                continue
+            # The winding of the triangles depends on the PolygonMode only
+            polygon_mode = appearance.polygon_mode if appearance is not None else 0
+            key = (index_id, polygon_mode)
+            if key not in self._indices:
+                triangles = front_facing_triangles(reader, strip_array, appearance)
+                # glTF does not allow empty accessors, so empty submeshes are left out
+                self._indices[key] = (
+                    self.index_accessor(triangles, key) if triangles else None
+                )
+            indices = self._indices[key]
+            if indices is None:
+                continue
+            primitive = {"attributes": attributes, "indices": indices}
+            if appearance is not None:
+                primitive["material"] = self.material(app_id, appearance, vertex_buffer)
+            primitives.append(primitive)
+        if not primitives:
+            return None
+        return self._append(
+            "meshes", {"name": f"Mesh_{mesh_id}", "primitives": primitives}
+        )
+
+    def camera(self, camera):
+        """Returns the glTF camera index of a Camera, or None for generic projections"""
+        if camera.projection_type == 50:
+            projection = {
+                "type": "perspective",
+                "perspective": {
+                    "yfov": radians(camera.fovy),
+                    "aspectRatio": camera.aspect_ratio,
+                    "znear": camera.near,
+                    "zfar": camera.far,
+                },
+            }
+        elif camera.projection_type == 49:
+            projection = {
+                "type": "orthographic",
+                "orthographic": {
+                    "xmag": camera.fovy * camera.aspect_ratio / 2,
+                    "ymag": camera.fovy / 2,
+                    "znear": camera.near,
+                    "zfar": camera.far,
+                },
+            }
+        else:
+            return None
+        return self._append("cameras", projection)
+
+    def node(self, node_id, visited):
+        """Add a node and its subtree, returns the glTF node index"""
+        node = self.reader.get_object_by_id(node_id)
+        visited.add(node_id)
+        gltf = {"name": f"{node.__class__.__name__}_{node_id}"}
+        matrix = local_matrix(node)
+        if not is_identity(matrix):
+            gltf["matrix"] = column_major(matrix)
+        index = self._append("nodes", gltf)
+        children = []
+        if isinstance(node, Mesh):
+            mesh = self.mesh(node_id, node)
+            vertex_buffer = self.reader.get_object_by_id(node.vertex_buffer)
+            if mesh is not None:
+                scale = vertex_buffer.position_scale
+                geometry = multiply(
+                    translation(*vertex_buffer.position_bias),
+                    scaling(scale, scale, scale),
+                )
+                if is_identity(geometry):
+                    gltf["mesh"] = mesh
+                else:
+                    children.append(
+                        self._append(
+                            "nodes",
+                            {
+                                "name": f"{gltf['name']}_geometry",
+                                "matrix": column_major(geometry),
+                                "mesh": mesh,
+                            },
+                        )
+                    )
+        elif isinstance(node, Camera):
+            camera = self.camera(node)
+            if camera is not None:
+                gltf["camera"] = camera
+        for child in node_children(node):
+            if child not in visited and isinstance(
+                self.reader.get_object_by_id(child), Node
+            ):
+                children.append(self.node(child, visited))
+        if children:
+            gltf["children"] = children
+        return index
+
+    def build(self):
+        """Build the scene graph, returns the glTF document and binary buffer"""
+        visited = set()
+        for root in root_nodes(self.reader):
+            if root not in visited:
+                self.doc["scenes"][0]["nodes"].append(self.node(root, visited))
+        self.blob.extend(bytes(-len(self.blob) % 4))
+        self.doc["buffers"].append({"byteLength": len(self.blob)})
+        if self.extensions_used:
+            self.doc["extensionsUsed"] = sorted(self.extensions_used)
+        if self.extensions_required:
+            self.doc["extensionsRequired"] = sorted(self.extensions_required)
+        for key in [key for key, value in self.doc.items() if value == []]:
+            del self.doc[key]
+        return self.doc, bytes(self.blob)
+
+
+def encode_glb(reader):
+    """Returns the scene of a reader as a binary glTF file"""
+    doc, blob = GLTFBuilder(reader).build()
+    text = json.dumps(doc, separators=(",", ":")).encode("utf-8")
+    text += b" " * (-len(text) % 4)
+    length = 12 + 8 + len(text) + 8 + len(blob)
+    return b"".join(
+        (
+            pack("<3I", _GLB_MAGIC, 2, length),
+            pack("<2I", len(text), _CHUNK_JSON),
+            text,
+            pack("<2I", len(blob), _CHUNK_BIN),
+            blob,
+        )
+    )
+
+
+def export_glb(reader, path):
+    """Write the scene of a reader to a binary glTF file"""
+    with open(path, "wb") as file:
+        file.write(encode_glb(reader))
@@ -0,0 +1,184 @@
+"""
+Wavefront OBJ/MTL export
+
+Meshes are flattened into world space, with normals transformed by the inverse
+transpose of the world matrix and renormalized. Each vertex and face stream is
+formatted with a single string operation over the whole stream instead of one
+per vertex.
+"""
+
+from os import path as os_path
+
+from PyM3G.geometry import (
+    front_facing_triangles,
+    normal_columns,
+    scaled_columns,
+    submeshes,
+)
+from PyM3G.lighting import world_normals
+from PyM3G.objects.image2d import Image2D
+from PyM3G.objects.mesh import Mesh
+from PyM3G.objects.texture2d import Texture2D
+from PyM3G.transform import (
+    identity,
+    transform_points,
+    world_matrices,
+)
+
+
+def _interleave(columns, extra=None):
+    count = len(columns[0])
+    width = len(columns) + (extra is not None)
+    flat = [None] * (count * width)
+    for comp, column in enumerate(columns):
+        flat[comp::width] = column
+    if extra is not None:
+        flat[len(columns) :: width] = extra
+    return flat
+
+
+def _format_stream(line, columns):
+    """Format columns of equal length with one % operation"""
+    if not columns or not columns[0]:
+        return ""
+    return (line * len(columns[0])) % tuple(_interleave(columns))
+
+
+def _face_stream(triangles, offset, has_uv, has_normal):
+    indices = [index + offset for index in triangles]
+    if has_uv and has_normal:
+        corner, repeat = "%d/%d/%d", 3
+    elif has_uv:
+        corner, repeat = "%d/%d", 2
+    elif has_normal:
+        corner, repeat = "%d//%d", 2
+    else:
+        corner, repeat = "%d", 1
+    args = [None] * (len(indices) * repeat)
+    for copy in range(repeat):
+        args[copy::repeat] = indices
+    line = f"f {corner} {corner} {corner}\n"
+    return (line * (len(indices) // 3)) % tuple(args)
+
+
+class OBJWriter:
+    """Accumulates OBJ and MTL text for one reader"""
+
+    def __init__(self, reader, path):
+        self.reader = reader
+        self.base = os_path.splitext(path)[0]
+        self.obj = [f"mtllib {os_path.basename(self.base)}.mtl\n"]
+        self.mtl = []
+        self.vertex_offset = 1
+        self._materials = set()
+        self._images = {}
+
+    def texture_file(self, tex_id):
+        """Write the image of a Texture2D once as PNG, returns its file name"""
+        texture = self.reader.get_object_by_id(tex_id)
+        if not isinstance(texture, Texture2D):
+            return None
+        image = self.reader.get_object_by_id(texture.image)
+        if not isinstance(image, Image2D):
+            return None
+        if id(image) not in self._images:
+            name = f"{os_path.basename(self.base)}_image{texture.image}.png"
+            image.save_png(os_path.join(os_path.dirname(self.base), name))
+            self._images[id(image)] = name
+        return self._images[id(image)]
+
+    def material(self, app_id):
+        """Write the MTL entry of an Appearance once, returns the material name"""
+        name = f"Appearance_{app_id}"
+        if app_id in self._materials:
+            return name
+        self._materials.add(app_id)
+        appearance = self.reader.get_object_by_id(app_id)
+        lines = [f"newmtl {name}\n"]
+        material = self.reader.get_object_by_id(appearance.material)
+        if material is not None:
+            ambient = material.ambient_color
+            diffuse = material.diffuse_color
+            specular = material.specular_color
+            lines.append("Ka %.4f %.4f %.4f\n" % tuple(c / 255 for c in ambient[:3]))
+            lines.append("Kd %.4f %.4f %.4f\n" % tuple(c / 255 for c in diffuse[:3]))
+            lines.append("Ks %.4f %.4f %.4f\n" % tuple(c / 255 for c in specular[:3]))
+            lines.append(f"Ns {material.shininess:.4f}\n")
+            lines.append(f"d {diffuse[3] / 255:.4f}\n")
+        else:
+            lines.append("Kd 1.0000 1.0000 1.0000\nillum 0\n")
+        if appearance.textures:
+            image_file = self.texture_file(appearance.textures[0])
+            if image_file is not None:
+                lines.append(f"map_Kd {image_file}\n")
+        self.mtl.extend(lines)
+        return name
+
+    def mesh(self, mesh_id, mesh, matrix):
+        """Write one mesh transformed into world space"""
+        reader = self.reader
+        vertex_buffer = reader.get_object_by_id(mesh.vertex_buffer)
+        positions = reader.get_object_by_id(vertex_buffer and vertex_buffer.positions)
+        if positions is None:
+            return
+        self.obj.append(f"g {mesh.__class__.__name__}_{mesh_id}\n")
+        columns = scaled_columns(
+            positions, vertex_buffer.position_scale, vertex_buffer.position_bias
+        )
+        self.obj.append(
+            _format_stream("v %.6g %.6g %.6g\n", transform_points(matrix, *columns))
+        )
+        tex_coords = None
+        if vertex_buffer.tex_coords and vertex_buffer.tex_coords[0]:
+            tex_coords = reader.get_object_by_id(vertex_buffer.tex_coords[0])
+            u_col, v_col = scaled_columns(
+                tex_coords,
+                vertex_buffer.tex_coord_scale[0],
+                vertex_buffer.tex_coord_bias[0],
+                2,
+            )
+            v_col = [1.0 - v for v in v_col]
+            self.obj.append(_format_stream("vt %.6g %.6g\n", [u_col, v_col]))
+        normals = reader.get_object_by_id(vertex_buffer.normals)
+        if normals is not None:
+            self.obj.append(
+                _format_stream(
+                    "vn %.4f %.4f %.4f\n",
+                    world_normals(matrix, normal_columns(normals)),
+                )
+            )
+        for (strip_array, appearance), app_id in zip(
+            submeshes(reader, mesh), mesh.appearance
+        ):
+            if strip_array is None:
+                continue
+            if appearance is not None:
+                self.obj.append(f"usemtl {self.material(app_id)}\n")
+            self.obj.append(
+                _face_stream(
+                    front_facing_triangles(reader, strip_array, appearance),
+                    self.vertex_offset,
+                    tex_coords is not None,
+                    normals is not None,
+                )
+            )
+        self.vertex_offset += positions.vertex_count
+
+    def write(self):
+        """Write all meshes, then the OBJ and MTL files"""
+        matrices = world_matrices(self.reader)
+        for obj_id, obj in enumerate(self.reader.objects, 1):
+            if isinstance(obj, Mesh):
+                self.mesh(obj_id, obj, matrices.get(obj_id, identity()))
+        with open(f"{self.base}.obj", "w", encoding="utf-8") as file:
+            file.write("".join(self.obj))
+        with open(f"{self.base}.mtl", "w", encoding="utf-8") as file:
+            file.write("".join(self.mtl))
+
+
+def export_obj(reader, path):
+    """
+    Write all meshes of a reader to an OBJ file, with an MTL file and PNG textures
+    next to it
+    """
+    OBJWriter(reader, path).write()
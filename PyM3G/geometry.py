@@ -0,0 +1,128 @@
+"""
+Helpers for walking Mesh, VertexBuffer and TriangleStripArray geometry as typed
+arrays
+"""
+
+from array import array
+from operator import itemgetter
+
+
+def strip_indices(strip_array):
+    """Returns the vertex indices of all strips, explicit or implicit, as one array"""
+    if strip_array.encoding >= 128:
+        return array("I", strip_array.indices)
+    count = sum(strip_array.strip_lengths)
+    return array("I", range(strip_array.start_index, strip_array.start_index + count))
+
+
+def strip_triangles(strip_array, drop_degenerate=True):
+    """
+    Returns a flat triangle list for a TriangleStripArray. Every other triangle of
+    a strip has its first two indices swapped so all triangles keep the winding of
+    the strip's first one.
+    """
+    indices = strip_indices(strip_array)
+    triangles = array("I")
+    start = 0
+    for length in strip_array.strip_lengths:
+        strip = indices[start : start + length]
+        start += length
+        if length < 3:
+            continue
+        first = strip[:-2]
+        second = strip[1:-1]
+        first[1::2], second[1::2] = strip[2:-1:2], strip[1:-2:2]
+        chunk = array("I", bytes(4 * 3 * (length - 2)))
+        chunk[0::3] = first
+        chunk[1::3] = second
+        chunk[2::3] = strip[2:]
+        triangles.extend(chunk)
+    if drop_degenerate:
+        triangles = drop_degenerate_triangles(triangles)
+    return triangles
+
+
+def drop_degenerate_triangles(triangles):
+    """Returns a triangle list without triangles that repeat a vertex"""
+    corners = zip(triangles[0::3], triangles[1::3], triangles[2::3])
+    if all(a != b and b != c and a != c for a, b, c in corners):
+        return triangles
+    kept = array("I")
+    for a, b, c in zip(triangles[0::3], triangles[1::3], triangles[2::3]):
+        if a != b and b != c and a != c:
+            kept.extend((a, b, c))
+    return kept
+
+
+def gather(values, indices):
+    """values[index] for every index, gathered in C"""
+    if not indices:
+        return []
+    if len(indices) == 1:
+        return [values[indices[0]]]
+    return itemgetter(*indices)(values)
+
+
+def vertex_attributes(reader, vertex_buffer):
+    """Returns (slot, VertexArray) for every stream of a vertex buffer"""
+    slots = [("positions", vertex_buffer.positions)]
+    slots += [("normals", vertex_buffer.normals), ("colors", vertex_buffer.colors)]
+    slots += [
+        (("tex_coords", unit), va_id)
+        for unit, va_id in enumerate(vertex_buffer.tex_coords)
+    ]
+    return [
+        (slot, reader.get_object_by_id(va_id)) for slot, va_id in slots if va_id
+    ]
+
+
+def submeshes(reader, mesh):
+    """Returns (TriangleStripArray, Appearance) pairs for each submesh of a mesh"""
+    return [
+        (reader.get_object_by_id(index_id), reader.get_object_by_id(app_id))
+        for index_id, app_id in zip(mesh.index_buffer, mesh.appearance)
+    ]
+
+
+def front_facing_triangles(reader, strip_array, appearance):
+    """
+    Returns the triangle list of a submesh with counter-clockwise front faces,
+    flipping it for PolygonMode WINDING_CW or CULL_FRONT (but not both)
+    """
+    triangles = strip_triangles(strip_array)
+    polygon_mode = None
+    if appearance is not None:
+        polygon_mode = reader.get_object_by_id(appearance.polygon_mode)
+    if polygon_mode is not None and (
+        (polygon_mode.winding == 169) != (polygon_mode.culling == 161)
+    ):
+        triangles[1::3], triangles[2::3] = triangles[2::3], triangles[1::3]
+    return triangles
+
+
+def component_range(vertex_array, component):
+    """Returns the minimum and maximum of one component of a VertexArray"""
+    values = vertex_array.vertices[component :: vertex_array.component_count]
+    return min(values), max(values)
+
+
+def scaled_columns(vertex_array, scale, bias, count=3):
+    """
+    Returns the first count components of a VertexArray as float columns with
+    scale * value + bias applied, as done for positions and texture coordinates
+    """
+    columns = []
+    for comp in range(count):
+        values = vertex_array.vertices[comp :: vertex_array.component_count]
+        offset = bias[comp] if comp < len(bias) else 0.0
+        columns.append([scale * value + offset for value in values])
+    return columns
+
+
+def normal_columns(vertex_array):
+    """Returns the normals of a VertexArray as float columns in [-1, 1]"""
+    divisor = {1: 127.0, 2: 32767.0, 4: 1.0}[vertex_array.component_size]
+    return [
+        [value / divisor for value in vertex_array.vertices[comp::3]]
+        for comp in range(3)
+    ]
@@ -0,0 +1,245 @@
+"""
+Image decoding and PNG encoding and decoding for Image2D pixel data
+
+All conversions work on whole buffers with slice assignment and bytes.translate,
+nothing loops over individual pixels in Python. The only exception is undoing
+the Sub, Average and Paeth filters of PNG rows, which depend on the bytes just
+decoded.
+"""
+
+from struct import pack, unpack_from
+import zlib
+
+ALPHA = 96
+LUMINANCE = 97
+LUMINANCE_ALPHA = 98
+RGB = 99
+RGBA = 100
+
+_format_bpp = {
+    ALPHA: 1,
+    LUMINANCE: 1,
+    LUMINANCE_ALPHA: 2,
+    RGB: 3,
+    RGBA: 4,
+}
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def bytes_per_pixel(image_format):
+    """Returns the number of bytes per pixel (or palette entry) of a format"""
+    if image_format not in _format_bpp:
+        raise ValueError(f"Unknown image format {image_format}")
+    return _format_bpp[image_format]
+
+
+def expand_rgba(image_format, data, count):
+    """
+    Expand count pixels of the given format into a contiguous RGBA8 buffer.
+    Formats without color are white, formats without alpha are opaque.
+    """
+    bpp = bytes_per_pixel(image_format)
+    data = bytes(data)
+    if len(data) < count * bpp:
+        raise ValueError(
+            f"Expected {count * bpp} bytes of pixel data, got {len(data)}"
+        )
+    if image_format == RGBA:
+        return bytearray(data[: count * 4])
+    out = bytearray(b"\xff") * (count * 4)
+    if image_format == ALPHA:
+        out[3::4] = data[:count]
+    elif image_format == LUMINANCE:
+        lum = data[:count]
+        out[0::4] = lum
+        out[1::4] = lum
+        out[2::4] = lum
+    elif image_format == LUMINANCE_ALPHA:
+        lum = data[0 : count * 2 : 2]
+        out[0::4] = lum
+        out[1::4] = lum
+        out[2::4] = lum
+        out[3::4] = data[1 : count * 2 : 2]
+    else:
+        out[0::4] = data[0 : count * 3 : 3]
+        out[1::4] = data[1 : count * 3 : 3]
+        out[2::4] = data[2 : count * 3 : 3]
+    return out
+
+
+def decode_rgba(image):
+    """
+    Decode the pixels of an Image2D into a contiguous RGBA8 buffer of
+    width * height * 4 bytes. Palettized images are expanded with one
+    bytes.translate lookup per channel. Mutable images carry no pixel data in the
+    file and decode as opaque white.
+    """
+    count = image.width * image.height
+    if image.is_mutable:
+        return bytearray(b"\xff") * (count * 4)
+    if not image.palette:
+        return expand_rgba(image.image_format, image.pixels, count)
+    bpp = bytes_per_pixel(image.image_format)
+    entries = min(len(image.palette) // bpp, 256)
+    palette = expand_rgba(image.image_format, image.palette, entries)
+    palette.extend(bytes(4 * (256 - entries)))
+    pixels = bytes(image.pixels)
+    if len(pixels) < count:
+        raise ValueError(f"Expected {count} palette indices, got {len(pixels)}")
+    pixels = pixels[:count]
+    out = bytearray(count * 4)
+    for channel in range(4):
+        out[channel::4] = pixels.translate(palette[channel::4])
+    return out
+
+
+def _png_chunk(tag, data):
+    return pack(">I", len(data)) + tag + data + pack(">I", zlib.crc32(tag + data))
+
+
+def encode_png(width, height, rgba, level=6):
+    """Encode an RGBA8 buffer as a PNG file, using only zlib"""
+    stride = width * 4
+    rgba = memoryview(bytes(rgba))
+    raw = b"".join(
+        b"\x00" + rgba[row : row + stride] for row in range(0, height * stride, stride)
+    )
+    return b"".join(
+        (
+            PNG_SIGNATURE,
+            _png_chunk(b"IHDR", pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+            _png_chunk(b"IDAT", zlib.compress(raw, level)),
+            _png_chunk(b"IEND", b""),
+        )
+    )
+
+
+def write_png(path, width, height, rgba, level=6):
+    """Write an RGBA8 buffer to a PNG file"""
+    with open(path, "wb") as file:
+        file.write(encode_png(width, height, rgba, level))
+
+
+def _unfilter(raw, height, stride, bpp):
+    """Undo the per-row filters of PNG image data"""
+    out = bytearray(height * stride)
+    prev = bytearray(stride)
+    pos = 0
+    for row in range(height):
+        kind = raw[pos]
+        line = bytearray(raw[pos + 1 : pos + 1 + stride])
+        pos += stride + 1
+        if len(line) < stride:
+            raise ValueError("PNG image data is truncated")
+        if kind == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 255
+        elif kind == 2:
+            line = bytearray((a + b) & 255 for a, b in zip(line, prev))
+        elif kind == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 255
+        elif kind == 4:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                up_left = prev[i - bpp] if i >= bpp else 0
+                up = prev[i]
+                estimate = left + up - up_left
+                dist_left = abs(estimate - left)
+                dist_up = abs(estimate - up)
+                dist_up_left = abs(estimate - up_left)
+                if dist_left <= dist_up and dist_left <= dist_up_left:
+                    predictor = left
+                elif dist_up <= dist_up_left:
+                    predictor = up
+                else:
+                    predictor = up_left
+                line[i] = (line[i] + predictor) & 255
+        elif kind != 0:
+            raise ValueError(f"Unknown PNG filter type {kind}")
+        out[row * stride : (row + 1) * stride] = line
+        prev = line
+    return out
+
+
+def _unpack_bits(data, width, height, stride, depth, scale):
+    """Expand rows of 1, 2 or 4 bit samples into one byte per sample"""
+    per_byte = 8 // depth
+    mask = (1 << depth) - 1
+    factor = 255 // mask if scale else 1
+    tables = []
+    for k in range(per_byte):
+        shift = 8 - depth * (k + 1)
+        tables.append(bytes(((value >> shift) & mask) * factor for value in range(256)))
+    out = bytearray(width * height)
+    for row in range(height):
+        line = bytes(data[row * stride : (row + 1) * stride])
+        samples = bytearray(stride * per_byte)
+        for k, table in enumerate(tables):
+            samples[k::per_byte] = line.translate(table)
+        out[row * width : (row + 1) * width] = samples[:width]
+    return out
+
+
+def decode_png(data):
+    """
+    Decode a PNG file into (width, height, image_format, palette, pixels) as
+    stored by Image2D. Indexed images keep their palette (RGBA when the file has
+    transparency) and one index byte per pixel; gray images become LUMINANCE or
+    LUMINANCE_ALPHA. 16 bit samples are reduced to their high byte. Interlaced
+    images are not supported.
+    """
+    data = bytes(data)
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    pos = len(PNG_SIGNATURE)
+    header = None
+    palette = b""
+    transparency = b""
+    chunks = []
+    while pos + 8 <= len(data):
+        length, tag = unpack_from(">I4s", data, pos)
+        body = data[pos + 8 : pos + 8 + length]
+        pos += length + 12
+        if tag == b"IHDR":
+            header = unpack_from(">IIBBBBB", body)
+        elif tag == b"PLTE":
+            palette = body
+        elif tag == b"tRNS":
+            transparency = body
+        elif tag == b"IDAT":
+            chunks.append(body)
+        elif tag == b"IEND":
+            break
+    if header is None:
+        raise ValueError("PNG file has no header")
+    width, height, depth, color_type, _, _, interlace = header
+    if interlace:
+        raise ValueError("Interlaced PNG files are not supported")
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type)
+    if channels is None or depth not in (1, 2, 4, 8, 16):
+        raise ValueError(f"Unsupported PNG color type {color_type}, depth {depth}")
+    bits = channels * depth
+    stride = (width * bits + 7) // 8
+    pixels = _unfilter(
+        zlib.decompress(b"".join(chunks)), height, stride, max(bits // 8, 1)
+    )
+    if depth == 16:
+        pixels = pixels[0::2]
+    elif depth < 8:
+        pixels = _unpack_bits(pixels, width, height, stride, depth, color_type == 0)
+    if color_type != 3:
+        image_format = {0: LUMINANCE, 2: RGB, 4: LUMINANCE_ALPHA, 6: RGBA}
+        return width, height, image_format[color_type], b"", bytes(pixels)
+    entries = len(palette) // 3
+    if not transparency:
+        return width, height, RGB, palette[: entries * 3], bytes(pixels)
+    alpha = transparency[:entries].ljust(entries, b"\xff")
+    rgba = bytearray(entries * 4)
+    rgba[0::4] = palette[0 : entries * 3 : 3]
+    rgba[1::4] = palette[1 : entries * 3 : 3]
+    rgba[2::4] = palette[2 : entries * 3 : 3]
+    rgba[3::4] = alpha
+    return width, height, RGBA, bytes(rgba), bytes(pixels)
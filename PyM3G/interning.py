@@ -0,0 +1,97 @@
+"""
+Interning of render state objects
+
+Materials, polygon modes, compositing modes, fogs and textures are often
+repeated with the same field values. intern_objects points every reference to
+such a duplicate at the first object equal to it (as compared by
+batching.value_key), drops the duplicates and renumbers the remaining objects.
+Objects with animation tracks or a user id are left alone, as the application
+can tell them apart, and so are textures of mutable images.
+
+An InternTable carries the interned objects from file to file, so equal objects
+of a whole corpus end up as one shared instance. Shared instances are used by
+several readers at once and must not be modified; copy one before changing it.
+"""
+
+from PyM3G.batching import value_key
+from PyM3G.layout import reorder
+
+from PyM3G.objects.compositing_mode import CompositingMode
+from PyM3G.objects.fog import Fog
+from PyM3G.objects.material import Material
+from PyM3G.objects.polygon_mode import PolygonMode
+from PyM3G.objects.texture2d import Texture2D
+
+INTERNED = (Material, PolygonMode, CompositingMode, Fog, Texture2D)
+
+
+class InternTable:
+    """
+    Shared instances of interned objects by type and encoded value. As the
+    encoded value includes the referenced ids, an object is only shared
+    between files where it references the same ids.
+    """
+
+    def __init__(self):
+        self.instances = {}
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.instances)
+
+    def intern(self, obj):
+        """Returns the shared instance equal to an object, which it becomes if new"""
+        self.lookups += 1
+        shared = self.instances.setdefault((type(obj), obj.encode()), obj)
+        if shared is not obj:
+            self.hits += 1
+        return shared
+
+
+def _internable(reader, obj):
+    if not isinstance(obj, INTERNED) or obj.animation_tracks or obj.user_id:
+        return False
+    if isinstance(obj, Texture2D):
+        image = reader.get_object_by_id(obj.image)
+        return image is not None and not image.is_mutable
+    return True
+
+
+def intern_objects(reader, table=None):
+    """
+    Collapses the duplicate render state objects of a reader (see the module
+    docstring) and, with a table, replaces the remaining ones with its shared
+    instances. Returns a report with the number of duplicates removed, the
+    number of objects shared through the table and the mapping of old to new
+    object ids.
+    """
+    memo = {}
+    first = {}
+    remap = {}
+    for obj_id, obj in enumerate(reader.objects, 1):
+        if _internable(reader, obj):
+            canonical = first.setdefault(value_key(reader, obj_id, memo), obj_id)
+            if canonical != obj_id:
+                remap[obj_id] = canonical
+    if remap:
+        for obj in reader.objects:
+            if hasattr(obj, "remap_references"):
+                obj.remap_references(remap)
+        order = [
+            index for index in range(len(reader.objects)) if index + 1 not in remap
+        ]
+        reader.objects, ids = reorder(reader.objects, order)
+        for old_id, canonical in remap.items():
+            ids[old_id] = ids[canonical]
+    else:
+        ids = {obj_id: obj_id for obj_id in range(1, len(reader.objects) + 1)}
+    report = {"duplicates": len(remap), "shared": 0, "ids": ids}
+    if table is not None:
+        for index, obj in enumerate(reader.objects):
+            if _internable(reader, obj):
+                shared = table.intern(obj)
+                if shared is not obj:
+                    reader.objects[index] = shared
+                    report["shared"] += 1
+    return report
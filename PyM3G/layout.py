@@ -0,0 +1,252 @@
+"""
+Regrouping the objects of a file into sections
+
+Objects are put in sections by kind: image pixels, vertex arrays, index arrays
+and keyframes each get sections of their own, and all the objects made of
+references and small fields share the rest. As object ids follow file order,
+the objects are first sorted so that every object still comes after the
+objects it references, keeping the kinds together where the references allow.
+
+Each section is then stored uncompressed or with the zlib level that suits the
+mode: "size" picks whatever is smallest, "load" weighs the time it takes to
+read the bytes at read_rate against the measured time to inflate them.
+"""
+
+from copy import copy
+from heapq import heapify, heappop, heappush
+from time import perf_counter
+import zlib
+
+from PyM3G.reader import M3GReader
+from PyM3G.writer import encode_file, encode_object, encode_section
+
+from PyM3G.objects.external_reference import ExternalReference
+from PyM3G.objects.header import Header
+from PyM3G.objects.image2d import Image2D
+from PyM3G.objects.keyframe_sequence import KeyframeSequence
+from PyM3G.objects.triangle_strip_array import TriangleStripArray
+from PyM3G.objects.vertex_array import VertexArray
+
+# Section groups in the order they are written, with the types they hold
+GROUPS = (
+    ("header", (Header,)),
+    ("external", (ExternalReference,)),
+    ("images", (Image2D,)),
+    ("vertices", (VertexArray,)),
+    ("indices", (TriangleStripArray,)),
+    ("keyframes", (KeyframeSequence,)),
+    ("scene", ()),
+)
+
+# Bytes per second a file is read at on the target, for the "load" mode
+READ_RATE = 1 << 20
+
+
+def group_of(obj):
+    """Returns the index in GROUPS of the section group of an object"""
+    for index, (_, types) in enumerate(GROUPS):
+        if isinstance(obj, types):
+            return index
+    return len(GROUPS) - 1
+
+
+def _references(obj):
+    return obj.references() if hasattr(obj, "references") else []
+
+
+def topological_order(objects, rank=None):
+    """
+    Returns the indices of a list of objects in an order where each object
+    comes after the objects it references. Of the objects that are free to go
+    next, the one with the lowest rank (by default its position) goes first.
+    Objects in reference cycles keep their relative order at the end.
+    """
+    if rank is None:
+        rank = list(range(len(objects)))
+    users = [[] for _ in objects]
+    waiting = []
+    for index, obj in enumerate(objects):
+        refs = {ref - 1 for ref in _references(obj) if 0 < ref <= len(objects)}
+        refs.discard(index)
+        for ref in refs:
+            users[ref].append(index)
+        waiting.append(len(refs))
+    ready = [(rank[index], index) for index, count in enumerate(waiting) if not count]
+    heapify(ready)
+    order = []
+    while ready:
+        _, index = heappop(ready)
+        order.append(index)
+        for user in users[index]:
+            waiting[user] -= 1
+            if not waiting[user]:
+                heappush(ready, (rank[user], user))
+    if len(order) < len(objects):
+        placed = set(order)
+        order += [index for index in range(len(objects)) if index not in placed]
+    return order
+
+
+def reorder(objects, order):
+    """
+    Returns copies of objects in a new order (a list of old indices) with their
+    references remapped, and the mapping of old to new object ids. Objects
+    without references to remap, such as Placeholders, are not copied.
+    """
+    mapping = {old + 1: new + 1 for new, old in enumerate(order)}
+    reordered = []
+    for old in order:
+        obj = objects[old]
+        if hasattr(obj, "remap_references"):
+            obj = copy(obj)
+            obj.remap_references(mapping)
+        reordered.append(obj)
+    return reordered, mapping
+
+
+def _first_use_order(objects):
+    """
+    Returns the indices of objects in file order, with every object that is
+    referenced before it appears moved in front of its first user
+    """
+    order = []
+    state = [0] * len(objects)  # 0 not visited, 1 in progress, 2 placed
+    for root in range(len(objects)):
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, iter(_references(objects[root])))]
+        while stack:
+            index, refs = stack[-1]
+            for ref in refs:
+                if 0 < ref <= len(objects) and not state[ref - 1]:
+                    state[ref - 1] = 1
+                    stack.append((ref - 1, iter(_references(objects[ref - 1]))))
+                    break
+            else:
+                stack.pop()
+                state[index] = 2
+                order.append(index)
+    return order
+
+
+def compact_objects(reader, drop=()):
+    """
+    Moves the objects of a reader that are referenced by earlier objects (such
+    as objects appended with add_object) in front of their first user, keeping
+    the order of all other objects, and removes the objects with ids in drop
+    once nothing else references them. References are remapped in place.
+    Returns the mapping of old to new object ids, without the removed objects.
+    """
+    objects = reader.objects
+    dropped = set(drop)
+    while True:
+        referenced = set()
+        for obj_id, obj in enumerate(objects, 1):
+            if obj_id not in dropped:
+                referenced.update(_references(obj))
+        unused = dropped - referenced
+        if unused == dropped:
+            break
+        dropped = unused
+    order = [index for index in _first_use_order(objects) if index + 1 not in dropped]
+    mapping = {old + 1: new + 1 for new, old in enumerate(order)}
+    if len(order) == len(objects) and all(
+        old == new for old, new in mapping.items()
+    ):
+        return mapping
+    for obj in objects:
+        if hasattr(obj, "remap_references"):
+            obj.remap_references(mapping)
+    reader.objects = [objects[old] for old in order]
+    return mapping
+
+
+def _inflate_time(packed, runs):
+    best = None
+    for _ in range(runs):
+        start = perf_counter()
+        zlib.decompress(packed)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def choose_compression(data, mode="size", read_rate=READ_RATE, runs=3):
+    """
+    Returns the zlib level (0 for uncompressed) to store section data with and
+    its stored size. mode "size" minimizes the size, mode "load" the estimated
+    load time of read time at read_rate plus the fastest of runs inflations.
+    """
+    if mode not in ("size", "load"):
+        raise ValueError(f"Unknown layout mode {mode!r}")
+    best = (len(data) / read_rate if mode == "load" else len(data), 0, len(data))
+    for level in range(1, 10):
+        packed = zlib.compress(data, level)
+        if len(packed) >= best[2]:
+            continue
+        cost = len(packed)
+        if mode == "load":
+            cost = len(packed) / read_rate + _inflate_time(packed, runs)
+        if cost < best[0]:
+            best = (cost, level, len(packed))
+    return best[1], best[2]
+
+
+def measure_load(path, runs=3):
+    """Returns the fastest of runs times it takes M3GReader to read a file"""
+    best = None
+    for _ in range(runs):
+        start = perf_counter()
+        M3GReader(path, log_level="ERROR")
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def write_layout(path, objects, mode="size", read_rate=READ_RATE, runs=3):
+    """
+    Writes a list of objects (the Header first) to a file with the objects
+    regrouped into sections (see the module docstring). The objects themselves
+    are not changed. Returns a report with the mapping of old to new object ids,
+    each section's group, object count, size and zlib level, the file size and
+    the measured load time of the written file.
+    """
+    if not objects or not isinstance(objects[0], Header):
+        raise ValueError("The first object has to be a Header")
+    groups = [group_of(obj) for obj in objects]
+    order = topological_order(objects, list(zip(groups, range(len(objects)))))
+    objects, mapping = reorder(objects, order)
+    if not isinstance(objects[0], Header):
+        raise ValueError("The Header can not reference other objects")
+
+    runs_of_groups = []
+    for obj, old in zip(objects[1:], order[1:]):
+        if runs_of_groups and runs_of_groups[-1][0] == groups[old]:
+            runs_of_groups[-1][1].append(obj)
+        else:
+            runs_of_groups.append((groups[old], [obj]))
+    sections = []
+    report = {"ids": mapping, "sections": []}
+    for group, members in runs_of_groups:
+        data = b"".join(encode_object(obj) for obj in members)
+        level, size = 0, len(data)
+        if GROUPS[group][0] != "external":
+            level, size = choose_compression(data, mode, read_rate, runs)
+        sections.append(encode_section(data, level > 0, level))
+        report["sections"].append(
+            {
+                "group": GROUPS[group][0],
+                "objects": len(members),
+                "bytes": len(data),
+                "stored": size,
+                "level": level,
+            }
+        )
+    external = any(isinstance(obj, ExternalReference) for obj in objects)
+    encoded = encode_file(objects[0], sections, external)
+    with open(path, "wb") as file:
+        file.write(encoded)
+    report["file_size"] = len(encoded)
+    report["load_time"] = measure_load(path, runs)
+    return report
@@ -0,0 +1,371 @@
+"""
+Evaluation of the M3G fixed-function lighting equation per vertex
+
+Lighting is computed in world space for whole vertex columns at a time, one
+light after the other: every light adds its attenuated and spot-weighted
+diffuse and specular factors to per-vertex accumulators, which are combined with
+the Material colors at the end. A light only affects meshes whose scope shares a
+bit with its own. AMBIENT lights only contribute to the ambient term, all other
+lights only to the diffuse and specular terms.
+
+bake_lighting stores the result as a color VertexArray, so a scene can be drawn
+without fixed-function lighting.
+"""
+
+from array import array
+from copy import deepcopy
+from math import cos, radians, sqrt
+
+from PyM3G.geometry import normal_columns, scaled_columns, strip_indices
+from PyM3G.layout import compact_objects
+from PyM3G.transform import (
+    inverse,
+    root_nodes,
+    scene_nodes,
+    transform_points,
+    transform_vectors,
+)
+
+from PyM3G.objects.appearance import Appearance
+from PyM3G.objects.camera import Camera
+from PyM3G.objects.light import Light
+from PyM3G.objects.material import Material
+from PyM3G.objects.mesh import Mesh
+from PyM3G.objects.polygon_mode import PolygonMode
+from PyM3G.objects.vertex_array import VertexArray
+from PyM3G.objects.world import World
+
+AMBIENT = 128
+DIRECTIONAL = 129
+OMNI = 130
+SPOT = 131
+
+
+def _normalized(vector):
+    length = sqrt(sum(value * value for value in vector)) or 1.0
+    return tuple(value / length for value in vector)
+
+
+class SceneLight:
+    """A Light with its color, position and direction in world space"""
+
+    def __init__(self, light, matrix):
+        self.mode = light.mode
+        self.scope = light.scope
+        self.color = [channel / 255 * light.intensity for channel in light.color]
+        self.position = (matrix[3], matrix[7], matrix[11])
+        self.direction = _normalized((-matrix[2], -matrix[6], -matrix[10]))
+        self.attenuation = (
+            light.attenuation_constant,
+            light.attenuation_linear,
+            light.attenuation_quadratic,
+        )
+        self.spot_cos = cos(radians(light.spot_angle))
+        self.spot_exponent = light.spot_exponent
+
+
+def scene_lights(nodes):
+    """Returns the enabled lights of a dict of SceneNodes (see scene_nodes)"""
+    return [
+        SceneLight(scene_node.node, scene_node.matrix)
+        for scene_node in nodes.values()
+        if isinstance(scene_node.node, Light) and scene_node.visible
+    ]
+
+
+def world_normals(matrix, normals):
+    """
+    Transform normal columns by the inverse transpose of a node's world matrix
+    and normalize them
+    """
+    inv = inverse(matrix)
+    transposed = [inv[col * 4 + row] for row in range(4) for col in range(4)]
+    nxs, nys, nzs = transform_vectors(transposed, *normals)
+    lengths = [sqrt(x * x + y * y + z * z) or 1.0 for x, y, z in zip(nxs, nys, nzs)]
+    return (
+        [x / length for x, length in zip(nxs, lengths)],
+        [y / length for y, length in zip(nys, lengths)],
+        [z / length for z, length in zip(nzs, lengths)],
+    )
+
+
+def _light_factors(light, positions, normals, viewer, local_viewer, shininess):
+    """
+    Returns the diffuse and specular factor columns of one light, including
+    attenuation and the spot cone
+    """
+    nxs, nys, nzs = normals
+    count = len(nxs)
+    if light.mode == DIRECTIONAL:
+        lx, ly, lz = (-value for value in light.direction)
+        lxs, lys, lzs = [lx] * count, [ly] * count, [lz] * count
+        weights = [1.0] * count
+    else:
+        px, py, pz = light.position
+        dxs = [px - x for x in positions[0]]
+        dys = [py - y for y in positions[1]]
+        dzs = [pz - z for z in positions[2]]
+        distances = [
+            sqrt(x * x + y * y + z * z) or 1.0 for x, y, z in zip(dxs, dys, dzs)
+        ]
+        lxs = [x / d for x, d in zip(dxs, distances)]
+        lys = [y / d for y, d in zip(dys, distances)]
+        lzs = [z / d for z, d in zip(dzs, distances)]
+        constant, linear, quadratic = light.attenuation
+        weights = [
+            1.0 / ((constant + linear * d + quadratic * d * d) or 1.0)
+            for d in distances
+        ]
+        if light.mode == SPOT:
+            sx, sy, sz = light.direction
+            cone, exponent = light.spot_cos, light.spot_exponent
+            spots = [-(x * sx + y * sy + z * sz) for x, y, z in zip(lxs, lys, lzs)]
+            weights = [
+                w * spot**exponent if spot >= cone else 0.0
+                for w, spot in zip(weights, spots)
+            ]
+    dots = [
+        x * lx + y * ly + z * lz
+        for x, y, z, lx, ly, lz in zip(nxs, nys, nzs, lxs, lys, lzs)
+    ]
+    diffuse = [w * dot if dot > 0 else 0.0 for w, dot in zip(weights, dots)]
+    if local_viewer is not None:
+        cx, cy, cz = local_viewer
+        views = [
+            _normalized((cx - x, cy - y, cz - z)) for x, y, z in zip(*positions)
+        ]
+    else:
+        views = [viewer] * count
+    specular = []
+    for nx, ny, nz, lx, ly, lz, view, w, dot in zip(
+        nxs, nys, nzs, lxs, lys, lzs, views, weights, dots
+    ):
+        if dot <= 0 or w == 0:
+            specular.append(0.0)
+            continue
+        hx, hy, hz = _normalized((lx + view[0], ly + view[1], lz + view[2]))
+        half = nx * hx + ny * hy + nz * hz
+        specular.append(w * half**shininess if half > 0 else 0.0)
+    return diffuse, specular
+
+
+def light_vertices(
+    material,
+    positions,
+    normals,
+    lights,
+    scope=-1,
+    colors=None,
+    viewer=(0.0, 0.0, 1.0),
+    local_viewer=None,
+):
+    """
+    Returns r, g, b and a columns (0 to 255) of the lit colors of vertices
+
+    positions and normals are world space columns, normals of unit length or
+    None. colors are the r, g, b, a vertex color columns (0 to 255), used for the
+    ambient and diffuse colors when the Material tracks vertex colors. viewer is
+    the direction towards an infinitely far viewer, local_viewer the camera
+    position when PolygonMode enables local camera lighting.
+    """
+    count = len(positions[0])
+    tracking = material.vertex_color_tracking_enabled and colors is not None
+    if tracking:
+        diffuse_m = [[value / 255 for value in column] for column in colors[:3]]
+        ambient_m = diffuse_m
+        alpha = list(colors[3])
+    else:
+        diffuse_m = [[channel / 255] * count for channel in material.diffuse_color[:3]]
+        ambient_m = [[channel / 255] * count for channel in material.ambient_color]
+        alpha = [float(material.diffuse_color[3])] * count
+    ambient = [0.0, 0.0, 0.0]
+    diffuse = [[0.0] * count for _ in range(3)]
+    specular = [[0.0] * count for _ in range(3)]
+    for light in lights:
+        if not light.scope & scope:
+            continue
+        if light.mode == AMBIENT:
+            ambient = [a + c for a, c in zip(ambient, light.color)]
+            continue
+        if normals is None:
+            continue
+        diffuse_f, specular_f = _light_factors(
+            light, positions, normals, viewer, local_viewer, material.shininess
+        )
+        for channel, color in enumerate(light.color):
+            if color:
+                diffuse[channel] = [
+                    a + f * color for a, f in zip(diffuse[channel], diffuse_f)
+                ]
+                specular[channel] = [
+                    a + f * color for a, f in zip(specular[channel], specular_f)
+                ]
+    out = []
+    for channel in range(3):
+        emissive = material.emissive_color[channel] / 255
+        light_ambient = ambient[channel]
+        specular_m = material.specular_color[channel] / 255
+        out.append(
+            [
+                min(1.0, emissive + ma * light_ambient + md * d + specular_m * s) * 255
+                for ma, md, d, s in zip(
+                    ambient_m[channel],
+                    diffuse_m[channel],
+                    diffuse[channel],
+                    specular[channel],
+                )
+            ]
+        )
+    out.append(alpha)
+    return out
+
+
+def vertex_colors(reader, vertex_buffer, count):
+    """Returns r, g, b, a columns (0 to 255) of the colors of a vertex buffer"""
+    colors = reader.get_object_by_id(vertex_buffer.colors)
+    if colors is None:
+        return [[channel] * count for channel in vertex_buffer.default_color]
+    step = colors.component_count
+    columns = [[value & 255 for value in colors.vertices[c::step]] for c in range(step)]
+    if step == 3:
+        columns.append([255] * count)
+    return columns
+
+
+def _viewer(reader, world_node, nodes):
+    """Returns the viewer direction and position of a World's active camera"""
+    camera = reader.get_object_by_id(world_node.active_camera) if world_node else None
+    if not isinstance(camera, Camera) or world_node.active_camera not in nodes:
+        return (0.0, 0.0, 1.0), None
+    matrix = nodes[world_node.active_camera].matrix
+    return _normalized((matrix[2], matrix[6], matrix[10])), (
+        matrix[3],
+        matrix[7],
+        matrix[11],
+    )
+
+
+def _color_array(columns):
+    """Returns an RGBA VertexArray of byte colors from 0 to 255 columns"""
+    count = len(columns[0])
+    data = bytearray(count * 4)
+    for channel, column in enumerate(columns):
+        data[channel::4] = bytes(min(255, max(0, round(value))) for value in column)
+    vertex_array = VertexArray()
+    vertex_array.component_size = 1
+    vertex_array.component_count = 4
+    vertex_array.encoding = 0
+    vertex_array.vertex_count = count
+    vertex_array.vertices = array("b", bytes(data))
+    return vertex_array
+
+
+def bake_lighting(reader, world=None, remove_materials=True, compact=True):
+    """
+    Light every mesh below a World (the file's first World by default, or all
+    root nodes if there is none) and store the colors in a new RGBA VertexArray
+
+    Each mesh gets a copy of its VertexBuffer using the new colors, since the
+    lighting depends on the mesh's transform. Vertices used by several submeshes
+    with different materials get the colors of the last one. With
+    remove_materials the Material of every lit Appearance is removed so the baked
+    colors are used as they are; Appearances shared with meshes outside the
+    World lose their Material too.
+
+    With compact, the new objects are moved in front of the meshes using them
+    and the replaced VertexBuffers, color arrays and Materials nothing uses
+    anymore are removed (see layout.compact_objects), which renumbers the
+    objects. Without it the new objects are forward references.
+
+    Returns a dict of mesh id to the id of its new color VertexArray, both as
+    they are after compacting.
+    """
+    if world is None:
+        world = next(
+            (i for i, obj in enumerate(reader.objects, 1) if isinstance(obj, World)),
+            None,
+        )
+    world_node = reader.get_object_by_id(world)
+    roots = [world] if isinstance(world_node, World) else root_nodes(reader)
+    nodes = scene_nodes(reader, roots)
+    lights = scene_lights(nodes)
+    viewer, camera_position = _viewer(reader, world_node, nodes)
+    baked = {}
+    replaced = []
+    lit_appearances = set()
+    for mesh_id, scene_node in nodes.items():
+        mesh = scene_node.node
+        if not isinstance(mesh, Mesh):
+            continue
+        vertex_buffer = reader.get_object_by_id(mesh.vertex_buffer)
+        positions = reader.get_object_by_id(getattr(vertex_buffer, "positions", 0))
+        if positions is None:
+            continue
+        count = positions.vertex_count
+        world_positions = transform_points(
+            scene_node.matrix,
+            *scaled_columns(
+                positions, vertex_buffer.position_scale, vertex_buffer.position_bias
+            ),
+        )
+        normals = None
+        if vertex_buffer.normals:
+            normals = world_normals(
+                scene_node.matrix,
+                normal_columns(reader.get_object_by_id(vertex_buffer.normals)),
+            )
+        colors = vertex_colors(reader, vertex_buffer, count)
+        out = [list(column) for column in colors]
+        lit = {}
+        for index_id, app_id in zip(mesh.index_buffer, mesh.appearance):
+            appearance = reader.get_object_by_id(app_id)
+            strip_array = reader.get_object_by_id(index_id)
+            if not isinstance(appearance, Appearance) or strip_array is None:
+                continue
+            material = reader.get_object_by_id(appearance.material)
+            if not isinstance(material, Material):
+                continue
+            polygon_mode = reader.get_object_by_id(appearance.polygon_mode)
+            local = (
+                isinstance(polygon_mode, PolygonMode)
+                and polygon_mode.local_camera_lighting_enabled
+            )
+            key = (appearance.material, local)
+            if key not in lit:
+                lit[key] = light_vertices(
+                    material,
+                    world_positions,
+                    normals,
+                    lights,
+                    mesh.scope,
+                    colors,
+                    viewer,
+                    camera_position if local else None,
+                )
+            for index in set(strip_indices(strip_array)):
+                if index < count:
+                    for column, source in zip(out, lit[key]):
+                        column[index] = source[index]
+            lit_appearances.add(appearance)
+        if not lit:
+            continue
+        replaced += [mesh.vertex_buffer, vertex_buffer.colors]
+        copy = deepcopy(vertex_buffer)
+        copy.colors = reader.add_object(_color_array(out))
+        mesh.vertex_buffer = reader.add_object(copy)
+        baked[mesh_id] = copy.colors
+    if remove_materials:
+        for appearance in lit_appearances:
+            replaced.append(appearance.material)
+            appearance.material = 0
+    if compact and replaced:
+        ids = compact_objects(
+            reader,
+            [
+                obj_id
+                for obj_id in replaced
+                if obj_id and not getattr(reader.get_object_by_id(obj_id), "user_id", 0)
+            ],
+        )
+        baked = {ids[mesh_id]: ids[color_id] for mesh_id, color_id in baked.items()}
+    return baked
@@ -0,0 +1,226 @@
+"""
+Resolving ExternalReference objects through a shared cache of loaded files
+
+A Loader resolves the uri of every ExternalReference of a file, relative to the
+referencing file or, for uris starting with "/", to a base path, or through a
+resolver function. Referenced m3g files stand for their first root-level object
+(the first object no other object references) and PNG files for an Image2D.
+Resolved references get a target and source, and M3GReader.get_object_by_id
+returns the target, so references across files look like local ones.
+
+Loaded files are kept in a FileCache shared by all loaders of the process, so a
+texture or model used by many files is only read once. The cache is bounded by
+the memory the cached files take, counted as the bytes of their decoded
+payloads (see budget.payload_size), and evicts the least recently used ones.
+Objects from the cache are shared between all files referencing them.
+"""
+
+from collections import OrderedDict
+from os import path as os_path, stat
+from threading import Lock
+
+from PyM3G.budget import object_payload_size
+from PyM3G.imaging import PNG_SIGNATURE
+from PyM3G.reader import M3GReader
+from PyM3G.util import M3GStatus
+
+from PyM3G.objects.external_reference import ExternalReference
+from PyM3G.objects.header import Header
+from PyM3G.objects.image2d import Image2D
+
+
+class FileCache:
+    """
+    Thread safe LRU cache of loaded files, keyed by path and invalidated when a
+    file's modification time changes. max_bytes bounds the total size the
+    cached files were put with, the bytes of their decoded payloads for a Loader.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, mtime):
+        """Returns the cached value of a file, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != mtime:
+                self.size -= entry[1]
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, mtime, size, value):
+        """Cache the value of a file, evicting the least recently used files"""
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (mtime, size, value)
+            self.size += size
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        """Drop all cached files"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+shared_cache = FileCache()
+
+
+def _decoded_size(value):
+    """Returns the bytes of the decoded payloads of a loaded file"""
+    if isinstance(value, M3GReader):
+        return sum(object_payload_size(obj) for obj in value.objects)
+    return object_payload_size(value)
+
+
+def root_object(reader):
+    """
+    Returns the first root-level object of a file, the object an external
+    reference to the file stands for, or None if there is none
+    """
+    referenced = set()
+    for obj in reader.objects:
+        if hasattr(obj, "references"):
+            referenced.update(obj.references())
+    for obj_id, obj in enumerate(reader.objects, 1):
+        if obj_id in referenced or isinstance(obj, (Header, ExternalReference)):
+            continue
+        if hasattr(obj, "references"):
+            return obj
+    return None
+
+
+class Loader:
+    """
+    Loads m3g files and resolves their external references
+
+    resolver, if given, is called with a uri and the path of the referencing file
+    and returns the path to load. In strict mode resolution errors (missing
+    files, cycles, unreadable files) are raised as ValueError or OSError,
+    otherwise they are recorded in the errors of the referencing reader and the
+    reference stays unresolved.
+    """
+
+    def __init__(
+        self,
+        base_path=None,
+        resolver=None,
+        cache=None,
+        log_level="WARNING",
+        strict=True,
+        threads=1,
+    ):
+        self.base_path = base_path
+        self.resolver = resolver
+        self.cache = shared_cache if cache is None else cache
+        self.log_level = log_level
+        self.strict = strict
+        self.threads = threads
+        self._loading = []
+
+    def resolve_uri(self, uri, referrer):
+        """Returns the path of the file a uri of the file referrer points at"""
+        if self.resolver is not None:
+            return self.resolver(uri, referrer)
+        if uri.startswith("file:"):
+            uri = uri[5:]
+        if uri.startswith("/"):
+            base = self.base_path
+            if base is None:
+                base = os_path.dirname(referrer)
+            return os_path.join(base, uri.lstrip("/"))
+        return os_path.join(os_path.dirname(referrer), uri)
+
+    def load(self, path):
+        """
+        Returns an M3GReader of a file with all external references resolved
+        (or an Image2D for a PNG file), from the cache if the file was loaded
+        before
+        """
+        return self._load(path)
+
+    def _load(self, path):
+        key = os_path.realpath(path)
+        if key in self._loading:
+            chain = self._loading[self._loading.index(key) :] + [key]
+            raise ValueError(f"Cyclic external reference: {' -> '.join(chain)}")
+        info = stat(key)
+        value = self.cache.get(key, info.st_mtime_ns)
+        if value is not None:
+            return value
+        self._loading.append(key)
+        try:
+            value = self._read_file(key)
+        finally:
+            self._loading.pop()
+        self.cache.put(key, info.st_mtime_ns, _decoded_size(value), value)
+        return value
+
+    def _read_file(self, path):
+        with open(path, "rb") as file:
+            if file.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE:
+                file.seek(0)
+                return Image2D.from_png(file.read())
+        reader = M3GReader(
+            path, self.log_level, threads=self.threads, strict=self.strict
+        )
+        self.link(reader)
+        return reader
+
+    def link(self, reader):
+        """
+        Resolve the external references of a reader. Returns the number of
+        references that were resolved.
+        """
+        references = [
+            (obj_id, obj)
+            for obj_id, obj in enumerate(reader.objects, 1)
+            if isinstance(obj, ExternalReference) and obj.target is None
+        ]
+        header = reader.objects[0] if reader.objects else None
+        if isinstance(header, Header) and references:
+            if not header.has_external_references:
+                reader.log.warning(
+                    "External references in '%s' without the header flag",
+                    reader.path,
+                )
+        resolved = 0
+        for obj_id, reference in references:
+            try:
+                path = self.resolve_uri(reference.uri, reader.path)
+                target = self._load(path)
+                if isinstance(target, M3GReader):
+                    target = root_object(target)
+                if target is None:
+                    raise ValueError(f"'{path}' has no root object")
+            except (OSError, ValueError) as err:
+                if self.strict:
+                    raise
+                reader.error(
+                    f"Could not resolve external reference '{reference.uri}': {err}",
+                    obj_id=obj_id,
+                )
+                if reader.status == M3GStatus.SUCCESS:
+                    reader.status = M3GStatus.PARTIAL
+                continue
+            reference.target = target
+            reference.source = path
+            resolved += 1
+        return resolved
+
+
+def load(path, base_path=None, resolver=None, strict=True):
+    """Load a file with its external references through the shared cache"""
+    return Loader(base_path, resolver, strict=strict).load(path)
@@ -1,6 +1,5 @@
 """Animation Controller Class"""
 
-from struct import unpack
 from PyM3G.util import obj2str
 from PyM3G.objects.object3d import Object3D
 
@@ -10,6 +9,15 @@ class AnimationController(Object3D):
     Controls the position, speed and weight of an animation sequence
     """
 
+    _layout = [
+        ("speed", "f"),
+        ("weight", "f"),
+        ("active_interval_start", "i"),
+        ("active_interval_end", "i"),
+        ("reference_sequence_time", "f"),
+        ("reference_world_time", "i"),
+    ]
+
     def __init__(self):
         super().__init__()
         self.speed = 1.0
@@ -31,14 +39,3 @@ class AnimationController(Object3D):
                 ("Reference World Time", self.reference_world_time),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        (
-            self.speed,
-            self.weight,
-            self.active_interval_start,
-            self.active_interval_end,
-            self.reference_sequence_time,
-            self.reference_world_time,
-        ) = unpack("<ffIIfI", reader.read(24))
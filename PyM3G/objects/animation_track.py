@@ -1,6 +1,6 @@
 """Animation Track Class"""
 
-from struct import unpack
+from PyM3G.schema import REF
 from PyM3G.util import obj2str, const2str
 from PyM3G.objects.object3d import Object3D
 
@@ -11,6 +11,12 @@ class AnimationTrack(Object3D):
     property
     """
 
+    _layout = [
+        ("keyframe_sequence", REF),
+        ("animation_controller", REF),
+        ("property_id", "I"),
+    ]
+
     def __init__(self):
         super().__init__()
         self.keyframe_sequence = None
@@ -26,9 +32,3 @@ class AnimationTrack(Object3D):
                 ("Property ID", const2str(self.property_id)),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        (self.keyframe_sequence, self.animation_controller, self.property_id) = unpack(
-            "<3I", reader.read(12)
-        )
@@ -1,6 +1,6 @@
 """Appearance Class"""
 
-from struct import unpack
+from PyM3G.schema import REF, Array
 from PyM3G.util import obj2str
 from PyM3G.objects.object3d import Object3D
 
@@ -11,6 +11,15 @@ class Appearance(Object3D):
     Sprite3D
     """
 
+    _layout = [
+        ("layer", "B"),
+        ("compositing_mode", REF),
+        ("fog", REF),
+        ("polygon_mode", REF),
+        ("material", REF),
+        Array("textures", REF),
+    ]
+
     def __init__(self):
         super().__init__()
         self.layer = 0
@@ -32,17 +41,3 @@ class Appearance(Object3D):
                 ("Textures", self.textures),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.textures = []
-        (
-            self.layer,
-            self.compositing_mode,
-            self.fog,
-            self.polygon_mode,
-            self.material,
-            texcount,
-        ) = unpack("<B5I", reader.read(21))
-        for _ in range(texcount):
-            self.textures.append(unpack("<I", reader.read(4))[0])
@@ -1,6 +1,6 @@
 """Background Class"""
 
-from struct import unpack
+from PyM3G.schema import REF
 from PyM3G.util import obj2str, const2str
 from PyM3G.objects.object3d import Object3D
 
@@ -10,6 +10,19 @@ class Background(Object3D):
     Defines whether and how to clear the viewport
     """
 
+    _layout = [
+        ("background_color", "4B"),
+        ("background_image", REF),
+        ("background_image_mode_x", "B"),
+        ("background_image_mode_y", "B"),
+        ("crop_x", "i"),
+        ("crop_y", "i"),
+        ("crop_width", "i"),
+        ("crop_height", "i"),
+        ("depth_clear_enabled", "?"),
+        ("color_clear_enabled", "?"),
+    ]
+
     def __init__(self):
         super().__init__()
         self.background_color = (0, 0, 0, 0)
@@ -39,18 +52,3 @@ class Background(Object3D):
                 ("Color Clear Enabled", self.color_clear_enabled),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.background_color = unpack("<4f", reader.read(16))
-        (
-            self.background_image,
-            self.background_image_mode_x,
-            self.background_image_mode_y,
-            self.crop_x,
-            self.crop_y,
-            self.crop_width,
-            self.crop_height,
-            self.depth_clear_enabled,
-            self.color_clear_enabled,
-        ) = unpack("<IBB4I??", reader.read(24))
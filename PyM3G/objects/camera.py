@@ -1,6 +1,6 @@
 """Camera Class"""
 
-from struct import unpack
+from PyM3G.schema import When
 from PyM3G.util import obj2str, const2str
 from PyM3G.objects.node import Node
 
@@ -11,6 +11,21 @@ class Camera(Node):
     projection from 3D to 2D
     """
 
+    _layout = [
+        ("projection_type", "B"),
+        When(
+            "projection_type",
+            [("projection_matrix", "16f")],
+            value=48,
+            otherwise=[
+                ("fovy", "f"),
+                ("aspect_ratio", "f"),
+                ("near", "f"),
+                ("far", "f"),
+            ],
+        ),
+    ]
+
     def __init__(self):
         super().__init__()
         self.projection_type = 48
@@ -32,13 +47,3 @@ class Camera(Node):
                 ("Far", self.far),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.projection_type = unpack("<B", reader.read(1))[0]
-        if self.projection_type == 48:
-            self.projection_matrix = unpack("<16f", reader.read(64))
-        else:
-            (self.fovy, self.aspect_ratio, self.near, self.far) = unpack(
-                "<4f", reader.read(16)
-            )
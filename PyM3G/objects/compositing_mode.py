@@ -1,6 +1,5 @@
 """Compositing Mode Class"""
 
-from struct import unpack
 from PyM3G.util import obj2str, const2str
 from PyM3G.objects.object3d import Object3D
 
@@ -10,6 +9,17 @@ class CompositingMode(Object3D):
     An Appearance component encapsulating per-pixel compositing attributes
     """
 
+    _layout = [
+        ("depth_test_enabled", "?"),
+        ("depth_write_enabled", "?"),
+        ("color_write_enabled", "?"),
+        ("alpha_write_enabled", "?"),
+        ("blending", "B"),
+        ("alpha_threshold", "B"),
+        ("depth_offset_factor", "f"),
+        ("depth_offset_units", "f"),
+    ]
+
     def __init__(self):
         super().__init__()
         self.depth_test_enabled = True
@@ -17,7 +27,7 @@ class CompositingMode(Object3D):
         self.color_write_enabled = True
         self.alpha_write_enabled = True
         self.blending = 68
-        self.alpha_threshold = 0.0
+        self.alpha_threshold = 0
         self.depth_offset_factor = 0.0
         self.depth_offset_units = 0.0
 
@@ -35,16 +45,3 @@ class CompositingMode(Object3D):
                 ("Depth Offset Units", self.depth_offset_units),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        (
-            self.depth_test_enabled,
-            self.depth_write_enabled,
-            self.color_write_enabled,
-            self.alpha_write_enabled,
-            self.blending,
-            self.alpha_threshold,
-            self.depth_offset_factor,
-            self.depth_offset_units,
-        ) = unpack("<4?BBff", reader.read(14))
@@ -1,19 +1,33 @@
 """External Reference Class"""
 
+from PyM3G.schema import M3GObject, String
 from PyM3G.util import obj2str
 
 
-class ExternalReference:
+class ExternalReference(M3GObject):
     """
     Used for including external files (textures or other scenes)
+
+    Once resolved by a loader.Loader, target is the object the reference stands
+    for and source the path of the file it was loaded from.
     """
 
+    _layout = [String("uri")]
+
     def __init__(self):
         self.uri = None
+        self.target = None
+        self.source = None
 
     def __str__(self):
-        return obj2str("External Reference", [("URI", self.uri)])
-
-    def read(self, reader):
-        """Read external reference string from file stream"""
-        self.uri = reader.read().rstrip(b"\x00").decode("utf-8")
+        return obj2str(
+            "External Reference",
+            [
+                ("URI", self.uri),
+                ("Source", self.source),
+                (
+                    "Target",
+                    None if self.target is None else type(self.target).__name__,
+                ),
+            ],
+        )
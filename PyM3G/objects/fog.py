@@ -1,6 +1,6 @@
 """Fog Class"""
 
-from struct import unpack
+from PyM3G.schema import When
 from PyM3G.util import obj2str, const2str
 from PyM3G.objects.object3d import Object3D
 
@@ -10,9 +10,16 @@ class Fog(Object3D):
     An Appearance component encapsulating attributes for fogging
     """
 
+    _layout = [
+        ("color", "3B"),
+        ("mode", "B"),
+        When("mode", [("density", "f")], value=80),
+        When("mode", [("near", "f"), ("far", "f")], value=81),
+    ]
+
     def __init__(self):
         super().__init__()
-        self.color = (0, 0, 0, 0)
+        self.color = (0, 0, 0)
         self.mode = 81
         self.density = 1.0
         self.near = 0.0
@@ -29,12 +36,3 @@ class Fog(Object3D):
                 ("Far", self.far),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.color = unpack("<3f", reader.read(12))
-        self.mode = unpack("<B", reader.read(1))[0]
-        if self.mode == 80:
-            self.density = unpack("<f", reader.read(4))[0]
-        elif self.mode == 81:
-            (self.near, self.far) = unpack("<2f", reader.read(8))
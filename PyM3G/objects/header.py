@@ -1,14 +1,22 @@
 """Header Class"""
 
-from struct import unpack
+from PyM3G.schema import M3GObject, String
 from PyM3G.util import obj2str
 
 
-class Header:
+class Header(M3GObject):
     """
     Header contains metadata about the file
     """
 
+    _layout = [
+        ("version", "2B"),
+        ("has_external_references", "?"),
+        ("total_file_size", "I"),
+        ("approximate_content_size", "I"),
+        String("authoring_field"),
+    ]
+
     def __init__(self):
         self.version = None
         self.has_external_references = None
@@ -27,13 +35,3 @@ class Header:
                 ("Authoring field text", f"'{self.authoring_field}'"),
             ],
         )
-
-    def read(self, reader):
-        """Read header from file stream"""
-        self.version = unpack("<BB", reader.read(2))
-        (
-            self.has_external_references,
-            self.total_file_size,
-            self.approximate_content_size,
-        ) = unpack("<?II", reader.read(9))
-        self.authoring_field = reader.read().rstrip(b"\x00").decode("utf-8")
@@ -1,7 +1,8 @@
 """Image2D Class"""
 
-from struct import unpack
+from PyM3G.schema import Bytes, Payload, When
 from PyM3G.util import obj2str, const2str
+from PyM3G.imaging import decode_png, decode_rgba, write_png
 from PyM3G.objects.object3d import Object3D
 
 
@@ -10,14 +11,25 @@ class Image2D(Object3D):
     A two-dimensional image that can be used as a texture, background or sprite image
     """
 
+    _layout = [
+        ("image_format", "B"),
+        ("is_mutable", "?"),
+        ("width", "I"),
+        ("height", "I"),
+        When("is_mutable", [Bytes("palette"), Bytes("pixels")], value=False),
+    ]
+
+    palette = Payload()
+    pixels = Payload()
+
     def __init__(self):
         super().__init__()
         self.image_format = None
         self.is_mutable = None
         self.width = None
         self.height = None
-        self.palette = []
-        self.pixels = []
+        self.palette = b""
+        self.pixels = b""
 
     def __str__(self):
         return obj2str(
@@ -32,15 +44,24 @@ class Image2D(Object3D):
             ],
         )
 
-    def read(self, reader):
-        super().read(reader)
-        (self.image_format, self.is_mutable, self.width, self.height) = unpack(
-            "<B?II", reader.read(10)
-        )
-        if not self.is_mutable:
-            pal = unpack("<I", reader.read(4))[0]
-            for _ in range(pal):
-                self.palette.append(unpack("<B", reader.read(1))[0])
-            pxl = unpack("<I", reader.read(4))[0]
-            for _ in range(pxl):
-                self.pixels.append(unpack("<B", reader.read(1))[0])
+    @classmethod
+    def from_png(cls, data):
+        """Returns an immutable image decoded from the data of a PNG file"""
+        image = cls()
+        image.is_mutable = False
+        (
+            image.width,
+            image.height,
+            image.image_format,
+            image.palette,
+            image.pixels,
+        ) = decode_png(data)
+        return image
+
+    def to_rgba(self):
+        """Decode the image into a contiguous RGBA8 buffer"""
+        return decode_rgba(self)
+
+    def save_png(self, path):
+        """Write the image to a PNG file"""
+        write_png(path, self.width, self.height, self.to_rgba())
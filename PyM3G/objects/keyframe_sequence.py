@@ -1,15 +1,56 @@
 """Keyframe Sequence Class"""
 
-from struct import unpack
-from PyM3G.util import obj2str, const2str
+from array import array
+from struct import error as StructError, pack, unpack_from
+from PyM3G.schema import Custom, Payload
+from PyM3G.util import array_bytes, obj2str, const2str, read_array
 from PyM3G.objects.object3d import Object3D
 
+_value_types = {0: ("f", 4), 1: ("B", 1), 2: ("H", 2)}
+
+
+def _field(block, record, start, size):
+    """Gather one fixed-size field out of every record of an interleaved block"""
+    count = len(block) // record
+    out = bytearray(count * size)
+    for byte in range(size):
+        out[byte::size] = block[start + byte :: record]
+    return bytes(out)
+
+
+def _interleave(fields, sizes):
+    """Interleave fixed-size fields into records, the inverse of _field"""
+    record = sum(sizes)
+    count = len(fields[0]) // sizes[0] if sizes[0] else 0
+    out = bytearray(count * record)
+    start = 0
+    for data, size in zip(fields, sizes):
+        for byte in range(size):
+            out[start + byte :: record] = data[byte::size]
+        start += size
+    return bytes(out)
+
 
 class KeyframeSequence(Object3D):
     """
     Encapsulates animation data as a sequence of time-stamped, vector-valued keyframes
     """
 
+    _layout = [
+        ("interpolation", "B"),
+        ("repeat_mode", "B"),
+        ("encoding", "B"),
+        ("duration", "I"),
+        ("valid_range_first", "I"),
+        ("valid_range_last", "I"),
+        ("component_count", "I"),
+        ("keyframe_count", "I"),
+        Custom("keyframes"),
+    ]
+
+    time = Payload()
+    vector_value = Payload()
+
     def __init__(self):
         super().__init__()
         self.interpolation = None
@@ -20,10 +61,10 @@ class KeyframeSequence(Object3D):
         self.valid_range_last = None
         self.component_count = None
         self.keyframe_count = None
-        self.time = []
-        self.vector_value = []
-        self.vector_bias = []
-        self.vector_scale = []
+        self.time = array("I")
+        self.vector_value = array("f")
+        self.vector_bias = ()
+        self.vector_scale = ()
 
     def __str__(self):
         return obj2str(
@@ -38,60 +79,52 @@ class KeyframeSequence(Object3D):
                 ("Component Count", self.component_count),
                 ("Keyframe Count", self.keyframe_count),
                 ("Time", f"Array of {len(self.time)} items"),
-                ("Vector Value", f"Array of {len(self.vector_value)} items"),
+                ("Vector Value", f"Array of {self.keyframe_count} items"),
                 ("Vector Bias", f"Array of {len(self.vector_bias)} items"),
                 ("Vector Scale", f"Array of {len(self.vector_scale)} items"),
             ],
         )
 
-    def read(self, reader):
-        super().read(reader)
-        (
-            self.interpolation,
-            self.repeat_mode,
-            self.encoding,
-            self.duration,
-            self.valid_range_first,
-            self.valid_range_last,
-            self.component_count,
-            self.keyframe_count,
-        ) = unpack("<3B5I", reader.read(23))
-        if self.encoding == 0:
-            for _ in range(self.keyframe_count):
-                self.time.append(unpack("<I", reader.read(4))[0])
-                self.vector_value.append(
-                    unpack(
-                        f"<{self.component_count}f",
-                        reader.read(4 * self.component_count),
-                    )
-                )
-        elif self.encoding == 1:
-            self.vector_bias = unpack(
-                f"<{self.component_count}f", reader.read(4 * self.component_count)
-            )
-            self.vector_scale = unpack(
-                f"<{self.component_count}f", reader.read(4 * self.component_count)
-            )
-            for _ in range(self.keyframe_count):
-                self.time.append(unpack("<I", reader.read(4))[0])
-                self.vector_value.append(
-                    unpack(
-                        f"<{self.component_count}B",
-                        reader.read(self.component_count),
-                    )
-                )
-        elif self.encoding == 2:
-            self.vector_bias = unpack(
-                f"<{self.component_count}f", reader.read(4 * self.component_count)
+    def _decode_keyframes(self, data, offset):
+        if self.encoding not in _value_types:
+            return offset
+        v_t, v_s = _value_types[self.encoding]
+        count = self.component_count
+        if self.encoding != 0:
+            self.vector_bias = unpack_from(f"<{count}f", data, offset)
+            self.vector_scale = unpack_from(f"<{count}f", data, offset + 4 * count)
+            offset += 8 * count
+        record = 4 + v_s * count
+        size = record * self.keyframe_count
+        if offset + size > len(data):
+            raise StructError(f"{size} bytes of keyframe data needed")
+        block = data[offset : offset + size]
+        self.time = read_array("I", _field(block, record, 0, 4))
+        self.vector_value = read_array(v_t, _field(block, record, 4, v_s * count))
+        return offset + size
+
+    def _encode_keyframes(self):
+        if self.encoding not in _value_types:
+            return b""
+        v_t, v_s = _value_types[self.encoding]
+        count = self.component_count
+        parts = []
+        if self.encoding != 0:
+            parts.append(
+                pack(f"<{2 * count}f", *self.vector_bias, *self.vector_scale)
             )
-            self.vector_scale = unpack(
-                f"<{self.component_count}f", reader.read(4 * self.component_count)
+        parts.append(
+            _interleave(
+                [array_bytes("I", self.time), array_bytes(v_t, self.vector_value)],
+                [4, v_s * count],
             )
-            for _ in range(self.keyframe_count):
-                self.time.append(unpack("<I",reader.read(4))[0])
-                self.vector_value.append(
-                    unpack(
-                        f"<{self.component_count}H",
-                        reader.read(2 * self.component_count),
-                    )
-                )
+        )
+        return b"".join(parts)
+
+    def keyframe(self, index):
+        """Returns the time and the stored (still encoded) value of one keyframe"""
+        start = index * self.component_count
+        return (
+            self.time[index],
+            tuple(self.vector_value[start : start + self.component_count]),
+        )
@@ -1,6 +1,5 @@
 """Light Class"""
 
-from struct import unpack
 from PyM3G.util import obj2str, const2str
 from PyM3G.objects.node import Node
 
@@ -10,12 +9,23 @@ class Light(Node):
     A scene graph node that represents different kinds of light sources
     """
 
+    _layout = [
+        ("attenuation_constant", "f"),
+        ("attenuation_linear", "f"),
+        ("attenuation_quadratic", "f"),
+        ("color", "3B"),
+        ("mode", "B"),
+        ("intensity", "f"),
+        ("spot_angle", "f"),
+        ("spot_exponent", "f"),
+    ]
+
     def __init__(self):
         super().__init__()
         self.attenuation_constant = 1.0
         self.attenuation_linear = 1.0
         self.attenuation_quadratic = 1.0
-        self.color = (0, 0, 0, 0)
+        self.color = (255, 255, 255)
         self.mode = 129
         self.intensity = 1.0
         self.spot_angle = 45
@@ -35,15 +45,3 @@ class Light(Node):
                 ("Spot Exponent", self.spot_exponent),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        (
-            self.attenuation_constant,
-            self.attenuation_linear,
-            self.attenuation_quadratic,
-        ) = unpack("<3f", reader.read(12))
-        self.color = unpack("<3f", reader.read(12))
-        (self.intensity, self.spot_angle, self.spot_exponent) = unpack(
-            "<3f", reader.read(12)
-        )
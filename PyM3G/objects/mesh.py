@@ -1,6 +1,6 @@
 """Mesh Class"""
 
-from struct import unpack
+from PyM3G.schema import REF, Records
 from PyM3G.util import obj2str
 from PyM3G.objects.node import Node
 
@@ -10,6 +10,11 @@ class Mesh(Node):
     A scene graph node that represents a 3D object defined as a polygonal surface.
     """
 
+    _layout = [
+        ("vertex_buffer", REF),
+        Records([("index_buffer", REF), ("appearance", REF)], count="submesh_count"),
+    ]
+
     def __init__(self):
         super().__init__()
         self.vertex_buffer = None
@@ -27,10 +32,3 @@ class Mesh(Node):
                 ("Appearance", self.appearance),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.vertex_buffer, self.submesh_count = unpack("<II", reader.read(8))
-        for _ in range(self.submesh_count):
-            self.index_buffer.append(unpack("<I", reader.read(4))[0])
-            self.appearance.append(unpack("<I", reader.read(4))[0])
@@ -1,6 +1,6 @@
 """Morphing Mesh Class"""
 
-from struct import unpack
+from PyM3G.schema import REF, Records
 from PyM3G.util import obj2str
 from PyM3G.objects.mesh import Mesh
 
@@ -10,6 +10,13 @@ class MorphingMesh(Mesh):
     A scene graph node that represents a vertex morphing polygon mesh
     """
 
+    _layout = [
+        Records(
+            [("morph_target", REF), ("initial_weight", "f")],
+            count="morph_target_count",
+        )
+    ]
+
     def __init__(self):
         super().__init__()
         self.morph_target_count = None
@@ -25,11 +32,3 @@ class MorphingMesh(Mesh):
                 ("Initial Weight", f"Array of {len(self.initial_weight)} items"),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.morph_target_count = unpack("<I", reader.read(4))
-        for _ in range(self.morph_target_count):
-            morph_target, initial_weight = unpack("<If", 8)
-            self.morph_target.append(morph_target)
-            self.initial_weight.append(initial_weight)
@@ -1,6 +1,6 @@
 """Node Class"""
 
-from struct import unpack
+from PyM3G.schema import REF, When
 from PyM3G.objects.transformable import Transformable
 
 
@@ -9,6 +9,23 @@ class Node(Transformable):
     An abstract base class for all scene graph nodes
     """
 
+    _layout = [
+        ("enable_rendering", "?"),
+        ("enable_picking", "?"),
+        ("alpha_factor", "B", 255),
+        ("scope", "i"),
+        ("has_alignment", "?"),
+        When(
+            "has_alignment",
+            [
+                ("z_target", "B"),
+                ("y_target", "B"),
+                ("z_reference", REF),
+                ("y_reference", REF),
+            ],
+        ),
+    ]
+
     def __init__(self):
         super().__init__()
         self.enable_rendering = True
@@ -20,18 +37,3 @@ class Node(Transformable):
         self.y_target = None
         self.z_reference = None
         self.y_reference = None
-
-    def read(self, reader):
-        super().read(reader)
-        (
-            self.enable_rendering,
-            self.enable_picking,
-            self.alpha_factor,
-            self.scope,
-            self.has_alignment,
-        ) = unpack("<??BI?", reader.read(8))
-        if self.has_alignment:
-            (self.z_target, self.y_target, self.z_reference, self.y_reference) = unpack(
-                "<BBII", reader.read(10)
-            )
-        self.alpha_factor = self.alpha_factor / 255.0
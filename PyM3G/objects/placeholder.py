@@ -0,0 +1,20 @@
+"""Placeholder Class"""
+
+from PyM3G.util import obj2str
+
+
+class Placeholder:
+    """
+    Stands in for an object that was skipped by the reader's type filter or could
+    not be read, so that the ids of the objects following it stay correct
+    """
+
+    def __init__(self, object_type=None, size=0):
+        self.object_type = object_type
+        self.size = size
+
+    def __str__(self):
+        return obj2str(
+            "Placeholder",
+            [("Object Type", self.object_type), ("Size", self.size)],
+        )
@@ -1,6 +1,5 @@
 """Polygon Mode Class"""
 
-from struct import unpack
 from PyM3G.util import obj2str, const2str
 from PyM3G.objects.object3d import Object3D
 
@@ -10,6 +9,15 @@ class PolygonMode(Object3D):
     An Appearance component encapsulating polygon-level attributes
     """
 
+    _layout = [
+        ("culling", "B"),
+        ("shading", "B"),
+        ("winding", "B"),
+        ("two_sided_lighting_enabled", "?"),
+        ("local_camera_lighting_enabled", "?"),
+        ("perspective_correction_enabled", "?"),
+    ]
+
     def __init__(self):
         super().__init__()
         self.culling = 160
@@ -31,14 +39,3 @@ class PolygonMode(Object3D):
                 ("Perspective Correction Enabled", self.perspective_correction_enabled),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        (
-            self.culling,
-            self.shading,
-            self.winding,
-            self.two_sided_lighting_enabled,
-            self.local_camera_lighting_enabled,
-            self.perspective_correction_enabled,
-        ) = unpack("<3B3?", reader.read(6))
@@ -1,6 +1,6 @@
 """Skinned Mesh Class"""
 
-from struct import unpack
+from PyM3G.schema import REF, Records
 from PyM3G.util import obj2str
 from PyM3G.objects.mesh import Mesh
 
@@ -10,6 +10,19 @@ class SkinnedMesh(Mesh):
     A scene graph node that represents a skeletally animated polygon mesh
     """
 
+    _layout = [
+        ("skeleton", REF),
+        Records(
+            [
+                ("transform_node", REF),
+                ("first_vertex", "I"),
+                ("vertex_count", "I"),
+                ("weight", "i"),
+            ],
+            count="transform_reference_count",
+        ),
+    ]
+
     def __init__(self):
         super().__init__()
         self.skeleton = None
@@ -31,15 +44,3 @@ class SkinnedMesh(Mesh):
                 ("Weight", f"Array of {len(self.weight)} items"),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.skeleton, self.transform_reference_count = unpack("<II", reader.read(8))
-        for _ in range(self.transform_reference_count):
-            (transform_node, first_vertex, vertex_count, weight) = unpack(
-                "<3Ii", reader.read(16)
-            )
-            self.transform_node.append(transform_node)
-            self.first_vertex.append(first_vertex)
-            self.vertex_count.append(vertex_count)
-            self.weight.append(weight)
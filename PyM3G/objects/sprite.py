@@ -1,6 +1,6 @@
 """Sprite Class"""
 
-from struct import unpack
+from PyM3G.schema import REF
 from PyM3G.util import obj2str
 from PyM3G.objects.node import Node
 
@@ -10,6 +10,16 @@ class Sprite(Node):
     A scene graph node that represents a 2-dimensional image with a 3D position
     """
 
+    _layout = [
+        ("image", REF),
+        ("appearance", REF),
+        ("is_scaled", "?"),
+        ("crop_x", "i"),
+        ("crop_y", "i"),
+        ("crop_width", "i"),
+        ("crop_height", "i"),
+    ]
+
     def __init__(self):
         super().__init__()
         self.image = None
@@ -33,15 +43,3 @@ class Sprite(Node):
                 ("Crop Height", self.crop_height),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        (
-            self.image,
-            self.appearance,
-            self.is_scaled,
-            self.crop_x,
-            self.crop_y,
-            self.crop_width,
-            self.crop_height,
-        ) = unpack("<II?4i", reader.read(25))
@@ -1,6 +1,6 @@
 """Texture2D Class"""
 
-from struct import unpack
+from PyM3G.schema import REF
 from PyM3G.util import obj2str, const2str
 from PyM3G.objects.transformable import Transformable
 
@@ -11,10 +11,20 @@ class Texture2D(Transformable):
     attributes specifying how the image is to be applied on submeshes
     """
 
+    _layout = [
+        ("image", REF),
+        ("blend_color", "3B"),
+        ("blending", "B"),
+        ("wrapping_s", "B"),
+        ("wrapping_t", "B"),
+        ("level_filter", "B"),
+        ("image_filter", "B"),
+    ]
+
     def __init__(self):
         super().__init__()
         self.image = None
-        self.blend_color = (0.0, 0.0, 0.0, 0.0)
+        self.blend_color = (0, 0, 0)
         self.blending = 227
         self.wrapping_s = 241
         self.wrapping_t = 241
@@ -34,15 +44,3 @@ class Texture2D(Transformable):
                 ("Image Filter", const2str(self.image_filter)),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.image = unpack("<I", reader.read(4))[0]
-        self.blend_color = unpack("<3B", reader.read(3))
-        (
-            self.blending,
-            self.wrapping_s,
-            self.wrapping_t,
-            self.level_filter,
-            self.image_filter,
-        ) = unpack("<5B", reader.read(5))
@@ -1,6 +1,6 @@
 """Transformable Class"""
 
-from struct import unpack
+from PyM3G.schema import When
 from PyM3G.objects.object3d import Object3D
 
 
@@ -10,6 +10,21 @@ class Transformable(Object3D):
     for manipulating node and texture transformations
     """
 
+    _layout = [
+        ("has_component_transform", "?"),
+        When(
+            "has_component_transform",
+            [
+                ("translation", "3f"),
+                ("scale", "3f"),
+                ("orientation_angle", "f"),
+                ("orientation_axis", "3f"),
+            ],
+        ),
+        ("has_general_transform", "?"),
+        When("has_general_transform", [("transform", "16f")]),
+    ]
+
     def __init__(self):
         super().__init__()
         self.has_component_transform = None
@@ -19,15 +34,3 @@ class Transformable(Object3D):
         self.orientation_axis = None
         self.has_general_transform = None
         self.transform = None
-
-    def read(self, reader):
-        super().read(reader)
-        self.has_component_transform = unpack("<?", reader.read(1))[0]
-        if self.has_component_transform:
-            self.translation = unpack("<3f", reader.read(12))
-            self.scale = unpack("<3f", reader.read(12))
-            self.orientation_angle = unpack("<f", reader.read(4))[0]
-            self.orientation_axis = unpack("<3f", reader.read(12))
-        self.has_general_transform = unpack("<?", reader.read(1))[0]
-        if self.has_general_transform:
-            self.transform = unpack("<16f", reader.read(64))
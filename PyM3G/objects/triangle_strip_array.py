@@ -1,6 +1,7 @@
 """Triangle Strip Array Class"""
 
-from struct import unpack
+from array import array
+from PyM3G.schema import Payload, TypedArray, When
 from PyM3G.util import obj2str
 from PyM3G.objects.object3d import Object3D
 
@@ -10,12 +11,25 @@ class TriangleStripArray(Object3D):
     TriangleStripArray defines an array of triangle strips
     """
 
+    _layout = [
+        ("encoding", "B"),
+        When("encoding", [("start_index", "I")], value=0),
+        When("encoding", [("start_index", "B")], value=1),
+        When("encoding", [("start_index", "H")], value=2),
+        When("encoding", [TypedArray("indices", "I")], value=128),
+        When("encoding", [TypedArray("indices", "B")], value=129),
+        When("encoding", [TypedArray("indices", "H")], value=130),
+        TypedArray("strip_lengths", "I"),
+    ]
+
+    indices = Payload()
+
     def __init__(self):
         super().__init__()
         self.encoding = None
-        self.start_index = None
-        self.indices = []
-        self.strip_lengths = []
+        self.start_index = 0
+        self.indices = array("I")
+        self.strip_lengths = array("I")
 
     def __str__(self):
         return obj2str(
@@ -27,29 +41,3 @@ class TriangleStripArray(Object3D):
                 ("Strip Lengths", f"Array of {len(self.strip_lengths)} items"),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.start_index = 0
-        self.encoding = unpack("<B", reader.read(1))[0]
-        if self.encoding == 0:
-            self.start_index = unpack("<I", reader.read(4))[0]
-        elif self.encoding == 1:
-            self.start_index = unpack("<B", reader.read(1))[0]
-        elif self.encoding == 2:
-            self.start_index = unpack("<H", reader.read(2))[0]
-        elif self.encoding == 128:
-            icount = unpack("<I", reader.read(4))[0]
-            for _ in range(icount):
-                self.indices.append(unpack("<I", reader.read(4))[0])
-        elif self.encoding == 129:
-            icount = unpack("<I", reader.read(4))[0]
-            for _ in range(icount):
-                self.indices.append(unpack("<B", reader.read(1))[0])
-        elif self.encoding == 130:
-            icount = unpack("<I", reader.read(4))[0]
-            for _ in range(icount):
-                self.indices.append(unpack("<H", reader.read(2))[0])
-        scount = unpack("<I", reader.read(4))[0]
-        for _ in range(scount):
-            self.strip_lengths.append(unpack("<I", reader.read(4))[0])
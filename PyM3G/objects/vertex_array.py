@@ -1,9 +1,58 @@
 """Vertex Array Class"""
 
-from struct import unpack
-from PyM3G.util import obj2str
+from array import array
+from itertools import accumulate
+from struct import error as StructError
+import sys
+from PyM3G.schema import Custom, Payload
+from PyM3G.util import array_bytes, obj2str, read_array
 from PyM3G.objects.object3d import Object3D
 
+_component_types = {1: "b", 2: "h", 4: "f"}
+
+
+def delta_decode(values, component_count):
+    """
+    Undo the delta encoding of interleaved vertex data. Integer components wrap
+    around like the byte and short values they are stored in.
+    """
+    out = array(values.typecode, values)
+    size = values.itemsize
+    for comp in range(component_count):
+        sums = array("q" if values.typecode != "f" else "d")
+        sums.extend(accumulate(values[comp::component_count]))
+        if values.typecode == "f":
+            out[comp::component_count] = array("f", sums)
+            continue
+        # Keep only the low bytes of each 64-bit sum, which is the wrapped value
+        wide = sums.tobytes()
+        low = bytearray(len(sums) * size)
+        for byte in range(size):
+            offset = byte if sys.byteorder == "little" else 8 - size + byte
+            low[byte::size] = wide[offset::8]
+        out[comp::component_count] = array(values.typecode, bytes(low))
+    return out
+
+
+def delta_encode(values, component_count):
+    """Delta encode interleaved vertex data, the inverse of delta_decode"""
+    out = array(values.typecode, values)
+    if values.typecode == "f":
+        wrap = None
+    else:
+        bits = 8 * values.itemsize
+        wrap = (1 << (bits - 1), (1 << bits) - 1)
+    for comp in range(component_count):
+        column = values[comp::component_count]
+        deltas = [b - a for a, b in zip(column, column[1:])]
+        if wrap is not None:
+            half, mask = wrap
+            deltas = [((delta + half) & mask) - half for delta in deltas]
+        out[comp + component_count :: component_count] = array(
+            values.typecode, deltas
+        )
+    return out
+
 
 class VertexArray(Object3D):
     """
@@ -11,13 +60,23 @@ class VertexArray(Object3D):
     texture coordinates
     """
 
+    _layout = [
+        ("component_size", "B"),
+        ("component_count", "B"),
+        ("encoding", "B"),
+        ("vertex_count", "H"),
+        Custom("vertices"),
+    ]
+
+    vertices = Payload()
+
     def __init__(self):
         super().__init__()
         self.component_size = None
         self.component_count = None
         self.encoding = None
         self.vertex_count = None
-        self.vertices = []
+        self.vertices = array("f")
 
     def __str__(self):
         return obj2str(
@@ -27,55 +86,28 @@ class VertexArray(Object3D):
                 ("Component Count", self.component_count),
                 ("Encoding", self.encoding),
                 ("Vertex Count", self.vertex_count),
-                ("Vertices", f"Array of {len(self.vertices)} items"),
+                ("Vertices", f"Array of {self.vertex_count} items"),
             ],
         )
 
-    def read(self, reader):
-        super().read(reader)
-        self.vertices = []
-        (
-            self.component_size,
-            self.component_count,
-            self.encoding,
-            self.vertex_count,
-        ) = unpack("<3BH", reader.read(5))
-        if self.component_size == 1:
-            c_t = "b"
-            c_s = 1
-        elif self.component_size == 2:
-            c_t = "h"
-            c_s = 2
-        elif self.component_size == 4:
-            c_t = "f"
-            c_s = 4
-        # else:
-        # log.error("Error reading vertex array")
-        if self.encoding == 0:
-            for _ in range(self.vertex_count):
-                self.vertices.append(
-                    unpack(
-                        "<" + str(self.component_count) + c_t,
-                        reader.read(self.component_count * c_s),
-                    )
-                )
-        elif self.encoding == 1:
-            delta = (0, 0, 0, 0)
-            for _ in range(self.vertex_count):
-                vtx = unpack(
-                    "<" + str(self.component_count) + c_t,
-                    reader.read(self.component_count * c_s),
-                )
-                if self.component_count == 2:
-                    tvtx = (delta[0] + vtx[0], delta[1] + vtx[1])
-                elif self.component_count == 3:
-                    tvtx = (delta[0] + vtx[0], delta[1] + vtx[1], delta[2] + vtx[2])
-                elif self.component_count == 4:
-                    tvtx = (
-                        delta[0] + vtx[0],
-                        delta[1] + vtx[1],
-                        delta[2] + vtx[2],
-                        delta[3] + vtx[3],
-                    )
-                self.vertices.append(tvtx)
-                delta = tvtx
+    def _decode_vertices(self, data, offset):
+        size = self.component_size * self.component_count * self.vertex_count
+        if offset + size > len(data):
+            raise StructError(f"{size} bytes of vertex data needed")
+        self.vertices = read_array(
+            _component_types[self.component_size], data[offset : offset + size]
+        )
+        if self.encoding == 1:
+            self.vertices = delta_decode(self.vertices, self.component_count)
+        return offset + size
+
+    def _encode_vertices(self):
+        vertices = array(_component_types[self.component_size], self.vertices)
+        if self.encoding == 1:
+            vertices = delta_encode(vertices, self.component_count)
+        return array_bytes(vertices.typecode, vertices)
+
+    def vertex(self, index):
+        """Returns the components of one vertex as a tuple"""
+        start = index * self.component_count
+        return tuple(self.vertices[start : start + self.component_count])
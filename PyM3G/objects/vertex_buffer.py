@@ -1,6 +1,6 @@
 """Vertex Buffer Class"""
 
-from struct import unpack
+from PyM3G.schema import REF, Records
 from PyM3G.util import obj2str
 from PyM3G.objects.object3d import Object3D
 
@@ -11,9 +11,22 @@ class VertexBuffer(Object3D):
     normals, and texture coordinates for a set of vertices
     """
 
+    _layout = [
+        ("default_color", "4B"),
+        ("positions", REF),
+        ("position_bias", "3f"),
+        ("position_scale", "f"),
+        ("normals", REF),
+        ("colors", REF),
+        Records(
+            [("tex_coords", REF), ("tex_coord_bias", "3f"), ("tex_coord_scale", "f")],
+            count="texcoord_array_count",
+        ),
+    ]
+
     def __init__(self):
         super().__init__()
-        self.default_color = (1.0, 1.0, 1.0, 1.0)
+        self.default_color = (255, 255, 255, 255)
         self.positions = None
         self.position_bias = None
         self.position_scale = None
@@ -40,20 +53,3 @@ class VertexBuffer(Object3D):
                 ("Texcoord Scale", f"Array of {len(self.tex_coord_scale)} items"),
             ],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.default_color = unpack("<4B", reader.read(4))
-        self.positions = unpack("<I", reader.read(4))[0]
-        self.position_bias = unpack("<3f", reader.read(12))
-        (
-            self.position_scale,
-            self.normals,
-            self.colors,
-            self.texcoord_array_count,
-        ) = unpack("<f3I", reader.read(16))
-        if self.texcoord_array_count > 0:
-            for _ in range(self.texcoord_array_count):
-                self.tex_coords.append(unpack("<I", reader.read(4))[0])
-                self.tex_coord_bias.append(unpack("<3f", reader.read(12)))
-                self.tex_coord_scale.append(unpack("<f", reader.read(4))[0])
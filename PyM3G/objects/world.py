@@ -1,6 +1,6 @@
 """World Class"""
 
-from struct import unpack
+from PyM3G.schema import REF
 from PyM3G.util import obj2str
 from PyM3G.objects.group import Group
 
@@ -10,6 +10,8 @@ class World(Group):
     A special Group node that is a top-level container for scene graphs
     """
 
+    _layout = [("active_camera", REF), ("background", REF)]
+
     def __init__(self):
         super().__init__()
         self.active_camera = None
@@ -20,7 +22,3 @@ class World(Group):
             "World",
             [("Active Camera", self.active_camera), ("Background", self.background)],
         )
-
-    def read(self, reader):
-        super().read(reader)
-        self.active_camera, self.background = unpack("<II", reader.read(8))
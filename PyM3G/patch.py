@@ -0,0 +1,205 @@
+"""
+Patching objects of m3g files in place
+
+A Patch replaces or modifies single objects of a file and writes it back out,
+re-encoding only the sections that hold a changed object. All other sections
+are copied byte for byte, without being decompressed or compressed again; only
+sections in front of a changed object are inflated, to count their objects.
+The header section is always re-encoded, to fix up the total file size.
+"""
+
+from struct import unpack_from
+
+from PyM3G.probe import inflate_payload, read_section
+from PyM3G.reader import M3G_SIGNATURE, M3GReader
+from PyM3G.writer import encode_object, encode_section, object_type
+
+from PyM3G.objects.header import Header
+
+# Times the compressed header section is encoded for its size to settle
+HEADER_ROUNDS = 4
+
+
+class _Span:
+    """A section of the source file and, once counted, the objects it holds"""
+
+    def __init__(self, offset, end, compression, payload):
+        self.offset = offset
+        self.end = end
+        self.compression = compression
+        self.payload = payload
+        self.first_id = None
+        self.objects = None
+
+    def inflate(self):
+        """Returns the uncompressed object data of the section"""
+        return inflate_payload(self.compression, self.payload)
+
+    def count(self, first_id):
+        """Finds the type, start and end of the objects in the section"""
+        data = self.inflate()
+        self.first_id = first_id
+        self.objects = []
+        position = 0
+        while position < len(data):
+            if position + 5 > len(data):
+                raise ValueError("Truncated object header")
+            object_type, size = unpack_from("<BI", data, position)
+            if position + 5 + size > len(data):
+                raise ValueError("Truncated object data")
+            self.objects.append((object_type, position + 5, position + 5 + size))
+            position += 5 + size
+        return data
+
+
+def _set_file_size(header, total):
+    header.total_file_size = total
+    if header.has_external_references:
+        header.approximate_content_size = max(
+            header.approximate_content_size or 0, total
+        )
+    else:
+        header.approximate_content_size = total
+
+
+class Patch:
+    """
+    Changes to the objects of an m3g file. edit decodes an object so it can be
+    modified, replace swaps in another object; encode and write return or write
+    the patched file. Object ids are those of M3GReader.
+    """
+
+    def __init__(self, path, level=6):
+        self.path = path
+        self.level = level
+        with open(path, "rb") as file:
+            self.data = file.read()
+        if not self.data.startswith(M3G_SIGNATURE):
+            raise ValueError(f"Invalid or obfuscated M3G file {path}")
+        self.spans = []
+        offset = len(M3G_SIGNATURE)
+        while offset < len(self.data):
+            section = read_section(self.data, offset)
+            if isinstance(section, str):
+                raise ValueError(f"{section} (section {len(self.spans)})")
+            compression, payload, end = section
+            self.spans.append(_Span(offset, end, compression, payload))
+            offset = end
+        if not self.spans:
+            raise ValueError(f"No sections in {path}")
+        self.changes = {}
+
+    def _locate(self, obj_id):
+        """Returns the span and the uncompressed data of the section of an object"""
+        if obj_id < 1:
+            raise ValueError(f"Invalid object id {obj_id}")
+        first_id = 1
+        for span in self.spans:
+            data = None
+            if span.objects is None:
+                data = span.count(first_id)
+            if obj_id < first_id + len(span.objects):
+                return span, data if data is not None else span.inflate()
+            first_id += len(span.objects)
+        raise ValueError(f"Object {obj_id} not found in {self.path}")
+
+    def edit(self, obj_id):
+        """
+        Returns the object with an id, decoded from the file. Changes made to it
+        are written with the patched file.
+        """
+        if obj_id in self.changes:
+            return self.changes[obj_id]
+        span, data = self._locate(obj_id)
+        objtype, start, end = span.objects[obj_id - span.first_id]
+        if objtype not in M3GReader._type2class:
+            raise ValueError(f"Object {obj_id} has an invalid type {objtype}")
+        obj = M3GReader._type2class[objtype]()
+        obj.decode(data[start:end])
+        self.changes[obj_id] = obj
+        return obj
+
+    def replace(self, obj_id, obj):
+        """Replaces the object with an id"""
+        if obj_id == 1 and not isinstance(obj, Header):
+            raise ValueError("Object 1 has to be a Header")
+        object_type(obj)
+        self._locate(obj_id)
+        self.changes[obj_id] = obj
+
+    def _encode_span(self, span, compress=True):
+        data = span.inflate()
+        chunks = []
+        for index, (_, start, end) in enumerate(span.objects):
+            obj = self.changes.get(span.first_id + index)
+            if obj is None:
+                chunks.append(data[start - 5 : end])
+            else:
+                chunks.append(encode_object(obj))
+        compress = compress and span.compression == 1
+        return encode_section(b"".join(chunks), compress, self.level)
+
+    def encode_sections(self):
+        """
+        Returns the signature and sections of the patched file, unchanged
+        sections as views of the source data
+        """
+        header = self.edit(1)
+        source = memoryview(self.data)
+        sections = [source[: len(M3G_SIGNATURE)]]
+        for span in self.spans:
+            changed = span.objects is not None and any(
+                span.first_id <= obj_id < span.first_id + len(span.objects)
+                for obj_id in self.changes
+            )
+            if changed and span is not self.spans[0]:
+                sections.append(self._encode_span(span))
+            else:
+                sections.append(source[span.offset : span.end])
+
+        # The header section is encoded until its size stops changing, which it
+        # only does when the section is compressed. Should the compressed size
+        # not settle within HEADER_ROUNDS, the header section is stored
+        # uncompressed, as its size then no longer depends on the file size.
+        rest = len(M3G_SIGNATURE) + sum(len(section) for section in sections[2:])
+        size = len(sections[1])
+        for _ in range(HEADER_ROUNDS):
+            _set_file_size(header, rest + size)
+            sections[1] = self._encode_span(self.spans[0])
+            if len(sections[1]) == size:
+                return sections
+            size = len(sections[1])
+        size = len(self._encode_span(self.spans[0], False))
+        _set_file_size(header, rest + size)
+        sections[1] = self._encode_span(self.spans[0], False)
+        return sections
+
+    def encode(self):
+        """Returns the patched file"""
+        return b"".join(self.encode_sections())
+
+    def write(self, path):
+        """Writes the patched file"""
+        sections = self.encode_sections()
+        with open(path, "wb") as file:
+            file.writelines(sections)
+
+
+def patch_file(source, destination, changes, level=6):
+    """
+    Patches the objects of a file and writes the result. changes maps object
+    ids to objects that replace them, or to functions that are called with the
+    decoded object and return its replacement, or None after modifying it in
+    place. Returns the Patch.
+    """
+    patch = Patch(source, level)
+    for obj_id, change in changes.items():
+        if callable(change):
+            obj = patch.edit(obj_id)
+            replacement = change(obj)
+            if replacement is not None:
+                patch.replace(obj_id, replacement)
+        else:
+            patch.replace(obj_id, change)
+    patch.write(destination)
+    return patch
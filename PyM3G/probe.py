@@ -0,0 +1,207 @@
+"""
+Fast probing of m3g files for corpus triage
+
+probe reads only the signature and the first section of a file and decodes the
+Header object in it, without constructing an M3GReader. With census=True it also
+walks the object headers of all sections and counts the objects per type, but
+never decodes an object's payload.
+"""
+
+from os import fstat
+from struct import error as StructError, unpack_from
+import zlib
+
+from PyM3G.reader import M3GReader, M3G_SIGNATURE
+from PyM3G.util import M3GStatus, fishlabs_deobfuscate, fishlabs_span, obj2str
+
+from PyM3G.objects.header import Header
+
+_HEAD_SIZE = 4096
+
+
+def _read_start(file, file_size, size):
+    """
+    Returns the first size bytes of a file with Fishlabs obfuscation undone and
+    whether the file was obfuscated, or None when there is no m3g signature.
+    Obfuscation swaps the first and last bytes of a file, so the start of an
+    obfuscated file is read back from its end.
+    """
+    file.seek(0)
+    span = fishlabs_span(file_size)
+    if file_size <= size + span:
+        data = file.read()
+        if data.startswith(M3G_SIGNATURE):
+            return data, False
+        data = fishlabs_deobfuscate(data)
+        return (data, True) if data.startswith(M3G_SIGNATURE) else None
+    data = file.read(size)
+    if data.startswith(M3G_SIGNATURE):
+        return data, False
+    file.seek(-span, 2)
+    start = file.read(span)[::-1]
+    if not start.startswith(M3G_SIGNATURE):
+        return None
+    return start + data[span:], True
+
+
+def _type_name(object_type):
+    if object_type in M3GReader._type2class:
+        return M3GReader._type2class[object_type].__name__
+    return f"Unknown({object_type})"
+
+
+class Probe:
+    """
+    What probe found out about a file: status, size, whether it is Fishlabs
+    obfuscated, the Header object (None if it could not be read) and, for a
+    census, the number of sections and of objects per type name.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.status = M3GStatus.FAILED
+        self.file_size = 0
+        self.obfuscated = False
+        self.header = None
+        self.sections = None
+        self.types = None
+        self.errors = []
+
+    def error(self, message):
+        """Record an error and mark the probe as partial"""
+        self.errors.append(message)
+        if self.status == M3GStatus.SUCCESS:
+            self.status = M3GStatus.PARTIAL
+
+    @property
+    def objects(self):
+        """Total number of objects counted by the census, or None"""
+        return None if self.types is None else sum(self.types.values())
+
+    def to_dict(self):
+        """Returns the probe as a JSON serializable dict"""
+        header = self.header
+        return {
+            "file": self.path,
+            "status": self.status.name,
+            "file_size": self.file_size,
+            "obfuscated": self.obfuscated,
+            "version": f"{header.version[0]}.{header.version[1]}" if header else None,
+            "has_external_references": (
+                header.has_external_references if header else None
+            ),
+            "total_file_size": header.total_file_size if header else None,
+            "approximate_content_size": (
+                header.approximate_content_size if header else None
+            ),
+            "authoring_field": header.authoring_field if header else None,
+            "sections": self.sections,
+            "objects": self.objects,
+            "types": self.types,
+            "errors": self.errors,
+        }
+
+    def __str__(self):
+        return obj2str("Probe", list(self.to_dict().items()))
+
+
+def read_section(data, offset):
+    """
+    Returns the compression, payload and end offset of the section of file
+    data at offset after checking its checksum, or an error message string
+    """
+    if len(data) < offset + 9:
+        return "Truncated section header"
+    compression, total_len, _ = unpack_from("<BII", data, offset)
+    end = offset + total_len
+    if total_len < 13 or end > len(data):
+        return "Truncated section"
+    body = data[offset : end - 4]
+    if zlib.adler32(body) != unpack_from("<I", data, end - 4)[0]:
+        return "Checksums do not match"
+    return compression, body[9:], end
+
+
+def inflate_payload(compression, payload):
+    """Returns the object data of a section payload read with read_section"""
+    if compression == 0:
+        return payload
+    if compression == 1:
+        return zlib.decompress(payload)
+    raise ValueError(f"Unknown compression scheme {compression}")
+
+
+def _read_header(result, data):
+    section = read_section(data, len(M3G_SIGNATURE))
+    if isinstance(section, str):
+        result.error(section)
+        if section == "Checksums do not match":
+            result.status = M3GStatus.CHECKSUM_FAIL
+        return
+    try:
+        objects = inflate_payload(section[0], section[1])
+        object_type, size = unpack_from("<BI", objects)
+        if object_type != 0:
+            raise ValueError(f"First object is a {_type_name(object_type)}")
+        header = Header()
+        header.decode(objects[5 : 5 + size])
+    except (ValueError, StructError, zlib.error) as err:
+        result.error(f"Could not read header: {err}")
+        return
+    result.header = header
+    result.status = M3GStatus.SUCCESS
+
+
+def _census(result, data):
+    result.sections = 0
+    result.types = {}
+    offset = len(M3G_SIGNATURE)
+    while offset < len(data):
+        section = read_section(data, offset)
+        if isinstance(section, str):
+            result.error(f"{section} (section {result.sections})")
+            return
+        compression, payload, offset = section
+        try:
+            objects = inflate_payload(compression, payload)
+        except (ValueError, zlib.error) as err:
+            result.error(f"{err} (section {result.sections})")
+            result.sections += 1
+            continue
+        position = 0
+        while position < len(objects):
+            if position + 5 > len(objects):
+                result.error(f"Truncated object header (section {result.sections})")
+                break
+            object_type, size = unpack_from("<BI", objects, position)
+            name = _type_name(object_type)
+            result.types[name] = result.types.get(name, 0) + 1
+            position += 5 + size
+        if position > len(objects):
+            result.error(f"Truncated object data (section {result.sections})")
+        result.sections += 1
+
+
+def probe(path, census=False):
+    """
+    Probe a file: read its signature and Header object and, with census=True,
+    count its objects per type. Format errors are recorded in the returned
+    Probe instead of raised.
+    """
+    result = Probe(path)
+    with open(path, "rb") as file:
+        result.file_size = fstat(file.fileno()).st_size
+        start = _read_start(file, result.file_size, _HEAD_SIZE)
+        if start is None:
+            result.error("Invalid M3G signature")
+            return result
+        data, result.obfuscated = start
+        offset = len(M3G_SIGNATURE)
+        if len(data) >= offset + 9:
+            needed = offset + unpack_from("<I", data, offset + 1)[0]
+            if needed > len(data) or census:
+                data = _read_start(file, result.file_size, result.file_size)[0]
+    _read_header(result, data)
+    if census and result.header is not None:
+        _census(result, data)
+    return result
@@ -0,0 +1,299 @@
+"""
+Choosing the smallest encoding of vertex arrays and keyframe sequences
+
+Vertex arrays used as positions or texture coordinates are stored in the fewest
+bytes per component that represent their values: integers (or floats) that lie
+on a power of two grid are moved into byte or short range losslessly, and with
+max_error > 0 any array is quantized as long as no value moves further than
+that. The scale and bias this needs are folded into the VertexBuffers that use
+the array. Keyframe sequences are quantized to 8 or 16 bits with a per
+component bias and scale in the same way.
+
+Lossless means that every value evaluates (scale * value + bias, rounded to a
+32-bit float) to exactly what it did before. Normals, colors and the arrays of
+morphing meshes keep their values; for them and all other integer arrays only
+the delta encoding is chosen, whichever compresses better.
+"""
+
+from array import array
+from math import gcd
+import zlib
+
+from PyM3G.animation import decoded_values
+from PyM3G.objects.keyframe_sequence import KeyframeSequence
+from PyM3G.objects.morphing_mesh import MorphingMesh
+from PyM3G.objects.vertex_array import VertexArray, delta_encode
+from PyM3G.objects.vertex_buffer import VertexBuffer
+from PyM3G.util import array_bytes
+
+# Component size, typecode, lowest value and number of steps of vertex arrays
+_VERTEX_RANGES = ((1, "b", -128, 255), (2, "h", -32768, 65535))
+
+# Encoding, typecode and largest value of quantized keyframe sequences
+_KEYFRAME_RANGES = ((1, "B", 255), (2, "H", 65535))
+
+
+def _float32(value):
+    return array("f", [value])[0]
+
+
+def _scaled_owners(reader):
+    """
+    Returns the VertexBuffers (with the texture unit, None for positions) that
+    use each vertex array with a scale and bias, and the ids of the arrays that
+    have to keep their values
+    """
+    owners = {}
+    pinned = set()
+    for obj in reader.objects:
+        if isinstance(obj, MorphingMesh):
+            for vb_id in [obj.vertex_buffer] + list(obj.morph_target):
+                vertex_buffer = reader.get_object_by_id(vb_id)
+                if isinstance(vertex_buffer, VertexBuffer):
+                    pinned.add(vertex_buffer.positions)
+                    pinned.update(vertex_buffer.tex_coords)
+        if not isinstance(obj, VertexBuffer):
+            continue
+        pinned.update((obj.normals, obj.colors))
+        if obj.positions:
+            owners.setdefault(obj.positions, []).append((obj, None))
+        for unit, va_id in enumerate(obj.tex_coords):
+            owners.setdefault(va_id, []).append((obj, unit))
+    pinned.discard(0)
+    return owners, pinned
+
+
+def _scale_bias(vertex_buffer, unit):
+    if unit is None:
+        return vertex_buffer.position_scale, tuple(vertex_buffer.position_bias)
+    return (
+        vertex_buffer.tex_coord_scale[unit],
+        tuple(vertex_buffer.tex_coord_bias[unit]),
+    )
+
+
+def _set_scale_bias(vertex_buffer, unit, scale, bias):
+    if unit is None:
+        vertex_buffer.position_scale = scale
+        vertex_buffer.position_bias = bias
+    else:
+        vertex_buffer.tex_coord_scale[unit] = scale
+        vertex_buffer.tex_coord_bias[unit] = bias
+
+
+def _evaluated(columns, scale, bias):
+    return [
+        array("f", [scale * value + offset for value in column])
+        for column, offset in zip(columns, bias)
+    ]
+
+
+def _grid_candidates(columns):
+    """
+    Yields the component size, typecode, integer columns, step and offsets of
+    each integer range the columns fit into losslessly: value = step * integer +
+    offset. The step is a power of two, found from the exact binary fractions of
+    the values. Integers centered on zero are tried first, as their offsets
+    are smaller, then integers starting at the lowest value of the range.
+    """
+    try:
+        ratios = [
+            [float(value).as_integer_ratio() for value in column] for column in columns
+        ]
+    except (OverflowError, ValueError):
+        return
+    denominator = max(den for column in ratios for _, den in column)
+    integers = [
+        [num * (denominator // den) for num, den in column] for column in ratios
+    ]
+    lows = [min(column) for column in integers]
+    step = 0
+    for column, low in zip(integers, lows):
+        for value in column:
+            step = gcd(step, value - low)
+    step = step & -step or 1
+    spread = max(max(column) - low for column, low in zip(integers, lows)) // step
+    for size, typecode, lowest, steps in _VERTEX_RANGES:
+        if spread > steps:
+            continue
+        for start in dict.fromkeys((max(lowest, -((spread + 1) // 2)), lowest)):
+            quantized = [
+                [(value - low) // step + start for value in column]
+                for column, low in zip(integers, lows)
+            ]
+            offsets = [(low - start * step) / denominator for low in lows]
+            yield size, typecode, quantized, step / denominator, offsets
+
+
+def _bounded_candidates(columns):
+    """
+    Yields the same as _grid_candidates for columns rounded to byte and short
+    range, with a step spanning the widest column
+    """
+    lows = [min(column) for column in columns]
+    spread = max(max(column) - low for column, low in zip(columns, lows))
+    for size, typecode, lowest, steps in _VERTEX_RANGES:
+        step = spread / steps or 1.0
+        quantized = [
+            [min(steps, round((value - low) / step)) + lowest for value in column]
+            for column, low in zip(columns, lows)
+        ]
+        offsets = [low - lowest * step for low in lows]
+        yield size, typecode, quantized, step, offsets
+
+
+def _interleave(typecode, columns):
+    width = len(columns)
+    size = array(typecode).itemsize * width * len(columns[0])
+    vertices = array(typecode, bytes(size))
+    for comp, column in enumerate(columns):
+        vertices[comp::width] = array(typecode, column)
+    return vertices
+
+
+def quantize_vertex_array(reader, va_id, max_error=0.0, owners=None):
+    """
+    Stores a vertex array in fewer bytes per component when its values allow it
+    (see the module docstring) and returns whether it was changed. owners are
+    the VertexBuffers using the array with the texture unit or None for
+    positions, found in the reader when not given.
+    """
+    if owners is None:
+        all_owners, pinned = _scaled_owners(reader)
+        if va_id in pinned:
+            return False
+        owners = all_owners.get(va_id, [])
+    vertex_array = reader.get_object_by_id(va_id)
+    if not owners or not vertex_array.vertex_count:
+        return False
+    count = vertex_array.component_count
+    scales = {_scale_bias(vb, unit)[0] for vb, unit in owners}
+    biases = {_scale_bias(vb, unit)[1][:count] for vb, unit in owners}
+    if len(scales) > 1 or len(biases) > 1 or not scales.pop() or count > 3:
+        return False
+    scale, bias = _scale_bias(*owners[0])
+    columns = [vertex_array.vertices[comp::count] for comp in range(count)]
+    before = _evaluated(columns, scale, bias)
+
+    candidates = list(_grid_candidates(columns))
+    if max_error > 0:
+        candidates += _bounded_candidates(columns)
+    candidates.sort(key=lambda candidate: candidate[0])
+    for size, typecode, quantized, step, offsets in candidates:
+        if size >= vertex_array.component_size:
+            break
+        new_scale = _float32(scale * step)
+        new_bias = [
+            _float32(scale * offset + old) for offset, old in zip(offsets, bias)
+        ]
+        after = _evaluated(quantized, new_scale, new_bias)
+        error = max(
+            abs(new - old)
+            for new_column, old_column in zip(after, before)
+            for new, old in zip(new_column, old_column)
+        )
+        if error > max_error:
+            continue
+        vertex_array.component_size = size
+        vertex_array.vertices = _interleave(typecode, quantized)
+        new_bias = tuple(new_bias) + tuple(bias[count:])
+        for vertex_buffer, unit in owners:
+            _set_scale_bias(vertex_buffer, unit, new_scale, new_bias)
+        return True
+    return False
+
+
+def choose_delta(vertex_array, level=6):
+    """
+    Sets the encoding of a vertex array to delta encoding (1) when that
+    compresses better with zlib at a level, and to plain values (0) otherwise.
+    Float arrays are always stored plain, as their deltas would round. Returns
+    the chosen encoding.
+    """
+    vertex_array.encoding = 0
+    typecode = vertex_array.vertices.typecode
+    if typecode == "f" or not vertex_array.vertex_count:
+        return 0
+    vertices = array(typecode, vertex_array.vertices)
+    plain = zlib.compress(array_bytes(typecode, vertices), level)
+    delta = zlib.compress(
+        array_bytes(typecode, delta_encode(vertices, vertex_array.component_count)),
+        level,
+    )
+    if len(delta) < len(plain):
+        vertex_array.encoding = 1
+    return vertex_array.encoding
+
+
+def quantize_keyframes(sequence, max_error=0.0):
+    """
+    Stores the values of a keyframe sequence in 8 or 16 bits per component with
+    a bias and scale, when that is smaller and moves no value by more than
+    max_error. Returns whether the sequence was changed.
+    """
+    count = sequence.component_count
+    if sequence.encoding not in (0, 1, 2) or not sequence.keyframe_count or not count:
+        return False
+    values = decoded_values(sequence)
+    columns = [array("f", [value[comp] for value in values]) for comp in range(count)]
+    size = 4 * count * sequence.keyframe_count
+    if sequence.encoding:
+        size = 8 * count + sequence.encoding * count * sequence.keyframe_count
+    for encoding, typecode, steps in _KEYFRAME_RANGES:
+        if 8 * count + encoding * count * sequence.keyframe_count >= size:
+            break
+        bias = [_float32(min(column)) for column in columns]
+        scale = [_float32(max(column) - low) for column, low in zip(columns, bias)]
+        quantized = []
+        error = 0.0
+        for column, low, span in zip(columns, bias, scale):
+            raw = [
+                max(0, min(steps, round((value - low) / span * steps))) if span else 0
+                for value in column
+            ]
+            after = array("f", [low + span * value / steps for value in raw])
+            error = max(error, max(abs(new - old) for new, old in zip(after, column)))
+            quantized.append(raw)
+        if error > max_error:
+            continue
+        sequence.encoding = encoding
+        sequence.vector_bias = tuple(bias)
+        sequence.vector_scale = tuple(scale)
+        sequence.vector_value = _interleave(typecode, quantized)
+        return True
+    return False
+
+
+def quantize(reader, max_error=0.0, keyframe_error=None, level=6):
+    """
+    Chooses the smallest encoding of every vertex array and keyframe sequence of
+    a reader (see the module docstring). max_error bounds how far positions and
+    texture coordinates may move, keyframe_error (max_error when None) how far
+    keyframe values may. Returns a report of what was changed and of the encoded
+    size of the arrays and sequences before and after.
+    """
+    if keyframe_error is None:
+        keyframe_error = max_error
+    owners, pinned = _scaled_owners(reader)
+    report = {
+        "vertex_arrays": 0,
+        "delta_encoded": 0,
+        "keyframe_sequences": 0,
+        "bytes_before": 0,
+        "bytes_after": 0,
+    }
+    for obj_id, obj in enumerate(reader.objects, 1):
+        if isinstance(obj, VertexArray):
+            report["bytes_before"] += len(obj.encode())
+            if obj_id not in pinned and quantize_vertex_array(
+                reader, obj_id, max_error, owners.get(obj_id, [])
+            ):
+                report["vertex_arrays"] += 1
+            report["delta_encoded"] += choose_delta(obj, level)
+        elif isinstance(obj, KeyframeSequence):
+            report["bytes_before"] += len(obj.encode())
+            report["keyframe_sequences"] += quantize_keyframes(obj, keyframe_error)
+        else:
+            continue
+        report["bytes_after"] += len(obj.encode())
+    return report
@@ -3,13 +3,15 @@ Module for reading JSR 184 m3g files
 """
 
 from io import BytesIO
+from os import fstat
 from struct import unpack, pack
+from concurrent.futures import ThreadPoolExecutor
 import zlib
 
 import logging
 from rich.logging import RichHandler
 
-from PyM3G.util import M3GStatus
+from PyM3G.util import M3GStatus, ReadError, fishlabs_deobfuscate
 
 from PyM3G.objects.animation_controller import AnimationController
 from PyM3G.objects.animation_track import AnimationTrack
@@ -27,6 +29,7 @@ from PyM3G.objects.light import Light
 from PyM3G.objects.material import Material
 from PyM3G.objects.mesh import Mesh
 from PyM3G.objects.morphing_mesh import MorphingMesh
+from PyM3G.objects.placeholder import Placeholder
 from PyM3G.objects.polygon_mode import PolygonMode
 from PyM3G.objects.skinned_mesh import SkinnedMesh
 from PyM3G.objects.sprite import Sprite
@@ -36,7 +39,8 @@ from PyM3G.objects.vertex_array import VertexArray
 from PyM3G.objects.vertex_buffer import VertexBuffer
 from PyM3G.objects.world import World
 
-_M3G_SIG = b"\xAB\x4A\x53\x52\x31\x38\x34\xBB\x0D\x0A\x1A\x0A"
+# The bytes every m3g file starts with
+M3G_SIGNATURE = b"\xAB\x4A\x53\x52\x31\x38\x34\xBB\x0D\x0A\x1A\x0A"
 
 
 class M3GReader:
@@ -73,7 +77,17 @@ class M3GReader:
 
     log = None
 
-    def __init__(self, path, log_level="WARNING"):
+    def __init__(
+        self,
+        path,
+        log_level="WARNING",
+        threads=1,
+        include=None,
+        exclude=None,
+        strict=True,
+        on_object=None,
+        budget=None,
+    ):
         logging.basicConfig(
             level="NOTSET",
             format="%(message)s",
@@ -84,118 +98,277 @@ class M3GReader:
         self.log.setLevel(log_level)
 
         self.status = M3GStatus.FAILED
+        self.path = path
+        self.threads = threads
+        self.strict = strict
+        self.on_object = on_object
+        self.budget = budget
+        self.source = None
+        self.errors = []
+        self.shifted_from = None
+        self.skipped_types = self.filtered_types(include, exclude)
         self.objects = []
+        self.sections = []
+        self.obfuscated = False
+        self.file_size = 0
         self.file = open(path, "rb")
         if not self.file:
             self.log.error("Could not open file %s", path)
             return
+        self.file_size = fstat(self.file.fileno()).st_size
         if not self.verify_signature():
             self.log.error("Invalid M3G file %s", path)
             self.file.close()
             return
         self.read_sections()
         self.file.close()
-        self.status = M3GStatus.SUCCESS
+        if self.status == M3GStatus.FAILED:
+            self.status = M3GStatus.PARTIAL if self.errors else M3GStatus.SUCCESS
 
-    def fishlabs_deobfuscate(self, data):
+    @classmethod
+    def type_id(cls, objtype):
+        """Returns the object type id for a type id, class or class name"""
+        if isinstance(objtype, int):
+            return objtype
+        for type_id, type_class in cls._type2class.items():
+            if objtype is type_class or objtype == type_class.__name__:
+                return type_id
+        raise ValueError(f"Unknown object type {objtype!r}")
+
+    @classmethod
+    def filtered_types(cls, include=None, exclude=None):
         """
-        From j2me-preservation/MascotCapsule
-        https://github.com/j2me-preservation/MascotCapsule/blob/master/tools/fishlabs_obfuscation.py
+        Returns the set of object type ids that are skipped when only the types in
+        include (all types if None) and none of the types in exclude are wanted.
+        The header is never skipped.
         """
-        length = len(data)
-        data = bytearray(data)
-        if length < 100:
-            var5 = 10 + length % 10
-        elif length < 200:
-            var5 = 50 + length % 20
-        elif length < 300:
-            var5 = 80 + length % 20
-        else:
-            var5 = 100 + length % 50
-        for i in range(var5):
-            var7 = data[i]
-            data[i] = data[length - i - 1]
-            data[length - i - 1] = var7
-        return bytes(data)
+        skipped = set()
+        if include is not None:
+            wanted = {cls.type_id(objtype) for objtype in include}
+            skipped.update(set(cls._type2class) - wanted)
+        if exclude is not None:
+            skipped.update(cls.type_id(objtype) for objtype in exclude)
+        skipped.discard(0)
+        return skipped
+
+    def fishlabs_deobfuscate(self, data):
+        """Undo the Fishlabs obfuscation (see util.fishlabs_deobfuscate)"""
+        return fishlabs_deobfuscate(data)
 
     def verify_signature(self):
         """Verify header bytes to make sure this is a valid m3g file"""
-        if self.file.read(12) == _M3G_SIG:
+        if self.file.read(12) == M3G_SIGNATURE:
             return True
         self.file.seek(-12,2)
-        if self.file.read(12) == _M3G_SIG[::-1]:
+        if self.file.read(12) == M3G_SIGNATURE[::-1]:
             from io import BytesIO
             self.file.seek(0)
             data = self.file.read()
             self.file = BytesIO(self.fishlabs_deobfuscate(data))
-            if self.file.read(12) == _M3G_SIG:
+            if self.file.read(12) == M3G_SIGNATURE:
                 self.log.info("Fishlabs obfuscation detected")
+                self.obfuscated = True
                 return True
         return False
 
+    def error(self, message, section=None, obj_id=None):
+        """Log an error and record it in the reader's error list"""
+        self.log.error("%s (file '%s')", message, self.path)
+        self.errors.append(ReadError(message, section, obj_id))
+
     def parse_object(self, objtype, data):
         """Parse an object out of a binary data chunk"""
-        rdr = BytesIO(data)
         if objtype in self._type2class:
             obj = self._type2class.get(objtype)()
         else:
-            obj = None
             self.log.error("Invalid object type(%d) found", objtype)
-            rdr.close()
             return None
         self.log.info(
             "Found [bold cyan]%s[/] object",
             obj.__class__.__name__,
             extra={"markup": True},
         )
-        obj.read(rdr)
-
-        bytes_unread = len(rdr.read())
-        if obj is None and bytes_unread > 0:
+        bytes_unread = len(data) - obj.decode(data)
+        if bytes_unread > 0:
             self.log.warning("%d bytes left unread", bytes_unread)
-        rdr.close()
         return obj
 
-    def read_objects(self, data):
-        """Reads all objects from a section"""
+    def read_objects(self, data, section=None):
+        """
+        Reads all objects from a section
+
+        In tolerant mode an object that fails to parse is recorded in errors and
+        replaced with a Placeholder, and reading goes on with the next object.
+        Every object is parsed from its own buffer of its declared size, so a bad
+        object can not read into the ones after it. When the reader has an
+        on_object callback it is called with the id and object of each object as
+        soon as it has been read. When the reader has a budget, the objects with
+        Payload fields are tracked by it with where they were found in the file.
+        """
         rdr = BytesIO(data)
         while True:
             object_header = rdr.read(5)
             if object_header == b"":
                 break
+            obj_id = len(self.objects) + 1
+            if len(object_header) < 5:
+                self.error("Truncated object header", section, obj_id)
+                break
             object_type, size = unpack("<BI", object_header)
-            self.objects.append(self.parse_object(object_type, rdr.read(size)))
+            if object_type in self.skipped_types:
+                rdr.seek(size, 1)
+                obj = Placeholder(object_type, size)
+            else:
+                start = rdr.tell()
+                obj = self._read_object(object_type, rdr.read(size), size, section)
+                if self.source is not None and section is not None:
+                    self.budget.track(obj, self.source, section, start, size)
+            self.objects.append(obj)
+            if self.on_object is not None:
+                self.on_object(obj_id, obj)
         rdr.close()
 
-    def read_sections(self):
-        """Reads all sections from a file"""
+    def _read_object(self, object_type, object_data, size, section):
+        obj_id = len(self.objects) + 1
+        if len(object_data) < size:
+            self.error(
+                f"Object data truncated to {len(object_data)} of {size} bytes",
+                section,
+                obj_id,
+            )
+        if object_type not in self._type2class:
+            self.error(f"Invalid object type {object_type}", section, obj_id)
+            return Placeholder(object_type, size)
+        if self.strict:
+            return self.parse_object(object_type, object_data)
+        try:
+            return self.parse_object(object_type, object_data)
+        except Exception as err:
+            self.error(f"Could not read object: {err!r}", section, obj_id)
+            return Placeholder(object_type, size)
+
+    def scan_sections(self):
+        """
+        Reads the raw data of every section from a file and validates its checksum,
+        without decompressing or parsing anything
+
+        The file offset, compression and length of the data of every scanned
+        section are recorded in sections.
+
+        A section with an unknown compression scheme or a bad checksum stops the
+        scan, unless the reader is in tolerant mode. There both are recorded in
+        errors; sections with a bad checksum are still parsed as far as possible,
+        sections with an unknown compression are returned without data. The
+        objects of such sections, and of sections that fail to decompress, are
+        lost, which shifts the ids of all objects after them: shifted_from is then
+        set to the id of the first object read after the first lost section.
+        """
+        sections = []
         while True:
             section_header = self.file.read(9)
             if section_header == b"":
                 break
+            index = len(sections)
+            if len(section_header) < 9:
+                self.error("Truncated section header", index)
+                break
             self.log.info("Section @ %d", self.file.tell())
             compression, total_len, uncomp = unpack("<BII", section_header)
             self.log.info("Compression: %s", compression)
             self.log.info("Total length: %d", total_len)
             self.log.info("Uncompressed length: %d", uncomp)
             section_length = total_len - 13
-            data = self.file.read(section_length)
-            if compression == 1:
-                self.read_objects(zlib.decompress(data))
-            elif compression == 0:
-                self.read_objects(data)
-            else:
-                self.log.error("Unknown Compression Scheme.")
-                return            
+            self.sections.append((self.file.tell(), compression, section_length))
+            data = self.file.read(max(section_length, 0))
+            checksum = self.file.read(4)
+            if section_length < 0 or len(checksum) < 4:
+                self.error("Truncated section", index)
+                break
+            if compression not in (0, 1):
+                self.error(f"Unknown compression scheme {compression}", index)
+                if self.strict:
+                    break
+                sections.append((compression, None))
+                continue
             chksum1 = zlib.adler32(pack("<BII", compression, total_len, uncomp) + data)
-            chksum2 = unpack("<I", self.file.read(4))[0]
+            chksum2 = unpack("<I", checksum)[0]
             if chksum1 != chksum2:
-                self.log.error(
-                    f"Checksums do not match, file '{self.file.name}' may be corrupt"
-                )
-                return
-            self.log.info("Checksum validated successfully")
+                self.error("Checksums do not match, file may be corrupt", index)
+                if self.strict:
+                    self.status = M3GStatus.CHECKSUM_FAIL
+                    break
+            else:
+                self.log.info("Checksum validated successfully")
+            sections.append((compression, data))
+        return sections
+
+    @staticmethod
+    def inflate_section(section):
+        """
+        Returns the uncompressed object data of a scanned section, None for a
+        section of unknown compression
+        """
+        compression, data = section
+        if compression == 1:
+            return zlib.decompress(data)
+        return data
+
+    def _inflate_tolerant(self, section):
+        try:
+            return self.inflate_section(section)
+        except zlib.error as err:
+            return err
+
+    def read_sections(self):
+        """
+        Reads all sections from a file
+
+        When the reader was created with more than one thread, the sections are
+        decompressed concurrently (zlib releases the GIL while inflating). Objects
+        are always parsed in file order so their ids stay the same.
+        """
+        sections = self.scan_sections()
+        if self.budget is not None and not self.obfuscated:
+            self.source = self.budget.source(self)
+        inflate = self.inflate_section if self.strict else self._inflate_tolerant
+        compressed = sum(1 for compression, _ in sections if compression == 1)
+        if self.threads > 1 and compressed > 1:
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                inflated = pool.map(inflate, sections)
+                for index, data in enumerate(inflated):
+                    self._read_section(index, data)
+        else:
+            for index, section in enumerate(sections):
+                self._read_section(index, inflate(section))
+
+    def _read_section(self, index, data):
+        if data is None or isinstance(data, zlib.error):
+            obj_id = len(self.objects) + 1
+            reason = "Unknown compression" if data is None else data
+            self.error(
+                f"Could not read section ({reason}), the ids of the objects "
+                f"from {obj_id} on are shifted",
+                index,
+                obj_id,
+            )
+            if self.shifted_from is None:
+                self.shifted_from = obj_id
+            return
+        self.read_objects(data, index)
 
     def get_object_by_id(self, obj_id):
-        """Returns an object based on id"""
-        return self.objects[obj_id - 1]
+        """
+        Returns an object based on id, or None for the null reference (0).
+        Resolved external references (see loader.Loader) return their target.
+        """
+        if not obj_id:
+            return None
+        obj = self.objects[obj_id - 1]
+        if isinstance(obj, ExternalReference) and obj.target is not None:
+            return obj.target
+        return obj
+
+    def add_object(self, obj):
+        """Appends a new object and returns its id"""
+        self.objects.append(obj)
+        return len(self.objects)
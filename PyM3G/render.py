@@ -0,0 +1,686 @@
+"""
+Headless software rendering of a World, for thumbnails
+
+Vertices are transformed, lit and projected per mesh as whole columns, and
+triangles are clipped against the near and far planes in clip space. They are
+drawn back to front within each Appearance layer (painter's algorithm, there is
+no depth buffer). Rasterization works on whole scanline spans: untextured,
+opaque spans are filled with one slice assignment, textures are sampled and
+modulated per span with list comprehensions and bytes.translate.
+
+Shading is flat: each triangle gets the average color of its vertices, which is
+the vertex or default color, or with a Material the result of the lighting
+equation (see lighting), under a light at the camera if the scene has no
+lights. Fog is evaluated per triangle.
+Skinned and morphing meshes are drawn in their rest pose and sprites are skipped.
+"""
+
+from math import ceil, exp, radians, sqrt, tan
+from operator import add, itemgetter
+
+from PyM3G.geometry import normal_columns, scaled_columns, strip_triangles
+from PyM3G.imaging import decode_rgba, write_png
+from PyM3G.lighting import light_vertices, scene_lights, vertex_colors, world_normals
+from PyM3G.transform import (
+    inverse,
+    local_matrix,
+    root_nodes,
+    scene_nodes,
+    transform_points,
+    translation,
+)
+
+from PyM3G.objects.background import Background
+from PyM3G.objects.camera import Camera
+from PyM3G.objects.compositing_mode import CompositingMode
+from PyM3G.objects.fog import Fog
+from PyM3G.objects.image2d import Image2D
+from PyM3G.objects.material import Material
+from PyM3G.objects.mesh import Mesh
+from PyM3G.objects.polygon_mode import PolygonMode
+from PyM3G.objects.texture2d import Texture2D
+from PyM3G.objects.world import World
+
+_PARALLEL = 49
+_PERSPECTIVE = 50
+
+_ALPHA = 64
+_ALPHA_ADD = 65
+_MODULATE = 66
+_MODULATE_X2 = 67
+_REPLACE = 68
+
+_LINEAR = 81
+
+_BORDER = 32
+
+_CULL_BACK = 160
+_CULL_FRONT = 161
+_WINDING_CW = 169
+
+_WRAP_CLAMP = 240
+_FUNC_REPLACE = 228
+
+# Fractional bits of the fixed point texel coordinates of a span
+_FIXED = 24
+_ONE = 1 << _FIXED
+
+_AUTO_FOVY = 45.0
+
+
+def perspective(fovy, aspect, near, far):
+    """Returns the projection matrix of a perspective camera"""
+    focal = 1.0 / tan(radians(fovy) / 2)
+    depth = near - far
+    return [
+        focal / aspect, 0.0, 0.0, 0.0,
+        0.0, focal, 0.0, 0.0,
+        0.0, 0.0, (far + near) / depth, 2 * far * near / depth,
+        0.0, 0.0, -1.0, 0.0,
+    ]  # fmt: skip
+
+
+def parallel(height, aspect, near, far):
+    """Returns the projection matrix of a parallel camera"""
+    depth = far - near
+    return [
+        2 / (height * aspect), 0.0, 0.0, 0.0,
+        0.0, 2 / height, 0.0, 0.0,
+        0.0, 0.0, -2 / depth, -(far + near) / depth,
+        0.0, 0.0, 0.0, 1.0,
+    ]  # fmt: skip
+
+
+def projection(camera):
+    """Returns the projection matrix of a Camera"""
+    if camera.projection_type == _PERSPECTIVE:
+        return perspective(camera.fovy, camera.aspect_ratio, camera.near, camera.far)
+    if camera.projection_type == _PARALLEL:
+        return parallel(camera.fovy, camera.aspect_ratio, camera.near, camera.far)
+    return list(camera.projection_matrix)
+
+
+class _Texture:
+    """Nearest neighbour sampling of the Image2D of a Texture2D"""
+
+    def __init__(self, reader, texture):
+        image = reader.get_object_by_id(texture.image)
+        rgba = bytes(decode_rgba(image))
+        self.width = image.width
+        self.height = image.height
+        self.texels = [rgba[i : i + 4] for i in range(0, len(rgba), 4)]
+        self.repeat_s = texture.wrapping_s != _WRAP_CLAMP
+        self.repeat_t = texture.wrapping_t != _WRAP_CLAMP
+        self.replace = texture.blending == _FUNC_REPLACE
+        self.matrix = local_matrix(texture)
+
+    @staticmethod
+    def _coords(start, end, count, size, repeat, scale):
+        """
+        Texel coordinates (times scale) of count steps from start to end. The
+        steps are taken in fixed point, so that a range yields them in C.
+        """
+        step = int((end - start) / (count - 1) * _ONE) if count > 1 else 0
+        if repeat:
+            start += size * ceil(max(0.0, -min(start, end)) / size)
+        first = int(start * _ONE)
+        fixed = range(first, first + step * count, step) if step else [first] * count
+        if repeat:
+            return [(value >> _FIXED) % size * scale for value in fixed]
+        last = size - 1
+        return [min(max(value >> _FIXED, 0), last) * scale for value in fixed]
+
+    def span(self, u0, v0, u1, v1, count):
+        """
+        Returns count RGBA texels sampled along a line from (u0, v0) to (u1, v1),
+        given in texels
+        """
+        xs = self._coords(u0, u1, count, self.width, self.repeat_s, 1)
+        ys = self._coords(v0, v1, count, self.height, self.repeat_t, self.width)
+        if count == 1:
+            return bytearray(self.texels[xs[0] + ys[0]])
+        return bytearray(b"".join(itemgetter(*map(add, xs, ys))(self.texels)))
+
+
+def _mesh_positions(reader, scene_node):
+    vertex_buffer = reader.get_object_by_id(scene_node.node.vertex_buffer)
+    if vertex_buffer is None:
+        return None
+    positions = reader.get_object_by_id(vertex_buffer.positions)
+    if positions is None:
+        return None
+    columns = scaled_columns(
+        positions, vertex_buffer.position_scale, vertex_buffer.position_bias
+    )
+    return transform_points(scene_node.matrix, *columns)
+
+
+def auto_camera(bounds, aspect):
+    """
+    Returns the camera matrix and projection that frame a bounding box
+    ((min x, min y, min z), (max x, max y, max z)) from the front (+z)
+    """
+    low, high = bounds
+    center = [(a + b) / 2 for a, b in zip(low, high)]
+    radius = max(sqrt(sum((b - a) ** 2 for a, b in zip(low, high))) / 2, 1e-6)
+    half = radians(_AUTO_FOVY) / 2
+    if aspect < 1.0:
+        half = min(half, aspect * half)
+    distance = radius / tan(half) * 1.05
+    matrix = translation(center[0], center[1], center[2] + distance)
+    near = max(distance - radius * 1.5, distance * 0.01)
+    proj = perspective(_AUTO_FOVY, aspect, near, distance + radius * 1.5)
+    return matrix, proj
+
+
+def _fog_color(fog, depth, color):
+    if fog.mode == _LINEAR:
+        span = fog.far - fog.near
+        factor = (fog.far - depth) / span if span else 1.0
+    else:
+        factor = exp(-fog.density * depth)
+    factor = min(1.0, max(0.0, factor))
+    return [
+        value * factor + channel * (1.0 - factor)
+        for value, channel in zip(color[:3], fog.color)
+    ] + [color[3]]
+
+
+def _clip(polygon, sign):
+    """Clip a polygon of clip space vertices against the near (sign 1) or far plane"""
+    out = []
+    for index, current in enumerate(polygon):
+        previous = polygon[index - 1]
+        dist_current = current[3] + sign * current[2]
+        dist_previous = previous[3] + sign * previous[2]
+        if (dist_current >= 0) != (dist_previous >= 0):
+            t = dist_previous / (dist_previous - dist_current)
+            out.append([a + (b - a) * t for a, b in zip(previous, current)])
+        if dist_current >= 0:
+            out.append(current)
+    return out
+
+
+class Renderer:
+    """Renders the meshes below a World or other root nodes into an RGBA8 frame"""
+
+    def __init__(self, reader, width=256, height=256):
+        self.reader = reader
+        self.width = width
+        self.height = height
+        self.frame = bytearray(width * height * 4)
+        self.lights = []
+        self.viewer = (0.0, 0.0, 1.0)
+        self.camera_position = None
+        self._textures = {}
+        self._tables = {}
+        self._triangles = []
+
+    def clear(self, background):
+        """Clear the frame with a Background's color and image"""
+        width, height = self.width, self.height
+        frame = self.frame
+        if not background.color_clear_enabled:
+            return
+        frame[:] = bytes(background.background_color) * (width * height)
+        image = self.reader.get_object_by_id(background.background_image)
+        if not isinstance(image, Image2D) or image.width * image.height == 0:
+            return
+        if background.crop_width <= 0 or background.crop_height <= 0:
+            return
+        rgba = bytes(decode_rgba(image))
+        texels = [rgba[i : i + 4] for i in range(0, len(rgba), 4)]
+        columns = self._crop_map(
+            background.crop_x,
+            background.crop_width,
+            width,
+            image.width,
+            background.background_image_mode_x,
+        )
+        rows = self._crop_map(
+            background.crop_y,
+            background.crop_height,
+            height,
+            image.height,
+            background.background_image_mode_y,
+        )
+        lines = {}
+        stride = width * 4
+        for row, source in enumerate(rows):
+            if source is None:
+                continue
+            if source not in lines:
+                start = source * image.width
+                old = frame[row * stride : (row + 1) * stride]
+                lines[source] = b"".join(
+                    [
+                        old[4 * x : 4 * x + 4]
+                        if column is None
+                        else texels[start + column]
+                        for x, column in enumerate(columns)
+                    ]
+                )
+            frame[row * stride : (row + 1) * stride] = lines[source]
+
+    @staticmethod
+    def _crop_map(crop, crop_size, size, image_size, mode):
+        """Source pixel of each frame pixel when a crop range is scaled to it"""
+        out = []
+        for pixel in range(size):
+            source = crop + int((pixel + 0.5) * crop_size / size)
+            if mode == _BORDER:
+                out.append(source if 0 <= source < image_size else None)
+            else:
+                out.append(source % image_size)
+        return out
+
+    def texture(self, tex_id):
+        """Returns the sampler of a Texture2D id, or None"""
+        if tex_id not in self._textures:
+            texture = self.reader.get_object_by_id(tex_id)
+            sampler = None
+            if isinstance(texture, Texture2D) and isinstance(
+                self.reader.get_object_by_id(texture.image), Image2D
+            ):
+                sampler = _Texture(self.reader, texture)
+            self._textures[tex_id] = sampler
+        return self._textures[tex_id]
+
+    def add_mesh(self, scene_node, positions, view, proj):
+        """Transform, light, clip and cull the triangles of a mesh"""
+        reader = self.reader
+        mesh = scene_node.node
+        vertex_buffer = reader.get_object_by_id(mesh.vertex_buffer)
+        ex, ey, ez = transform_points(view, *positions)
+        p = proj
+        columns = [
+            [
+                p[row] * x + p[row + 1] * y + p[row + 2] * z + p[row + 3]
+                for x, y, z in zip(ex, ey, ez)
+            ]
+            for row in (0, 4, 8, 12)
+        ]
+        clip = list(zip(*columns))
+        inside = [w > 0 and -w <= z <= w for _, _, z, w in clip]
+        half_w, half_h = self.width / 2, self.height / 2
+        screen = [
+            ((x / w + 1) * half_w, (1 - y / w) * half_h, 1 / w) if ok else None
+            for (x, y, _, w), ok in zip(clip, inside)
+        ]
+        normals = None
+        if vertex_buffer.normals:
+            normals = world_normals(
+                scene_node.matrix,
+                normal_columns(reader.get_object_by_id(vertex_buffer.normals)),
+            )
+        for index_id, app_id in zip(mesh.index_buffer, mesh.appearance):
+            appearance = reader.get_object_by_id(app_id)
+            strip_array = reader.get_object_by_id(index_id)
+            if appearance is None or strip_array is None:
+                continue
+            self._add_submesh(
+                vertex_buffer,
+                appearance,
+                strip_triangles(strip_array),
+                self._colors(scene_node, vertex_buffer, appearance, positions, normals),
+                (clip, inside, screen, ez),
+            )
+
+    def _colors(self, scene_node, vertex_buffer, appearance, positions, normals):
+        """
+        Returns r, g, b and a columns of the colors of a mesh's vertices. Without
+        lights in the scene a Material is lit by a light at the camera.
+        """
+        count = len(positions[0])
+        columns = vertex_colors(self.reader, vertex_buffer, count)
+        material = self.reader.get_object_by_id(appearance.material)
+        if isinstance(material, Material) and self.lights:
+            polygon_mode = self.reader.get_object_by_id(appearance.polygon_mode)
+            local = (
+                isinstance(polygon_mode, PolygonMode)
+                and polygon_mode.local_camera_lighting_enabled
+            )
+            columns = light_vertices(
+                material,
+                positions,
+                normals,
+                self.lights,
+                scene_node.node.scope,
+                columns,
+                self.viewer,
+                self.camera_position if local else None,
+            )
+        elif isinstance(material, Material):
+            if not material.vertex_color_tracking_enabled:
+                columns = [[channel] * count for channel in material.diffuse_color]
+            if normals is None:
+                light = [1.0] * count
+            else:
+                vx, vy, vz = self.viewer
+                light = [
+                    0.3 + 0.7 * abs(x * vx + y * vy + z * vz)
+                    for x, y, z in zip(*normals)
+                ]
+            columns[:3] = [
+                [min(255.0, emissive + value * f) for value, f in zip(column, light)]
+                for column, emissive in zip(columns[:3], material.emissive_color)
+            ]
+        alpha = scene_node.alpha
+        columns[3] = [value * alpha for value in columns[3]]
+        return columns
+
+    def _tex_coords(self, vertex_buffer, appearance):
+        """Returns the sampler and u and v texel columns of texture unit 0"""
+        if not appearance.textures or not vertex_buffer.tex_coords:
+            return None, None
+        sampler = self.texture(appearance.textures[0])
+        tex_coords = self.reader.get_object_by_id(vertex_buffer.tex_coords[0])
+        if sampler is None or tex_coords is None:
+            return None, None
+        s, t = scaled_columns(
+            tex_coords,
+            vertex_buffer.tex_coord_scale[0],
+            vertex_buffer.tex_coord_bias[0],
+            2,
+        )
+        s, t, _ = transform_points(sampler.matrix, s, t, [0.0] * len(s))
+        return sampler, (
+            [value * sampler.width for value in s],
+            [value * sampler.height for value in t],
+        )
+
+    def _add_submesh(self, vertex_buffer, appearance, triangles, colors, vertices):
+        reader = self.reader
+        clip, inside, screen, eye_z = vertices
+        polygon_mode = reader.get_object_by_id(appearance.polygon_mode)
+        culling, clockwise = _CULL_BACK, False
+        if isinstance(polygon_mode, PolygonMode):
+            culling = polygon_mode.culling
+            clockwise = polygon_mode.winding == _WINDING_CW
+        compositing = reader.get_object_by_id(appearance.compositing_mode)
+        if not isinstance(compositing, CompositingMode):
+            compositing = None
+        fog = reader.get_object_by_id(appearance.fog)
+        sampler, tex_coords = self._tex_coords(vertex_buffer, appearance)
+        if sampler is not None:
+            screen = [
+                None if point is None else point + (u * point[2], v * point[2])
+                for point, u, v in zip(screen, *tex_coords)
+            ]
+        constant = None
+        if all(min(column) == max(column) for column in colors):
+            constant = [column[0] for column in colors]
+        else:
+            colors = list(zip(*colors))
+        layer = appearance.layer
+        triangles_out = self._triangles
+        for corners in zip(triangles[0::3], triangles[1::3], triangles[2::3]):
+            a, b, c = corners
+            if inside[a] and inside[b] and inside[c]:
+                polygons = [(screen[a], screen[b], screen[c])]
+            else:
+                polygons = self._clipped(corners, clip, tex_coords)
+                if not polygons:
+                    continue
+            p0, p1, p2 = polygons[0]
+            area = (p1[0] - p0[0]) * (p2[1] - p0[1]) - (p2[0] - p0[0]) * (
+                p1[1] - p0[1]
+            )
+            if area == 0:
+                continue
+            front = (area < 0) != clockwise
+            if (culling == _CULL_BACK and not front) or (
+                culling == _CULL_FRONT and front
+            ):
+                continue
+            depth = -(eye_z[a] + eye_z[b] + eye_z[c]) / 3
+            if constant is None:
+                color = [
+                    (x + y + z) / 3 for x, y, z in zip(colors[a], colors[b], colors[c])
+                ]
+            else:
+                color = constant
+            if isinstance(fog, Fog):
+                color = _fog_color(fog, depth, color)
+            for polygon in polygons:
+                triangles_out.append(
+                    (
+                        layer,
+                        -depth,
+                        len(triangles_out),
+                        polygon,
+                        color,
+                        sampler,
+                        compositing,
+                    )
+                )
+
+    def _clipped(self, corners, clip, tex_coords):
+        """Clip a triangle against the near and far planes, returns screen triangles"""
+        polygon = []
+        for i in corners:
+            vertex = list(clip[i])
+            if tex_coords is not None:
+                vertex += [tex_coords[0][i], tex_coords[1][i]]
+            polygon.append(vertex)
+        if all(v[0] > v[3] for v in polygon) or all(v[0] < -v[3] for v in polygon):
+            return []
+        if all(v[1] > v[3] for v in polygon) or all(v[1] < -v[3] for v in polygon):
+            return []
+        polygon = _clip(_clip(polygon, 1), -1)
+        if len(polygon) < 3:
+            return []
+        half_w, half_h = self.width / 2, self.height / 2
+        points = []
+        for vertex in polygon:
+            if vertex[3] <= 0:
+                return []
+            inv = 1 / vertex[3]
+            point = (
+                (vertex[0] * inv + 1) * half_w,
+                (1 - vertex[1] * inv) * half_h,
+                inv,
+            )
+            if tex_coords is not None:
+                point += (vertex[4] * inv, vertex[5] * inv)
+            points.append(point)
+        return [
+            (points[0], points[k], points[k + 1]) for k in range(1, len(points) - 1)
+        ]
+
+    def _color_tables(self, color, sampler):
+        """Per channel translate tables that modulate texels by a flat color"""
+        if sampler.replace:
+            color = [255.0, 255.0, 255.0, color[3]]
+        key = tuple(int(value) for value in color)
+        if key not in self._tables:
+            self._tables[key] = [
+                None
+                if value >= 255
+                else bytes(texel * value // 255 for texel in range(256))
+                for value in key
+            ]
+        return self._tables[key]
+
+    def draw(self):
+        """Rasterize the collected triangles, back to front within each layer"""
+        self._triangles.sort(key=lambda item: item[:3])
+        for _, _, _, points, color, sampler, compositing in self._triangles:
+            blending, threshold, channels = _REPLACE, 0, (0, 1, 2, 3)
+            if compositing is not None:
+                blending = compositing.blending
+                threshold = compositing.alpha_threshold
+                channels = (0, 1, 2) if compositing.color_write_enabled else ()
+                if compositing.alpha_write_enabled:
+                    channels += (3,)
+            if sampler is None:
+                flat = bytes(min(255, max(0, int(value))) for value in color)
+            else:
+                tables = self._color_tables(color, sampler)
+                gradients = _gradients(points)
+            for row, x0, x1 in self._spans(points):
+                if sampler is None:
+                    span = flat * (x1 - x0)
+                else:
+                    span = _textured_span(sampler, gradients, row + 0.5, x0, x1)
+                    for channel, table in enumerate(tables):
+                        if table is not None:
+                            span[channel::4] = span[channel::4].translate(table)
+                start = (row * self.width + x0) * 4
+                self._write(start, span, blending, threshold, channels)
+
+    def _spans(self, points):
+        """Yields the row and pixel range of each span of a triangle"""
+        top, middle, bottom = sorted(points, key=itemgetter(1))
+        top_x, top_y = top[0], top[1]
+        middle_x, middle_y = middle[0], middle[1]
+        bottom_y = bottom[1]
+        first = max(0, ceil(top_y - 0.5))
+        last = min(self.height, ceil(bottom_y - 0.5))
+        if first >= last:
+            return
+        long_slope = (bottom[0] - top_x) / (bottom_y - top_y)
+        upper_slope = (middle_x - top_x) / (middle_y - top_y) if middle_y > top_y else 0
+        lower_slope = (
+            (bottom[0] - middle_x) / (bottom_y - middle_y) if bottom_y > middle_y else 0
+        )
+        width = self.width
+        for row in range(first, last):
+            y = row + 0.5
+            left = top_x + (y - top_y) * long_slope
+            if y < middle_y:
+                right = top_x + (y - top_y) * upper_slope
+            else:
+                right = middle_x + (y - middle_y) * lower_slope
+            if left > right:
+                left, right = right, left
+            x0 = max(0, ceil(left - 0.5))
+            x1 = min(width, ceil(right - 0.5))
+            if x0 < x1:
+                yield row, x0, x1
+
+    def _write(self, start, span, blending, threshold, channels):
+        """Blend a span of RGBA pixels into the frame"""
+        frame = self.frame
+        end = start + len(span)
+        if blending == _REPLACE and not threshold and len(channels) == 4:
+            frame[start:end] = span
+            return
+        alpha = span[3::4]
+        for channel in channels:
+            src = span[channel::4]
+            dst = frame[start + channel : end : 4]
+            if blending == _ALPHA and channel == 3:
+                out = bytes(a + d * (255 - a) // 255 for d, a in zip(dst, alpha))
+            elif blending == _ALPHA:
+                out = bytes(
+                    (s * a + d * (255 - a)) // 255 for s, d, a in zip(src, dst, alpha)
+                )
+            elif blending == _ALPHA_ADD:
+                out = bytes(
+                    min(255, d + s * a // 255) for s, d, a in zip(src, dst, alpha)
+                )
+            elif blending == _MODULATE:
+                out = bytes(s * d // 255 for s, d in zip(src, dst))
+            elif blending == _MODULATE_X2:
+                out = bytes(min(255, s * d // 127) for s, d in zip(src, dst))
+            else:
+                out = src
+            if threshold:
+                out = bytes(
+                    o if a >= threshold else d for o, d, a in zip(out, dst, alpha)
+                )
+            frame[start + channel : end : 4] = out
+
+
+def _gradients(points):
+    """
+    Returns (d/dx, d/dy, value at 0, 0) of each attribute after the screen
+    position of a triangle's vertices, which are linear in screen space
+    """
+    (x0, y0, *a0), (x1, y1, *a1), (x2, y2, *a2) = points
+    dx1, dy1, dx2, dy2 = x1 - x0, y1 - y0, x2 - x0, y2 - y0
+    det = dx1 * dy2 - dx2 * dy1
+    out = []
+    for v0, v1, v2 in zip(a0, a1, a2):
+        ddx = ((v1 - v0) * dy2 - (v2 - v0) * dy1) / det
+        ddy = ((v2 - v0) * dx1 - (v1 - v0) * dx2) / det
+        out.append((ddx, ddy, v0 - ddx * x0 - ddy * y0))
+    return out
+
+
+def _textured_span(sampler, gradients, y, x0, x1):
+    """Sample the texels of a span with perspective correct ends"""
+    (inv_dx, inv_dy, inv), (u_dx, u_dy, u), (v_dx, v_dy, v) = gradients
+    inv += inv_dy * y
+    u += u_dy * y
+    v += v_dy * y
+    left, right = x0 + 0.5, x1 - 0.5
+    inv0, inv1 = inv + inv_dx * left, inv + inv_dx * right
+    return sampler.span(
+        (u + u_dx * left) / inv0,
+        (v + v_dx * left) / inv0,
+        (u + u_dx * right) / inv1,
+        (v + v_dx * right) / inv1,
+        x1 - x0,
+    )
+
+
+def render(reader, width=256, height=256, world=None, camera=None):
+    """
+    Render a World into an RGBA8 buffer of width * height * 4 bytes
+
+    world is the id of the World to draw, by default the file's first World, or
+    all root nodes if there is none. camera is the id of the Camera to look
+    through, by default the World's active camera. Without a camera the view is
+    framed automatically to show all meshes from the front.
+    """
+    objects = reader.objects
+    if world is None:
+        world = next(
+            (i for i, obj in enumerate(objects, 1) if isinstance(obj, World)), None
+        )
+    world_node = reader.get_object_by_id(world)
+    roots = [world] if isinstance(world_node, World) else root_nodes(reader)
+    nodes = scene_nodes(reader, roots)
+    renderer = Renderer(reader, width, height)
+    if isinstance(world_node, World):
+        background = reader.get_object_by_id(world_node.background)
+        if isinstance(background, Background):
+            renderer.clear(background)
+        if camera is None:
+            camera = world_node.active_camera
+
+    meshes = []
+    for scene_node in nodes.values():
+        if scene_node.visible and isinstance(scene_node.node, Mesh):
+            positions = _mesh_positions(reader, scene_node)
+            if positions is not None and positions[0]:
+                meshes.append((scene_node, positions))
+
+    camera_node = reader.get_object_by_id(camera)
+    if isinstance(camera_node, Camera):
+        matrix = nodes[camera].matrix if camera in nodes else local_matrix(camera_node)
+        proj = projection(camera_node)
+    elif meshes:
+        bounds = (
+            [min(min(positions[axis]) for _, positions in meshes) for axis in range(3)],
+            [max(max(positions[axis]) for _, positions in meshes) for axis in range(3)],
+        )
+        matrix, proj = auto_camera(bounds, width / height)
+    else:
+        return renderer.frame
+    view = inverse(matrix)
+    renderer.lights = scene_lights(nodes)
+    length = sqrt(matrix[2] ** 2 + matrix[6] ** 2 + matrix[10] ** 2) or 1.0
+    renderer.viewer = (matrix[2] / length, matrix[6] / length, matrix[10] / length)
+    renderer.camera_position = (matrix[3], matrix[7], matrix[11])
+    for scene_node, positions in meshes:
+        renderer.add_mesh(scene_node, positions, view, proj)
+    renderer.draw()
+    return renderer.frame
+
+
+def render_png(reader, path, width=256, height=256, world=None, camera=None):
+    """Render a World (see render) into a PNG file"""
+    write_png(path, width, height, render(reader, width, height, world, camera))
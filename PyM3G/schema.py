@@ -0,0 +1,493 @@
+"""
+Declarative object layouts and the decoders and encoders generated from them
+
+Every object class lists the fields it adds to its base class in a _layout
+attribute. When the class is created, Python source for a decoder, an encoder
+and reference helpers of its full layout (base class fields first) is generated
+and compiled once. Runs of fixed-size fields are read with one precompiled
+Struct, counted arrays with a single unpack or array conversion.
+
+A plain field is a (name, code) tuple where code is a struct format code with
+an optional repeat count ("B", "3f", "16f"). The code "R" is an ObjectIndex,
+stored like "I" but known to reference another object. An optional third item
+divides the stored value on reading and multiplies it on writing.
+"""
+
+from array import array
+import re
+from struct import Struct, error as StructError, pack, unpack_from
+
+from PyM3G.util import array_bytes, read_array
+
+REF = "R"
+
+_code_pattern = re.compile(r"(\d*)([a-zA-Z?])$")
+
+
+class When:
+    """
+    Fields that are only present when an attribute is true, or equal to value
+    when one is given. otherwise lists the fields present in the other case.
+    """
+
+    def __init__(self, attr, fields, value=None, otherwise=()):
+        self.attr = attr
+        self.fields = list(fields)
+        self.value = value
+        self.otherwise = list(otherwise)
+
+
+class Array:
+    """A UInt32 count followed by that many values, stored as a list"""
+
+    def __init__(self, name, code):
+        self.name = name
+        self.code = code
+
+
+class TypedArray:
+    """A UInt32 count followed by that many values, stored as an array.array"""
+
+    def __init__(self, name, code):
+        self.name = name
+        self.code = code
+
+
+class Records:
+    """
+    A UInt32 count followed by that many records of plain fields. Every field is
+    stored as a list with one item per record, the count in count if given.
+    """
+
+    def __init__(self, fields, count=None):
+        self.fields = list(fields)
+        self.count = count
+
+
+class Bytes:
+    """A UInt32 length followed by that many bytes"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+class String:
+    """A null terminated UTF-8 string"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+class UserParameters:
+    """The Object3D user parameters, stored as a dict of id to bytes"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Custom:
+    """
+    Data handled by the class itself through _decode_<name>(data, offset), which
+    returns the new offset, and _encode_<name>(), which returns bytes
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _split(code):
+    """Returns the repeat count and the struct format letter of a field code"""
+    match = _code_pattern.match(code)
+    if match is None:
+        raise ValueError(f"Invalid field code {code!r}")
+    count = int(match.group(1) or 1)
+    letter = match.group(2)
+    return count, "I" if letter == REF else letter
+
+
+def _take(data, offset, size):
+    """Returns size bytes of data at offset, failing like struct on short data"""
+    if offset + size > len(data):
+        raise StructError(f"{size} bytes needed at offset {offset}")
+    return data[offset : offset + size]
+
+
+class _Generator:
+    """Builds the source of the codec functions of one layout"""
+
+    def __init__(self):
+        self.namespace = {
+            "StructError": StructError,
+            "array": array,
+            "array_bytes": array_bytes,
+            "pack": pack,
+            "read_array": read_array,
+            "take": _take,
+            "unpack_from": unpack_from,
+            "U32": Struct("<I"),
+            "U32x2": Struct("<II"),
+        }
+        self.decode = ["def decode(obj, data, offset):"]
+        self.encode = ["def encode(obj):", "    parts = []"]
+        self.refs = ["def references(obj):", "    refs = []"]
+        self.remap = ["def remap(obj, mapping):"]
+
+    def constant(self, value):
+        """Adds a value to the namespace of the generated code and returns its name"""
+        name = f"C{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def layout(self, fields, indent):
+        """Emit the code of a list of layout items"""
+        pad = "    " * indent
+        run = []
+        for item in fields:
+            if isinstance(item, tuple):
+                run.append(item)
+                continue
+            self.fixed(run, pad)
+            run = []
+            if isinstance(item, When):
+                self.when(item, indent)
+            else:
+                getattr(self, type(item).__name__.lower())(item, pad)
+        self.fixed(run, pad)
+
+    def references(self, name, code, pad, many=False):
+        """Emit reference listing and remapping of a field if it is a reference"""
+        if code != REF:
+            return
+        if many:
+            self.refs.append(f"{pad}refs.extend(obj.{name})")
+            self.remap.append(
+                f"{pad}obj.{name} = [mapping.get(ref, ref) for ref in obj.{name}]"
+            )
+        else:
+            self.refs.append(f"{pad}refs.append(obj.{name})")
+            self.remap.append(f"{pad}obj.{name} = mapping.get(obj.{name}, obj.{name})")
+
+    def fixed(self, run, pad):
+        """A run of plain fields, read and written with one Struct"""
+        if not run:
+            return
+        layout = Struct("<" + "".join(code for _, code, *_ in run).replace(REF, "I"))
+        struct_name = self.constant(layout)
+        values = []
+        targets = []
+        index = 0
+        for name, code, *divisor in run:
+            count, _ = _split(code)
+            self.references(name, code, pad)
+            if count > 1:
+                targets.append((f"obj.{name}", f"values[{index}:{index + count}]"))
+                values.append(f"*obj.{name}")
+            elif divisor:
+                targets.append((f"obj.{name}", f"values[{index}] / {divisor[0]}"))
+                values.append(f"round(obj.{name} * {divisor[0]})")
+            else:
+                targets.append((f"obj.{name}", f"values[{index}]"))
+                values.append(f"obj.{name}")
+            index += count
+        unpack = "unpack_from(data, offset)"
+        if all(source == f"values[{pos}]" for pos, (_, source) in enumerate(targets)):
+            names = ", ".join(target for target, _ in targets)
+            self.decode.append(f"{pad}({names},) = {struct_name}.{unpack}")
+        else:
+            self.decode.append(f"{pad}values = {struct_name}.{unpack}")
+            for target, source in targets:
+                self.decode.append(f"{pad}{target} = {source}")
+        self.decode.append(f"{pad}offset += {layout.size}")
+        self.encode.append(
+            f"{pad}parts.append({struct_name}.pack({', '.join(values)}))"
+        )
+
+    def when(self, item, indent):
+        """A conditional block"""
+        pad = "    " * indent
+        if item.value is None:
+            test = f"obj.{item.attr}"
+        else:
+            test = f"obj.{item.attr} == {item.value!r}"
+        for lines in (self.decode, self.encode, self.refs, self.remap):
+            lines.append(f"{pad}if {test}:")
+            lines.append(f"{pad}    pass")
+        self.layout(item.fields, indent + 1)
+        if item.otherwise:
+            for lines in (self.decode, self.encode, self.refs, self.remap):
+                lines.append(f"{pad}else:")
+                lines.append(f"{pad}    pass")
+            self.layout(item.otherwise, indent + 1)
+
+    def array(self, item, pad):
+        """A counted list of values"""
+        count, letter = _split(item.code)
+        size = Struct("<" + letter).size * count
+        self.decode += [
+            f"{pad}(count,) = U32.unpack_from(data, offset)",
+            f"{pad}obj.{item.name} = list(",
+            f"{pad}    unpack_from('<%d{letter}' % count, data, offset + 4)",
+            f"{pad})",
+            f"{pad}offset += 4 + {size} * count",
+        ]
+        self.encode += [
+            f"{pad}count = len(obj.{item.name})",
+            f"{pad}parts.append(",
+            f"{pad}    pack('<I%d{letter}' % count, count, *obj.{item.name})",
+            f"{pad})",
+        ]
+        self.references(item.name, item.code, pad, many=True)
+
+    def typedarray(self, item, pad):
+        """A counted array.array of values"""
+        _, letter = _split(item.code)
+        size = Struct("<" + letter).size
+        self.decode += [
+            f"{pad}(count,) = U32.unpack_from(data, offset)",
+            f"{pad}obj.{item.name} = read_array(",
+            f"{pad}    '{letter}', take(data, offset + 4, {size} * count)",
+            f"{pad})",
+            f"{pad}offset += 4 + {size} * count",
+        ]
+        self.encode += [
+            f"{pad}parts.append(U32.pack(len(obj.{item.name})))",
+            f"{pad}parts.append(array_bytes('{letter}', obj.{item.name}))",
+        ]
+        self.references(item.name, item.code, pad, many=True)
+
+    def records(self, item, pad):
+        """A counted list of records stored as one list per field"""
+        layout = Struct(
+            "<" + "".join(code for _, code in item.fields).replace(REF, "I")
+        )
+        struct_name = self.constant(layout)
+        self.decode += [
+            f"{pad}(count,) = U32.unpack_from(data, offset)",
+            f"{pad}rows = list({struct_name}.iter_unpack(",
+            f"{pad}    take(data, offset + 4, {layout.size} * count)",
+            f"{pad}))",
+            f"{pad}offset += 4 + {layout.size} * count",
+        ]
+        if item.count:
+            self.decode.append(f"{pad}obj.{item.count} = count")
+        first = item.fields[0][0]
+        self.encode += [
+            f"{pad}count = len(obj.{first})",
+            f"{pad}parts.append(U32.pack(count))",
+            f"{pad}for row in range(count):",
+        ]
+        values = []
+        index = 0
+        for name, code in item.fields:
+            count, _ = _split(code)
+            if count > 1:
+                source = f"row[{index}:{index + count}]"
+                values.append(f"*obj.{name}[row]")
+            else:
+                source = f"row[{index}]"
+                values.append(f"obj.{name}[row]")
+            self.decode.append(f"{pad}obj.{name} = [{source} for row in rows]")
+            self.references(name, code, pad, many=True)
+            index += count
+        self.encode.append(
+            f"{pad}    parts.append({struct_name}.pack({', '.join(values)}))"
+        )
+
+    def bytes(self, item, pad):
+        """A length prefixed byte string"""
+        self.decode += [
+            f"{pad}(count,) = U32.unpack_from(data, offset)",
+            f"{pad}obj.{item.name} = take(data, offset + 4, count)",
+            f"{pad}offset += 4 + count",
+        ]
+        self.encode += [
+            f"{pad}parts.append(U32.pack(len(obj.{item.name})))",
+            f"{pad}parts.append(bytes(obj.{item.name}))",
+        ]
+
+    def string(self, item, pad):
+        """A null terminated string"""
+        self.decode += [
+            f"{pad}end = data.find(b'\\0', offset)",
+            f"{pad}end = len(data) if end < 0 else end",
+            f"{pad}obj.{item.name} = data[offset:end].decode('utf-8')",
+            f"{pad}offset = min(end + 1, len(data))",
+        ]
+        self.encode.append(
+            f"{pad}parts.append((obj.{item.name} or '').encode('utf-8') + b'\\0')"
+        )
+
+    def userparameters(self, item, pad):
+        """Counted (id, length, bytes) user parameters"""
+        self.decode += [
+            f"{pad}(count,) = U32.unpack_from(data, offset)",
+            f"{pad}offset += 4",
+            f"{pad}obj.{item.name} = {{}}",
+            f"{pad}for _ in range(count):",
+            f"{pad}    (key, size) = U32x2.unpack_from(data, offset)",
+            f"{pad}    obj.{item.name}[key] = take(data, offset + 8, size)",
+            f"{pad}    offset += 8 + size",
+        ]
+        self.encode += [
+            f"{pad}parts.append(U32.pack(len(obj.{item.name})))",
+            f"{pad}for key, value in obj.{item.name}.items():",
+            f"{pad}    parts.append(U32x2.pack(key, len(value)))",
+            f"{pad}    parts.append(bytes(value))",
+        ]
+
+    def custom(self, item, pad):
+        """Data decoded and encoded by methods of the class"""
+        self.decode.append(f"{pad}offset = obj._decode_{item.name}(data, offset)")
+        self.encode.append(f"{pad}parts.append(obj._encode_{item.name}())")
+
+    def source(self):
+        """Returns the complete source of the generated functions"""
+        self.decode.append("    return offset")
+        self.encode.append("    return b''.join(parts)")
+        self.refs.append("    return refs")
+        self.remap.append("    return obj")
+        functions = (self.decode, self.encode, self.refs, self.remap)
+        return "\n".join("\n".join(lines) for lines in functions)
+
+
+_codecs = {}
+
+
+def full_layout(cls):
+    """Returns the layout of a class including the fields of its base classes"""
+    fields = []
+    for klass in reversed(cls.__mro__):
+        fields.extend(vars(klass).get("_layout", ()))
+    return fields
+
+
+def reference_fields(cls):
+    """Returns the names of the fields of a class that hold object references"""
+    names = []
+    pending = list(full_layout(cls))
+    while pending:
+        item = pending.pop(0)
+        if isinstance(item, tuple):
+            if item[1] == REF:
+                names.append(item[0])
+        elif isinstance(item, When):
+            pending[:0] = item.fields + item.otherwise
+        elif isinstance(item, Records):
+            pending[:0] = item.fields
+        elif isinstance(item, (Array, TypedArray)) and item.code == REF:
+            names.append(item.name)
+    return list(dict.fromkeys(names))
+
+
+# Stands in for the value of a Payload field that a budget has dropped
+EVICTED = object()
+
+
+class Payload:
+    """
+    A bulk field (a typed array or bytes) that a budget.PayloadBudget can drop
+    from memory and reload from the file it was read from. Reading the field
+    marks it as used; setting it stops the budget from dropping it again.
+    Without a budget it behaves like a plain attribute.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            value = obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name) from None
+        budget = obj.__dict__.get("_budget")
+        if budget is not None:
+            value = budget.use(obj, self.name)
+        return value
+
+    def __set__(self, obj, value):
+        budget = obj.__dict__.get("_budget")
+        if budget is not None:
+            budget.release(obj)
+        obj.__dict__[self.name] = value
+
+
+def payload_fields(cls):
+    """Returns the names of the Payload fields of a class"""
+    names = []
+    for klass in cls.__mro__:
+        names += [
+            name for name, attr in vars(klass).items() if isinstance(attr, Payload)
+        ]
+    return names
+
+
+def compile_layout(cls):
+    """
+    Generate, compile and cache the decode, encode, references and remap functions
+    of a class. Returns the cache entry, a dict that also holds the source.
+    """
+    if cls in _codecs:
+        return _codecs[cls]
+    generator = _Generator()
+    generator.layout(full_layout(cls), 1)
+    source = generator.source()
+    namespace = dict(generator.namespace)
+    exec(compile(source, f"<m3g layout {cls.__name__}>", "exec"), namespace)
+    _codecs[cls] = {
+        "source": source,
+        "decode": namespace["decode"],
+        "encode": namespace["encode"],
+        "references": namespace["references"],
+        "remap": namespace["remap"],
+    }
+    return _codecs[cls]
+
+
+def codec_source(cls):
+    """Returns the generated source of a class's codec, for debugging"""
+    return compile_layout(cls)["source"]
+
+
+class M3GObject:
+    """
+    Base class of all object classes. Reading and writing are generated from
+    the class's layout.
+    """
+
+    _layout = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        codec = compile_layout(cls)
+        cls._decode = codec["decode"]
+        cls._encode = codec["encode"]
+        cls._references = codec["references"]
+        cls._remap = codec["remap"]
+
+    def read(self, reader):
+        """Read object data from an input stream"""
+        data = reader.read()
+        end = self._decode(data, 0)
+        reader.seek(end - len(data), 1)
+
+    def write(self, writer):
+        """Write object data to an output stream"""
+        writer.write(self._encode())
+
+    def decode(self, data, offset=0):
+        """Decode object data from a buffer, returns the offset after it"""
+        return self._decode(data, offset)
+
+    def encode(self):
+        """Returns the encoded object data"""
+        return self._encode()
+
+    def references(self):
+        """Returns the ids of all objects this object references (0 is null)"""
+        return self._references()
+
+    def remap_references(self, mapping):
+        """Replace referenced object ids through a dict of old id to new id"""
+        self._remap(mapping)
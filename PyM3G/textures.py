@@ -0,0 +1,278 @@
+"""
+Image2D deduplication and texture atlas packing
+"""
+
+from hashlib import blake2b
+from os import path as os_path
+from struct import pack
+
+from PyM3G.imaging import RGB, RGBA, decode_rgba
+from PyM3G.layout import compact_objects
+from PyM3G.objects.background import Background
+from PyM3G.objects.image2d import Image2D
+from PyM3G.objects.mesh import Mesh
+from PyM3G.objects.sprite import Sprite
+from PyM3G.objects.texture2d import Texture2D
+
+
+def image_digest(image):
+    """Returns a content hash over the format, size, palette and pixels of an image"""
+    digest = blake2b(digest_size=16)
+    digest.update(
+        pack("<B?II", image.image_format, image.is_mutable, image.width, image.height)
+    )
+    digest.update(pack("<I", len(image.palette)))
+    digest.update(bytes(image.palette))
+    digest.update(bytes(image.pixels))
+    return digest.hexdigest()
+
+
+class ImageIndex:
+    """
+    Content-hash index of Image2D objects. Can be shared between readers so that
+    identical images across a whole corpus are kept in memory only once.
+    """
+
+    def __init__(self):
+        self.images = {}
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def canonical(self, image, digest=None):
+        """Returns the canonical copy of an image, adding it if it is new"""
+        if digest is None:
+            digest = image_digest(image)
+        found = self.images.setdefault(digest, image)
+        if found is not image:
+            self.duplicates += 1
+        return found
+
+    def export(self, directory):
+        """
+        Write every canonical image once as <digest>.png and return a dict of
+        digest to file path
+        """
+        paths = {}
+        for digest, image in self.images.items():
+            paths[digest] = os_path.join(directory, f"{digest}.png")
+            image.save_png(paths[digest])
+        return paths
+
+
+def _repoint(reader, remap):
+    for obj in reader.objects:
+        if isinstance(obj, (Texture2D, Sprite)):
+            obj.image = remap.get(obj.image, obj.image)
+        elif isinstance(obj, Background):
+            obj.background_image = remap.get(
+                obj.background_image, obj.background_image
+            )
+
+
+def dedupe_images(reader, index=None, compact=True):
+    """
+    Collapse identical Image2D objects of a reader to one instance. References
+    from Texture2D, Sprite and Background objects are repointed to the first
+    copy in the file, and every duplicate slot is replaced with the canonical
+    instance. When an ImageIndex is given the canonical instance is shared with
+    all other readers deduplicated through the same index.
+
+    With compact, the duplicate slots are removed (see layout.compact_objects),
+    so each image is also stored once on export; this renumbers the objects
+    after them.
+
+    Returns a dict mapping every old object id to its new id, duplicates to the
+    id of their canonical image.
+    """
+    if index is None:
+        index = ImageIndex()
+    first = {}
+    remap = {}
+    for obj_id, obj in enumerate(reader.objects, 1):
+        if not isinstance(obj, Image2D) or obj.is_mutable:
+            continue
+        digest = image_digest(obj)
+        reader.objects[obj_id - 1] = index.canonical(obj, digest)
+        if digest in first:
+            remap[obj_id] = first[digest]
+        else:
+            first[digest] = obj_id
+    _repoint(reader, remap)
+    if compact and remap:
+        ids = compact_objects(reader, remap)
+    else:
+        ids = {obj_id: obj_id for obj_id in range(1, len(reader.objects) + 1)}
+    for obj_id, canonical in remap.items():
+        ids[obj_id] = ids[canonical]
+    return ids
+
+
+def _texcoord_range(vertex_array, scale, bias):
+    if not vertex_array or not vertex_array.vertices:
+        return None
+    lo = []
+    hi = []
+    for comp in range(2):
+        values = vertex_array.vertices[comp :: vertex_array.component_count]
+        ends = (min(values) * scale + bias[comp], max(values) * scale + bias[comp])
+        lo.append(min(ends))
+        hi.append(max(ends))
+    return lo, hi
+
+
+def _texture_usage(reader):
+    """Map (vertex buffer id, texture unit) to the set of texture ids drawn with it"""
+    usage = {}
+    for obj in reader.objects:
+        if not isinstance(obj, Mesh):
+            continue
+        for app_id in obj.appearance:
+            appearance = reader.get_object_by_id(app_id)
+            if appearance is None:
+                continue
+            for unit, tex_id in enumerate(appearance.textures):
+                usage.setdefault((obj.vertex_buffer, unit), set()).add(tex_id)
+    return usage
+
+
+def _atlas_candidates(reader, max_image_size, epsilon):
+    blocked = set()
+    textures = {}
+    for obj_id, obj in enumerate(reader.objects, 1):
+        if isinstance(obj, Sprite):
+            blocked.add(obj.image)
+        elif isinstance(obj, Background):
+            blocked.add(obj.background_image)
+        elif isinstance(obj, Texture2D):
+            textures[obj_id] = obj
+            if obj.has_component_transform or obj.has_general_transform:
+                blocked.add(obj.image)
+
+    usage = _texture_usage(reader)
+    for (vb_id, unit), tex_ids in usage.items():
+        images = {textures[tex_id].image for tex_id in tex_ids if tex_id in textures}
+        vertex_buffer = reader.get_object_by_id(vb_id)
+        in_range = None
+        if len(images) == 1 and unit < len(vertex_buffer.tex_coords):
+            in_range = _texcoord_range(
+                reader.get_object_by_id(vertex_buffer.tex_coords[unit]),
+                vertex_buffer.tex_coord_scale[unit],
+                vertex_buffer.tex_coord_bias[unit],
+            )
+        if in_range is None or min(in_range[0]) < -epsilon:
+            blocked.update(images)
+        elif max(in_range[1]) > 1.0 + epsilon:
+            blocked.update(images)
+
+    candidates = []
+    for obj_id, obj in enumerate(reader.objects, 1):
+        if (
+            isinstance(obj, Image2D)
+            and obj_id not in blocked
+            and not obj.is_mutable
+            and obj.image_format in (RGB, RGBA)
+            and obj.width == obj.height <= max_image_size
+        ):
+            candidates.append(obj_id)
+    return candidates, usage, textures
+
+
+def _shelf_pack(sizes, sheet_size):
+    """Pack square sizes (largest first) into sheets, returns sheet, x, y per item"""
+    places = {}
+    sheets = []
+    for key, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        for sheet, shelves in enumerate(sheets):
+            spot = None
+            for shelf in shelves:
+                if shelf[1] >= size and shelf[2] + size <= sheet_size:
+                    spot = shelf
+                    break
+            if spot is None:
+                top = shelves[-1][0] + shelves[-1][1]
+                if top + size > sheet_size:
+                    continue
+                spot = [top, size, 0]
+                shelves.append(spot)
+            places[key] = (sheet, spot[2], spot[0])
+            spot[2] += size
+            break
+        else:
+            sheets.append([[0, size, size]])
+            places[key] = (len(sheets) - 1, 0, 0)
+    return places, len(sheets)
+
+
+def pack_atlas(
+    reader, max_image_size=64, sheet_size=256, epsilon=1e-4, compact=True
+):
+    """
+    Pack small square RGB/RGBA images into shared RGBA sheets, which are added
+    to the reader as new Image2D objects. Textures are repointed to their sheet and
+    the texture coordinates of every vertex buffer drawn with them are remapped
+    through VertexBuffer.tex_coord_scale and tex_coord_bias.
+
+    With compact, the sheets are moved in front of their first user and packed
+    images nothing uses anymore are removed (see layout.compact_objects), which
+    renumbers the objects after them. Without it the sheets stay at the end of
+    the file, referenced by earlier textures, and the packed images stay too.
+
+    An image is only packed when all of its uses can be remapped this way: it must
+    only be used by untransformed Texture2D objects, each vertex buffer texture
+    unit it is drawn with must use no other image, and the texture coordinates
+    must stay inside [0, 1] (no repeat wrapping). Sheets have no padding between
+    images, so linear filtering can bleed across neighbours.
+
+    Returns a dict mapping the id each packed image had to (sheet id, x, y).
+    """
+    candidates, usage, textures = _atlas_candidates(reader, max_image_size, epsilon)
+    sizes = {obj_id: reader.get_object_by_id(obj_id).width for obj_id in candidates}
+    places, sheet_count = _shelf_pack(sizes, sheet_size)
+
+    stride = sheet_size * 4
+    buffers = [bytearray(sheet_size * stride) for _ in range(sheet_count)]
+    for obj_id, (sheet, x, y) in places.items():
+        size = sizes[obj_id]
+        rgba = decode_rgba(reader.get_object_by_id(obj_id))
+        buffer = buffers[sheet]
+        row_size = size * 4
+        for row in range(size):
+            start = (y + row) * stride + x * 4
+            source = row * row_size
+            buffer[start : start + row_size] = rgba[source : source + row_size]
+
+    sheet_ids = []
+    for buffer in buffers:
+        image = Image2D()
+        image.image_format = RGBA
+        image.is_mutable = False
+        image.width = image.height = sheet_size
+        image.pixels = bytes(buffer)
+        sheet_ids.append(reader.add_object(image))
+
+    for (vb_id, unit), tex_ids in usage.items():
+        images = {textures[tex_id].image for tex_id in tex_ids if tex_id in textures}
+        image_id = images.pop() if len(images) == 1 else None
+        if image_id not in places:
+            continue
+        sheet, x, y = places[image_id]
+        factor = sizes[image_id] / sheet_size
+        vertex_buffer = reader.get_object_by_id(vb_id)
+        bias = vertex_buffer.tex_coord_bias[unit]
+        vertex_buffer.tex_coord_scale[unit] *= factor
+        vertex_buffer.tex_coord_bias[unit] = (
+            bias[0] * factor + x / sheet_size,
+            bias[1] * factor + y / sheet_size,
+            bias[2],
+        )
+    for texture in textures.values():
+        if texture.image in places:
+            texture.image = sheet_ids[places[texture.image][0]]
+    if compact:
+        ids = compact_objects(reader, places)
+        sheet_ids = [ids[sheet_id] for sheet_id in sheet_ids]
+    return {
+        obj_id: (sheet_ids[sheet], x, y) for obj_id, (sheet, x, y) in places.items()
+    }
@@ -0,0 +1,200 @@
+"""
+4x4 matrix helpers for node and texture transforms
+
+Matrices are flat lists of 16 floats in row-major order, the same layout M3G
+uses for general transforms.
+"""
+
+from math import cos, radians, sin, sqrt
+
+from PyM3G.objects.group import Group
+from PyM3G.objects.node import Node
+from PyM3G.objects.skinned_mesh import SkinnedMesh
+
+
+def identity():
+    """Returns the identity matrix"""
+    return scaling(1.0, 1.0, 1.0)
+
+
+def multiply(a, b):
+    """Returns the matrix product a * b"""
+    return [
+        a[row] * b[col] + a[row + 1] * b[col + 4] + a[row + 2] * b[col + 8]
+        + a[row + 3] * b[col + 12]
+        for row in (0, 4, 8, 12)
+        for col in (0, 1, 2, 3)
+    ]
+
+
+def translation(x, y, z):
+    """Returns a translation matrix"""
+    return [1.0, 0.0, 0.0, x, 0.0, 1.0, 0.0, y, 0.0, 0.0, 1.0, z, 0.0, 0.0, 0.0, 1.0]
+
+
+def scaling(x, y, z):
+    """Returns a scaling matrix"""
+    return [x, 0.0, 0.0, 0.0, 0.0, y, 0.0, 0.0, 0.0, 0.0, z, 0.0, 0.0, 0.0, 0.0, 1.0]
+
+
+def quaternion(angle, axis):
+    """Returns the (x, y, z, w) quaternion of a rotation in degrees about an axis"""
+    if not angle or axis is None:
+        return (0.0, 0.0, 0.0, 1.0)
+    length = sqrt(axis[0] ** 2 + axis[1] ** 2 + axis[2] ** 2)
+    if length == 0.0:
+        return (0.0, 0.0, 0.0, 1.0)
+    half = radians(angle) / 2
+    factor = sin(half) / length
+    return (axis[0] * factor, axis[1] * factor, axis[2] * factor, cos(half))
+
+
+def quaternion_matrix(quat):
+    """Returns the rotation matrix of an (x, y, z, w) quaternion"""
+    x, y, z, w = quat
+    return [
+        1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w), 0.0,
+        2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w), 0.0,
+        2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y), 0.0,
+        0.0, 0.0, 0.0, 1.0,
+    ]  # fmt: skip
+
+
+def rotation(angle, axis):
+    """Returns the matrix of a rotation in degrees about an axis"""
+    return quaternion_matrix(quaternion(angle, axis))
+
+
+def local_matrix(transformable):
+    """
+    Returns the composite transform T R S M of a Node or Texture2D, made of its
+    translation, orientation, scale and general transform
+    """
+    matrix = translation(*transformable.translation)
+    matrix = multiply(
+        matrix,
+        rotation(transformable.orientation_angle, transformable.orientation_axis),
+    )
+    matrix = multiply(matrix, scaling(*transformable.scale))
+    if transformable.has_general_transform and transformable.transform:
+        matrix = multiply(matrix, list(transformable.transform))
+    return matrix
+
+
+def inverse(matrix):
+    """Returns the inverse of a matrix, by Gauss-Jordan elimination"""
+    rows = [
+        list(matrix[row * 4 : row * 4 + 4]) + [float(row == col) for col in range(4)]
+        for row in range(4)
+    ]
+    for col in range(4):
+        pivot = max(range(col, 4), key=lambda row: abs(rows[row][col]))
+        if rows[pivot][col] == 0.0:
+            raise ValueError("Matrix is not invertible")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        factor = 1.0 / rows[col][col]
+        rows[col] = [value * factor for value in rows[col]]
+        for row in range(4):
+            if row != col and rows[row][col]:
+                scale = rows[row][col]
+                rows[row] = [a - scale * b for a, b in zip(rows[row], rows[col])]
+    return [value for row in rows for value in row[4:]]
+
+
+def is_identity(matrix):
+    """Returns whether a matrix is the identity"""
+    return matrix == identity()
+
+
+def column_major(matrix):
+    """Returns the matrix in column-major order, as used by glTF"""
+    return [matrix[row * 4 + col] for col in range(4) for row in range(4)]
+
+
+def transform_points(matrix, xs, ys, zs):
+    """Transform point columns by a matrix, returns the new x, y and z columns"""
+    m = matrix
+    return (
+        [m[0] * x + m[1] * y + m[2] * z + m[3] for x, y, z in zip(xs, ys, zs)],
+        [m[4] * x + m[5] * y + m[6] * z + m[7] for x, y, z in zip(xs, ys, zs)],
+        [m[8] * x + m[9] * y + m[10] * z + m[11] for x, y, z in zip(xs, ys, zs)],
+    )
+
+
+def transform_vectors(matrix, xs, ys, zs):
+    """Transform direction columns by the upper 3x3 part of a matrix"""
+    m = matrix
+    return (
+        [m[0] * x + m[1] * y + m[2] * z for x, y, z in zip(xs, ys, zs)],
+        [m[4] * x + m[5] * y + m[6] * z for x, y, z in zip(xs, ys, zs)],
+        [m[8] * x + m[9] * y + m[10] * z for x, y, z in zip(xs, ys, zs)],
+    )
+
+
+def node_children(node):
+    """Returns the ids of the child nodes of a node"""
+    if isinstance(node, Group):
+        return list(node.children)
+    if isinstance(node, SkinnedMesh) and node.skeleton:
+        return [node.skeleton]
+    return []
+
+
+def root_nodes(reader):
+    """Returns the ids of all nodes that are not the child of another node"""
+    children = set()
+    for obj in reader.objects:
+        if isinstance(obj, Node):
+            children.update(node_children(obj))
+    return [
+        obj_id
+        for obj_id, obj in enumerate(reader.objects, 1)
+        if isinstance(obj, Node) and obj_id not in children
+    ]
+
+
+def world_matrices(reader):
+    """Returns a dict of node id to the node's transform relative to its root"""
+    matrices = {}
+    stack = [(root, identity()) for root in root_nodes(reader)]
+    while stack:
+        node_id, parent = stack.pop()
+        node = reader.get_object_by_id(node_id)
+        if node_id in matrices or not isinstance(node, Node):
+            continue
+        matrices[node_id] = multiply(parent, local_matrix(node))
+        stack.extend((child, matrices[node_id]) for child in node_children(node))
+    return matrices
+
+
+class SceneNode:
+    """A node reached from the scene roots, with its world transform"""
+
+    def __init__(self, node, matrix, alpha, visible):
+        self.node = node
+        self.matrix = matrix
+        self.alpha = alpha
+        self.visible = visible
+
+
+def scene_nodes(reader, roots):
+    """
+    Returns a dict of node id to SceneNode for all nodes below the root ids.
+    Nodes with rendering disabled hide their whole subtree, and the alpha
+    factors of nodes multiply down the tree.
+    """
+    nodes = {}
+    stack = [(root, identity(), 1.0, True) for root in roots]
+    while stack:
+        node_id, parent, alpha, visible = stack.pop()
+        node = reader.get_object_by_id(node_id)
+        if node_id in nodes or not isinstance(node, Node):
+            continue
+        matrix = multiply(parent, local_matrix(node))
+        alpha *= node.alpha_factor
+        visible = visible and node.enable_rendering
+        nodes[node_id] = SceneNode(node, matrix, alpha, visible)
+        stack.extend(
+            (child, matrix, alpha, visible) for child in node_children(node)
+        )
+    return nodes
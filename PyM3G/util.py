@@ -1,6 +1,9 @@
 """Utility functions"""
 
+from array import array
 from enum import Enum, auto
+import os
+import sys
 
 
 _constants = {
@@ -92,6 +95,30 @@ class M3GStatus(Enum):
     SUCCESS = auto()
     FAILED = auto()
     CHECKSUM_FAIL = auto()
+    PARTIAL = auto()
+
+
+class ReadError:
+    """
+    An error found while reading a file. section is the index of the section it
+    was found in and obj_id the id of the object it belongs to, both None when
+    not known.
+    """
+
+    def __init__(self, message, section=None, obj_id=None):
+        self.message = message
+        self.section = section
+        self.obj_id = obj_id
+
+    def __str__(self):
+        return obj2str(
+            "ReadError",
+            [
+                ("Section", self.section),
+                ("Object", self.obj_id),
+                ("Message", self.message),
+            ],
+        )
 
 
 def obj2str(obtype, values):
@@ -102,6 +129,96 @@ def obj2str(obtype, values):
     return outstr
 
 
+def obj2dict(obj, payload=False):
+    """
+    Build a JSON serializable dict of an object's public fields. Typed arrays and
+    byte strings are replaced by their length unless payload is True, then arrays
+    become lists and bytes hex strings. Linked objects are replaced by their type
+    name.
+    """
+    values = {"type": obj.__class__.__name__}
+    for name in vars(obj):
+        if name.startswith("_"):
+            continue
+        value = getattr(obj, name)
+        if isinstance(value, (array, bytes, bytearray)):
+            if not payload:
+                value = {"length": len(value)}
+            elif isinstance(value, array):
+                value = value.tolist()
+            else:
+                value = value.hex()
+        elif hasattr(value, "__dict__") and not isinstance(value, Enum):
+            value = value.__class__.__name__
+        elif isinstance(value, dict):
+            value = {
+                str(key): item.hex() if isinstance(item, bytes) else item
+                for key, item in value.items()
+            }
+        values[name] = value
+    return values
+
+
 def const2str(const_id):
     """Return a string representing a constant value"""
     return _constants.get(const_id)
+
+
+def read_array(typecode, data):
+    """Returns a typed array from little endian data"""
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def array_bytes(typecode, values):
+    """Returns values as little endian data of a typed array"""
+    values = array(typecode, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def find_files(paths):
+    """Expand directories into the .m3g files below them, in sorted order"""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            files.extend(
+                os.path.join(root, name)
+                for name in sorted(names)
+                if name.lower().endswith(".m3g")
+            )
+    return files
+
+
+def fishlabs_span(length):
+    """Returns the number of bytes swapped at each end of a Fishlabs obfuscated file"""
+    if length < 100:
+        return 10 + length % 10
+    if length < 200:
+        return 50 + length % 20
+    if length < 300:
+        return 80 + length % 20
+    return 100 + length % 50
+
+
+def fishlabs_deobfuscate(data):
+    """
+    Undo the Fishlabs obfuscation, which swaps the first and last bytes of a file
+    From j2me-preservation/MascotCapsule
+    https://github.com/j2me-preservation/MascotCapsule/blob/master/tools/fishlabs_obfuscation.py
+    """
+    length = len(data)
+    data = bytearray(data)
+    for i in range(fishlabs_span(length)):
+        var7 = data[i]
+        data[i] = data[length - i - 1]
+        data[length - i - 1] = var7
+    return bytes(data)
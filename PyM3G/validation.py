@@ -0,0 +1,367 @@
+"""
+Structural validation of parsed M3G files
+
+Every object is visited once. References are checked against the object types
+the format allows for each field, and index and range checks work on whole
+arrays with min, max and sum so bad files can be rejected before any expensive
+processing.
+"""
+
+from PyM3G.geometry import strip_indices
+from PyM3G.imaging import bytes_per_pixel
+from PyM3G.reader import M3GReader
+from PyM3G.util import obj2str
+
+from PyM3G.objects.animation_controller import AnimationController
+from PyM3G.objects.animation_track import AnimationTrack
+from PyM3G.objects.appearance import Appearance
+from PyM3G.objects.background import Background
+from PyM3G.objects.camera import Camera
+from PyM3G.objects.compositing_mode import CompositingMode
+from PyM3G.objects.external_reference import ExternalReference
+from PyM3G.objects.fog import Fog
+from PyM3G.objects.group import Group
+from PyM3G.objects.header import Header
+from PyM3G.objects.image2d import Image2D
+from PyM3G.objects.keyframe_sequence import KeyframeSequence
+from PyM3G.objects.material import Material
+from PyM3G.objects.mesh import Mesh
+from PyM3G.objects.morphing_mesh import MorphingMesh
+from PyM3G.objects.node import Node
+from PyM3G.objects.object3d import Object3D
+from PyM3G.objects.placeholder import Placeholder
+from PyM3G.objects.polygon_mode import PolygonMode
+from PyM3G.objects.skinned_mesh import SkinnedMesh
+from PyM3G.objects.sprite import Sprite
+from PyM3G.objects.texture2d import Texture2D
+from PyM3G.objects.triangle_strip_array import TriangleStripArray
+from PyM3G.objects.vertex_array import VertexArray
+from PyM3G.objects.vertex_buffer import VertexBuffer
+from PyM3G.objects.world import World
+
+REFERENCE = "reference"
+RANGE = "range"
+SIZE = "size"
+HEADER = "header"
+
+# (owner class, field, allowed target classes, list field, null allowed)
+_references = [
+    (Object3D, "animation_tracks", AnimationTrack, True, False),
+    (AnimationTrack, "keyframe_sequence", KeyframeSequence, False, False),
+    (AnimationTrack, "animation_controller", AnimationController, False, True),
+    (Appearance, "compositing_mode", CompositingMode, False, True),
+    (Appearance, "fog", Fog, False, True),
+    (Appearance, "polygon_mode", PolygonMode, False, True),
+    (Appearance, "material", Material, False, True),
+    (Appearance, "textures", Texture2D, True, True),
+    (Background, "background_image", Image2D, False, True),
+    (Group, "children", Node, True, False),
+    (Node, "z_reference", Node, False, True),
+    (Node, "y_reference", Node, False, True),
+    (Mesh, "vertex_buffer", VertexBuffer, False, False),
+    (Mesh, "index_buffer", TriangleStripArray, True, False),
+    (Mesh, "appearance", Appearance, True, True),
+    (SkinnedMesh, "skeleton", Group, False, False),
+    (SkinnedMesh, "transform_node", Node, True, False),
+    (MorphingMesh, "morph_target", VertexBuffer, True, False),
+    (Sprite, "image", Image2D, False, False),
+    (Sprite, "appearance", Appearance, False, True),
+    (Texture2D, "image", Image2D, False, False),
+    (VertexBuffer, "positions", VertexArray, False, True),
+    (VertexBuffer, "normals", VertexArray, False, True),
+    (VertexBuffer, "colors", VertexArray, False, True),
+    (VertexBuffer, "tex_coords", VertexArray, True, True),
+    (World, "active_camera", Camera, False, True),
+    (World, "background", Background, False, True),
+]
+
+
+class ValidationIssue:
+    """A single problem found in an object (object id 0 is the file itself)"""
+
+    def __init__(self, obj_id, kind, message):
+        self.obj_id = obj_id
+        self.kind = kind
+        self.message = message
+
+    def __str__(self):
+        return f"({self.obj_id}) {self.kind}: {self.message}"
+
+
+class ValidationReport:
+    """The issues found by validate, in object order"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.objects = 0
+        self.issues = []
+
+    @property
+    def valid(self):
+        """True when no issues were found"""
+        return not self.issues
+
+    def add(self, obj_id, kind, message):
+        """Record an issue"""
+        self.issues.append(ValidationIssue(obj_id, kind, message))
+
+    def by_kind(self, kind):
+        """Returns the issues of one kind"""
+        return [issue for issue in self.issues if issue.kind == kind]
+
+    def __str__(self):
+        return obj2str(
+            "ValidationReport",
+            [
+                ("Path", self.path),
+                ("Objects", self.objects),
+                ("Valid", self.valid),
+                ("Issues", len(self.issues)),
+            ]
+            + [("Issue", str(issue)) for issue in self.issues],
+        )
+
+
+def _class_of(obj):
+    """
+    The object class of a parsed object, of a skipped one or of the target of a
+    resolved external reference
+    """
+    if isinstance(obj, Placeholder):
+        return M3GReader._type2class.get(obj.object_type)
+    if isinstance(obj, ExternalReference) and obj.target is not None:
+        return type(obj.target)
+    return type(obj)
+
+
+def _check_references(report, objects, obj_id, obj):
+    for owner, field, target_class, is_list, nullable in _references:
+        if not isinstance(obj, owner):
+            continue
+        if field in ("z_reference", "y_reference") and not obj.has_alignment:
+            continue
+        values = getattr(obj, field)
+        for ref in values if is_list else (values,):
+            if not ref:
+                if not nullable:
+                    report.add(obj_id, REFERENCE, f"{field} is null")
+                continue
+            if ref > len(objects):
+                report.add(obj_id, REFERENCE, f"{field} points past the end ({ref})")
+                continue
+            if ref >= obj_id:
+                report.add(
+                    obj_id, REFERENCE, f"{field} is a forward reference ({ref})"
+                )
+            target = _class_of(objects[ref - 1])
+            if target is ExternalReference:
+                continue
+            if target is None or not issubclass(target, target_class):
+                found = "unknown object" if target is None else target.__name__
+                report.add(
+                    obj_id,
+                    REFERENCE,
+                    f"{field} points at {found} ({ref}), "
+                    f"expected {target_class.__name__}",
+                )
+
+
+def _check_vertex_array(report, obj_id, vertex_array):
+    if vertex_array.component_size not in (1, 2, 4):
+        report.add(
+            obj_id, RANGE, f"component size {vertex_array.component_size} is invalid"
+        )
+    if not 2 <= vertex_array.component_count <= 4:
+        report.add(
+            obj_id, RANGE, f"component count {vertex_array.component_count} is invalid"
+        )
+    expected = vertex_array.vertex_count * vertex_array.component_count
+    if len(vertex_array.vertices) != expected:
+        report.add(
+            obj_id,
+            SIZE,
+            f"{len(vertex_array.vertices)} components for "
+            f"{vertex_array.vertex_count} vertices",
+        )
+
+
+def _strip_bounds(report, obj_id, strip_array):
+    """Checks a strip array and returns its highest index, or None when broken"""
+    lengths = strip_array.strip_lengths
+    if lengths and min(lengths) < 3:
+        report.add(obj_id, RANGE, "strip shorter than 3 indices")
+    if strip_array.encoding >= 128 and len(strip_array.indices) != sum(lengths):
+        report.add(
+            obj_id,
+            SIZE,
+            f"{len(strip_array.indices)} indices for strips of {sum(lengths)}",
+        )
+        return None
+    indices = strip_indices(strip_array)
+    return max(indices) if indices else -1
+
+
+def _vertex_count(report, objects, obj_id, vertex_buffer):
+    """Checks the arrays of a vertex buffer and returns its vertex count"""
+    slots = [
+        ("positions", vertex_buffer.positions, (3,)),
+        ("normals", vertex_buffer.normals, (3,)),
+        ("colors", vertex_buffer.colors, (3, 4)),
+    ]
+    slots += [("tex_coords", va_id, (2, 3)) for va_id in vertex_buffer.tex_coords]
+    counts = set()
+    for field, va_id, components in slots:
+        vertex_array = objects[va_id - 1] if 0 < va_id <= len(objects) else None
+        if not isinstance(vertex_array, VertexArray):
+            continue
+        counts.add(vertex_array.vertex_count)
+        if vertex_array.component_count not in components:
+            report.add(
+                obj_id,
+                RANGE,
+                f"{field} has {vertex_array.component_count} components",
+            )
+        if field == "colors" and vertex_array.component_size != 1:
+            report.add(obj_id, RANGE, "colors must have byte components")
+    if len(counts) > 1:
+        report.add(obj_id, SIZE, f"vertex arrays differ in length {sorted(counts)}")
+    return min(counts) if counts else 0
+
+
+def _check_image(report, obj_id, image):
+    try:
+        bpp = bytes_per_pixel(image.image_format)
+    except ValueError:
+        report.add(obj_id, RANGE, f"image format {image.image_format} is invalid")
+        return
+    if image.is_mutable:
+        return
+    pixel_count = image.width * image.height
+    if image.palette:
+        entries, rest = divmod(len(image.palette), bpp)
+        if rest or entries > 256:
+            report.add(obj_id, SIZE, f"palette of {len(image.palette)} bytes")
+        if len(image.pixels) != pixel_count:
+            report.add(
+                obj_id,
+                SIZE,
+                f"{len(image.pixels)} palette indices for "
+                f"{image.width} x {image.height}",
+            )
+        elif entries and max(image.pixels) >= entries:
+            report.add(obj_id, RANGE, "palette index beyond the palette")
+    elif len(image.pixels) != pixel_count * bpp:
+        report.add(
+            obj_id,
+            SIZE,
+            f"{len(image.pixels)} pixel bytes for {image.width} x {image.height}",
+        )
+
+
+def _check_keyframes(report, obj_id, sequence):
+    count = sequence.keyframe_count
+    if len(sequence.time) != count:
+        report.add(obj_id, SIZE, f"{len(sequence.time)} times for {count} keyframes")
+    if len(sequence.vector_value) != count * sequence.component_count:
+        report.add(obj_id, SIZE, f"{len(sequence.vector_value)} values")
+    if count and max(sequence.valid_range_first, sequence.valid_range_last) >= count:
+        report.add(obj_id, RANGE, "valid range beyond the last keyframe")
+    times = sequence.time
+    if any(map(int.__gt__, times, times[1:])):
+        report.add(obj_id, RANGE, "keyframe times are not increasing")
+
+
+def _power_of_two(value):
+    return value > 0 and not value & (value - 1)
+
+
+def validate(reader):
+    """
+    Validate the structure of all objects of a reader. Returns a
+    ValidationReport listing every reference, range and size problem found.
+    """
+    report = ValidationReport(getattr(reader, "path", None))
+    objects = reader.objects
+    report.objects = len(objects)
+    if not objects or not isinstance(objects[0], Header):
+        report.add(0, HEADER, "the first object is not a Header")
+    else:
+        header = objects[0]
+        file_size = getattr(reader, "file_size", None)
+        if file_size and header.total_file_size != file_size:
+            report.add(
+                1,
+                HEADER,
+                f"total file size {header.total_file_size}, file is {file_size}",
+            )
+
+    vertex_counts = {}
+    highest_index = {}
+    for obj_id, obj in enumerate(objects, 1):
+        if obj is None:
+            report.add(obj_id, REFERENCE, "unknown object type")
+            continue
+        if isinstance(obj, Header):
+            if obj_id != 1:
+                report.add(obj_id, HEADER, "Header after the first object")
+            continue
+        if isinstance(obj, Placeholder):
+            continue
+        _check_references(report, objects, obj_id, obj)
+        if isinstance(obj, VertexArray):
+            _check_vertex_array(report, obj_id, obj)
+        elif isinstance(obj, VertexBuffer):
+            vertex_counts[obj_id] = _vertex_count(report, objects, obj_id, obj)
+        elif isinstance(obj, TriangleStripArray):
+            highest_index[obj_id] = _strip_bounds(report, obj_id, obj)
+        elif isinstance(obj, Image2D):
+            _check_image(report, obj_id, obj)
+        elif isinstance(obj, KeyframeSequence):
+            _check_keyframes(report, obj_id, obj)
+        elif isinstance(obj, Texture2D):
+            image = objects[obj.image - 1] if 0 < obj.image <= len(objects) else None
+            if isinstance(image, Image2D) and not (
+                _power_of_two(image.width) and _power_of_two(image.height)
+            ):
+                report.add(obj_id, SIZE, "texture image size is not a power of two")
+        elif isinstance(obj, Mesh):
+            _check_mesh(report, objects, obj_id, obj, vertex_counts, highest_index)
+    return report
+
+
+def _check_mesh(report, objects, obj_id, mesh, vertex_counts, highest_index):
+    """Checks mesh index and vertex ranges against the vertex buffers before it"""
+    if len(mesh.index_buffer) != len(mesh.appearance):
+        report.add(obj_id, SIZE, "index buffer and appearance counts differ")
+    if mesh.vertex_buffer not in vertex_counts:
+        return
+    vertex_count = vertex_counts[mesh.vertex_buffer]
+    for submesh, index_id in enumerate(mesh.index_buffer):
+        highest = highest_index.get(index_id)
+        if highest is not None and highest >= vertex_count:
+            report.add(
+                obj_id,
+                RANGE,
+                f"submesh {submesh} uses vertex {highest} of {vertex_count}",
+            )
+    if isinstance(mesh, SkinnedMesh):
+        for bone, (first, count) in enumerate(
+            zip(mesh.first_vertex, mesh.vertex_count)
+        ):
+            if first + count > vertex_count:
+                report.add(
+                    obj_id,
+                    RANGE,
+                    f"bone {bone} covers vertices {first} to {first + count} "
+                    f"of {vertex_count}",
+                )
+    elif isinstance(mesh, MorphingMesh):
+        if len(mesh.initial_weight) != len(mesh.morph_target):
+            report.add(obj_id, SIZE, "morph target and weight counts differ")
+        for target in mesh.morph_target:
+            if target in vertex_counts and vertex_counts[target] != vertex_count:
+                report.add(
+                    obj_id,
+                    SIZE,
+                    f"morph target {target} has {vertex_counts[target]} vertices",
+                )
@@ -0,0 +1,298 @@
+"""
+Post-transform vertex cache optimization and triangle strip re-stitching
+
+Triangles are reordered with Tipsify (Sander, Nehab and Barczak, "Fast
+Triangle Reordering for Vertex Locality and Reduced Overdraw", 2007), which runs
+in linear time. The reordered triangles are then greedily grown into strips in
+simulated vertex cache order and stitched together with degenerate triangles.
+"""
+
+from array import array
+from collections import deque
+
+from PyM3G.geometry import strip_triangles, submeshes
+from PyM3G.layout import compact_objects
+from PyM3G.objects.triangle_strip_array import TriangleStripArray
+
+CACHE_SIZE = 16
+STRIP_COST = 3
+
+
+def acmr(triangles, cache_size=CACHE_SIZE):
+    """
+    Returns the average cache miss ratio (vertices transformed per triangle) of a
+    triangle list drawn through a FIFO vertex cache
+    """
+    if not triangles:
+        return 0.0
+    cached = set()
+    fifo = deque()
+    misses = 0
+    for index in triangles:
+        if index in cached:
+            continue
+        misses += 1
+        cached.add(index)
+        fifo.append(index)
+        if len(fifo) > cache_size:
+            cached.discard(fifo.popleft())
+    return misses / (len(triangles) // 3)
+
+
+def _adjacency(triangles, vertex_count):
+    """Vertex to triangle adjacency in compressed (offsets, triangles) form"""
+    valence = array("I", bytes(4 * (vertex_count + 1)))
+    for index in triangles:
+        valence[index] += 1
+    offsets = array("I", bytes(4 * (vertex_count + 1)))
+    total = 0
+    for vertex in range(vertex_count):
+        offsets[vertex] = total
+        total += valence[vertex]
+    offsets[vertex_count] = total
+    fill = array("I", offsets)
+    adjacent = array("I", bytes(4 * total))
+    for corner, index in enumerate(triangles):
+        adjacent[fill[index]] = corner // 3
+        fill[index] += 1
+    return offsets, adjacent, valence
+
+
+def tipsify(triangles, vertex_count, cache_size=CACHE_SIZE):
+    """Returns the triangle list reordered for post-transform vertex cache locality"""
+    offsets, adjacent, live = _adjacency(triangles, vertex_count)
+    cache_time = [0] * vertex_count
+    emitted = bytearray(len(triangles) // 3)
+    dead_end = []
+    output = array("I")
+    time = cache_size + 1
+    cursor = 0
+    while cursor < vertex_count and not live[cursor]:
+        cursor += 1
+    fanning = cursor if cursor < vertex_count else -1
+
+    while fanning >= 0:
+        candidates = []
+        for tri in adjacent[offsets[fanning] : offsets[fanning + 1]]:
+            if emitted[tri]:
+                continue
+            emitted[tri] = 1
+            for vertex in triangles[tri * 3 : tri * 3 + 3]:
+                output.append(vertex)
+                dead_end.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if time - cache_time[vertex] > cache_size:
+                    cache_time[vertex] = time
+                    time += 1
+
+        fanning = -1
+        best = -1
+        for vertex in candidates:
+            if not live[vertex]:
+                continue
+            priority = 0
+            if time - cache_time[vertex] + 2 * live[vertex] <= cache_size:
+                priority = time - cache_time[vertex]
+            if priority > best:
+                best = priority
+                fanning = vertex
+        if fanning >= 0:
+            continue
+        while dead_end:
+            vertex = dead_end.pop()
+            if live[vertex]:
+                fanning = vertex
+                break
+        else:
+            while cursor < vertex_count and not live[cursor]:
+                cursor += 1
+            if cursor < vertex_count:
+                fanning = cursor
+    return output
+
+
+def _rotations(a, b, c):
+    return ((a, b, c), (b, c, a), (c, a, b))
+
+
+def _next_edge(strip):
+    """The directed edge the next triangle of a strip has to start with"""
+    if len(strip) % 2:
+        return strip[-1], strip[-2]
+    return strip[-2], strip[-1]
+
+
+def _grow(strip, edges, used, triangles, cached, budget):
+    """
+    Extend a strip across unused neighbours until it runs out of them or would
+    miss the vertex cache more than budget times. Returns the triangles it took
+    and its cache misses.
+    """
+    taken = {}
+    seen = set(strip)
+    misses = len(seen - cached)
+    while True:
+        edge = _next_edge(strip)
+        for tri in edges.get(edge, ()):
+            if not used[tri] and tri not in taken:
+                break
+        else:
+            return list(taken), misses
+        for first, second, third in _rotations(*triangles[tri]):
+            if (first, second) == edge:
+                break
+        if third not in seen:
+            if third not in cached:
+                if misses >= budget:
+                    return list(taken), misses
+                misses += 1
+            seen.add(third)
+        strip.append(third)
+        taken[tri] = None
+
+
+def build_strips(triangles, cache_size=CACHE_SIZE):
+    """
+    Greedily grow strips across shared edges, keeping the winding. The strips are
+    drawn through a simulated FIFO vertex cache: each one is seeded next to the
+    cached vertices and picked for the fewest misses per triangle, with
+    STRIP_COST misses charged for starting it, and stops before missing more than
+    three quarters of the cache. Without cached neighbours the seed is the first
+    unused triangle, so strips built from a cache optimized list follow its
+    traversal. Returns a list of strips (lists of vertex indices).
+    """
+    triangles = [tuple(triangles[i : i + 3]) for i in range(0, len(triangles), 3)]
+    edges = {}
+    corners = {}
+    for tri, (a, b, c) in enumerate(triangles):
+        for edge in ((a, b), (b, c), (c, a)):
+            edges.setdefault(edge, []).append(tri)
+        for vertex in (a, b, c):
+            corners.setdefault(vertex, []).append(tri)
+    budget = cache_size * 3 // 4
+    used = bytearray(len(triangles))
+    cached = set()
+    fifo = deque()
+    strips = []
+    cursor = 0
+    while True:
+        seeds = sorted(
+            {tri for vertex in fifo for tri in corners[vertex] if not used[tri]}
+        )
+        if not seeds:
+            while cursor < len(triangles) and used[cursor]:
+                cursor += 1
+            if cursor == len(triangles):
+                return strips
+            seeds = [cursor]
+        best, best_taken, best_cost = None, None, None
+        for seed in seeds:
+            used[seed] = 1
+            for rotation in _rotations(*triangles[seed]):
+                strip = list(rotation)
+                taken, misses = _grow(strip, edges, used, triangles, cached, budget)
+                cost = (misses + STRIP_COST) / (len(taken) + 1)
+                if best is None or cost < best_cost:
+                    best, best_taken, best_cost = strip, taken + [seed], cost
+            used[seed] = 0
+        for tri in best_taken:
+            used[tri] = 1
+        for vertex in best:
+            if vertex not in cached:
+                cached.add(vertex)
+                fifo.append(vertex)
+                if len(fifo) > cache_size:
+                    cached.discard(fifo.popleft())
+        strips.append(best)
+
+
+def stitch_strips(strips):
+    """Join strips into one with degenerate triangles, keeping each strip's winding"""
+    stitched = []
+    for strip in strips:
+        if stitched:
+            stitched.append(stitched[-1])
+            stitched.append(strip[0])
+            if len(stitched) % 2:
+                stitched.append(strip[0])
+        stitched.extend(strip)
+    return stitched
+
+
+def make_strip_array(strips):
+    """Returns a TriangleStripArray with explicit indices for a list of strips"""
+    strip_array = TriangleStripArray()
+    indices = [index for strip in strips for index in strip]
+    highest = max(indices) if indices else 0
+    if highest < 256:
+        strip_array.encoding, typecode = 129, "B"
+    elif highest < 65536:
+        strip_array.encoding, typecode = 130, "H"
+    else:
+        strip_array.encoding, typecode = 128, "I"
+    strip_array.start_index = 0
+    strip_array.indices = array(typecode, indices)
+    strip_array.strip_lengths = array("I", [len(strip) for strip in strips])
+    return strip_array
+
+
+def optimize_strip_array(
+    strip_array, vertex_count, cache_size=CACHE_SIZE, stitch=True
+):
+    """
+    Reorder the triangles of a TriangleStripArray for the vertex cache and rebuild
+    them as strips, stitched into a single strip unless stitch is False.
+
+    Returns the new TriangleStripArray, the reordered triangle list (for index
+    buffer exports) and a report dict with the triangle count, the ACMR of the
+    original strips, of the reordered list and of the new strips, and the strip
+    counts before and after. Only the strips are written, so acmr_strips is the
+    ACMR of the result; acmr_after measures the list the strips were built from.
+    """
+    before = strip_triangles(strip_array)
+    reordered = tipsify(before, vertex_count, cache_size)
+    strips = build_strips(reordered, cache_size)
+    if stitch and strips:
+        strips = [stitch_strips(strips)]
+    optimized = make_strip_array(strips)
+    report = {
+        "triangles": len(before) // 3,
+        "acmr_before": acmr(before, cache_size),
+        "acmr_after": acmr(reordered, cache_size),
+        "acmr_strips": acmr(strip_triangles(optimized), cache_size),
+        "strips_before": len(strip_array.strip_lengths),
+        "strips_after": len(strips),
+    }
+    return optimized, reordered, report
+
+
+def optimize_mesh(reader, mesh, cache_size=CACHE_SIZE, stitch=True, compact=True):
+    """
+    Optimize every submesh of a Mesh. The new TriangleStripArrays are added to the
+    reader and the mesh's index buffers are pointed at them. With compact, they
+    are moved in front of the mesh and the replaced strip arrays nothing uses
+    anymore are removed (see layout.compact_objects), which renumbers the objects
+    after them. Returns one report per submesh (see optimize_strip_array, the
+    written ACMR is acmr_strips), with the mapping of old to new object ids under
+    "ids" (None if not compacted).
+    """
+    vertex_buffer = reader.get_object_by_id(mesh.vertex_buffer)
+    positions = reader.get_object_by_id(vertex_buffer.positions)
+    reports = []
+    replaced = []
+    for submesh, (strip_array, _) in enumerate(submeshes(reader, mesh)):
+        if strip_array is None:
+            continue
+        optimized, _, report = optimize_strip_array(
+            strip_array, positions.vertex_count, cache_size, stitch
+        )
+        replaced.append(mesh.index_buffer[submesh])
+        mesh.index_buffer[submesh] = reader.add_object(optimized)
+        report["ids"] = None
+        reports.append(report)
+    if compact and replaced:
+        ids = compact_objects(reader, replaced)
+        for report in reports:
+            report["ids"] = ids
+    return reports
@@ -0,0 +1,207 @@
+"""
+Vertex welding for VertexBuffers and their TriangleStripArrays
+
+All attribute streams of a vertex buffer are interleaved into one byte row per
+vertex with slice assignment, so deduplication hashes one bytes object per vertex
+instead of building tuples of Python values.
+"""
+
+from array import array
+from math import floor
+from itertools import product
+
+from PyM3G.geometry import gather, strip_indices, vertex_attributes
+from PyM3G.layout import compact_objects
+from PyM3G.objects.mesh import Mesh
+from PyM3G.objects.morphing_mesh import MorphingMesh
+from PyM3G.objects.skinned_mesh import SkinnedMesh
+from PyM3G.objects.triangle_strip_array import TriangleStripArray
+from PyM3G.objects.vertex_array import VertexArray
+
+
+def interleave_rows(vertex_arrays, count):
+    """Interleave the raw bytes of several vertex arrays into rows of one vertex"""
+    widths = [va.component_count * va.component_size for va in vertex_arrays]
+    stride = sum(widths)
+    rows = bytearray(count * stride)
+    offset = 0
+    for vertex_array, width in zip(vertex_arrays, widths):
+        raw = vertex_array.vertices.tobytes()[: count * width]
+        for byte in range(width):
+            rows[offset + byte :: stride] = raw[byte::width]
+        offset += width
+    return bytes(rows), stride, widths
+
+
+def _deinterleave(rows, stride, offset, width):
+    count = len(rows) // stride
+    column = bytearray(count * width)
+    for byte in range(width):
+        column[byte::width] = rows[offset + byte :: stride]
+    return bytes(column)
+
+
+def _native_array(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+
+def _find_near(grid, cell, point, rest, radius):
+    """Returns a vertex in the cells around cell matching point and rest, or None"""
+    for offset in product((-1, 0, 1), repeat=3):
+        near = (cell[0] + offset[0], cell[1] + offset[1], cell[2] + offset[2])
+        for other, other_point, other_rest in grid.get(near, ()):
+            if other_rest == rest and all(
+                abs(a - b) <= radius for a, b in zip(point, other_point)
+            ):
+                return other
+    return None
+
+
+def _grid_merge(vertex_buffer, positions, unique, epsilon):
+    """
+    Merge unique vertices whose positions are within epsilon (in world units) and
+    whose other attributes are identical, using a uniform grid of epsilon sized
+    cells. Returns the remap from unique vertex to merged vertex.
+    """
+    radius = epsilon / (abs(vertex_buffer.position_scale) or 1.0)
+    width = positions.component_size * 3
+    grid = {}
+    remap = array("I")
+    merged = 0
+    for row in unique:
+        point = _native_array(positions.vertices.typecode, row[:width])
+        cell = tuple(floor(comp / radius) for comp in point)
+        rest = row[width:]
+        target = _find_near(grid, cell, point, rest, radius)
+        if target is None:
+            target = merged
+            merged += 1
+            grid.setdefault(cell, []).append((target, point, rest))
+        remap.append(target)
+    return remap
+
+
+def weld_vertex_buffer(reader, vb_id, epsilon=0.0, compact=True):
+    """
+    Deduplicate the vertices of a VertexBuffer and remap the TriangleStripArrays of
+    every Mesh drawn with it. Vertices are merged when all their attributes are
+    byte-identical, or with epsilon > 0 when their positions are also within
+    epsilon of each other (in world units) and the other attributes are identical.
+
+    The welded streams are added to the reader as new VertexArrays (the old ones
+    may be shared) and the meshes get new TriangleStripArrays with explicit
+    indices. Vertex buffers drawn by SkinnedMesh or MorphingMesh objects are left
+    alone since their vertex ranges and morph targets depend on the vertex order.
+    Nothing is changed when no vertices merge.
+
+    With compact, the new objects are moved in front of their first user and the
+    replaced arrays nothing uses anymore are removed (see layout.compact_objects),
+    which renumbers the objects after them.
+
+    Returns a report dict with vertex counts and stream sizes before and after,
+    and under "ids" the mapping of old to new object ids (None if not compacted).
+    """
+    report, replaced = _weld(reader, vb_id, epsilon)
+    if compact and replaced:
+        report["ids"] = compact_objects(reader, replaced)
+    return report
+
+
+def _weld(reader, vb_id, epsilon):
+    """Welds a vertex buffer, returning its report and the ids it replaced"""
+    vertex_buffer = reader.get_object_by_id(vb_id)
+    meshes = [
+        obj
+        for obj in reader.objects
+        if isinstance(obj, Mesh) and obj.vertex_buffer == vb_id
+    ]
+    if any(isinstance(mesh, (SkinnedMesh, MorphingMesh)) for mesh in meshes):
+        raise ValueError(f"VertexBuffer {vb_id} is used by a skinned or morphing mesh")
+    attributes = vertex_attributes(reader, vertex_buffer)
+    count = min(va.vertex_count for _, va in attributes)
+    vertex_arrays = [va for _, va in attributes]
+    rows, stride, widths = interleave_rows(vertex_arrays, count)
+
+    first = {}
+    keys = [rows[start : start + stride] for start in range(0, len(rows), stride)]
+    remap = [first.setdefault(key, len(first)) for key in keys]
+    unique = list(first)
+    if epsilon > 0.0 and attributes[0][0] == "positions":
+        merged = _grid_merge(vertex_buffer, vertex_arrays[0], unique, epsilon)
+        survivors = {}
+        for index, target in enumerate(merged):
+            survivors.setdefault(target, unique[index])
+        unique = [survivors[target] for target in range(len(survivors))]
+        remap = gather(merged, remap)
+    welded = b"".join(unique)
+    report = {
+        "vertices_before": count,
+        "vertices_after": len(unique),
+        "bytes_before": count * stride,
+        "bytes_after": len(welded),
+        "ids": None,
+    }
+    if len(unique) == count:
+        return report, []
+
+    replaced = []
+    offset = 0
+    for (slot, old), width in zip(attributes, widths):
+        new = VertexArray()
+        new.component_size = old.component_size
+        new.component_count = old.component_count
+        new.encoding = 0
+        new.vertex_count = len(unique)
+        new.vertices = _native_array(
+            old.vertices.typecode, _deinterleave(welded, stride, offset, width)
+        )
+        offset += width
+        va_id = reader.add_object(new)
+        if isinstance(slot, tuple):
+            replaced.append(vertex_buffer.tex_coords[slot[1]])
+            vertex_buffer.tex_coords[slot[1]] = va_id
+        else:
+            replaced.append(getattr(vertex_buffer, slot))
+            setattr(vertex_buffer, slot, va_id)
+
+    for mesh in meshes:
+        for submesh, index_id in enumerate(mesh.index_buffer):
+            old = reader.get_object_by_id(index_id)
+            if not isinstance(old, TriangleStripArray):
+                continue
+            new = TriangleStripArray()
+            new.start_index = 0
+            new.encoding, typecode = (130, "H") if len(unique) < 65536 else (128, "I")
+            new.indices = array(typecode, gather(remap, strip_indices(old)))
+            new.strip_lengths = array("I", old.strip_lengths)
+            replaced.append(index_id)
+            mesh.index_buffer[submesh] = reader.add_object(new)
+    return report, replaced
+
+
+def weld_all(reader, epsilon=0.0):
+    """
+    Weld every VertexBuffer drawn only by plain meshes, then compact the objects
+    once for all of them. Returns a dict of vertex buffer id (before compacting)
+    to weld report, whose "ids" are the shared mapping of old to new object ids.
+    """
+    skipped = set()
+    candidates = set()
+    for obj in reader.objects:
+        if isinstance(obj, (SkinnedMesh, MorphingMesh)):
+            skipped.add(obj.vertex_buffer)
+        elif isinstance(obj, Mesh):
+            candidates.add(obj.vertex_buffer)
+    reports = {}
+    replaced = []
+    for vb_id in sorted(candidates - skipped):
+        if vb_id:
+            reports[vb_id], dropped = _weld(reader, vb_id, epsilon)
+            replaced += dropped
+    if replaced:
+        ids = compact_objects(reader, replaced)
+        for report in reports.values():
+            report["ids"] = ids
+    return reports
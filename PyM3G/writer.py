@@ -0,0 +1,95 @@
+"""
+Module for writing JSR 184 m3g files
+"""
+
+from copy import copy
+from struct import pack
+import zlib
+
+from PyM3G.reader import M3GReader, M3G_SIGNATURE
+from PyM3G.objects.external_reference import ExternalReference
+from PyM3G.objects.header import Header
+
+_class2type = {cls: type_id for type_id, cls in M3GReader._type2class.items()}
+
+
+def object_type(obj):
+    """Returns the object type id of an object"""
+    if type(obj) not in _class2type:
+        raise ValueError(f"Can not write {type(obj).__name__} objects")
+    return _class2type[type(obj)]
+
+
+def encode_object(obj):
+    """Returns an object with its type and length header"""
+    data = obj.encode()
+    return pack("<BI", object_type(obj), len(data)) + data
+
+
+def encode_section(data, compress=True, level=6):
+    """
+    Returns a section holding encoded objects. Compressed sections are only used
+    when they are actually smaller.
+    """
+    compression = 0
+    body = data
+    if compress:
+        packed = zlib.compress(data, level)
+        if len(packed) < len(data):
+            compression, body = 1, packed
+    header = pack("<BII", compression, len(body) + 13, len(data))
+    return header + body + pack("<I", zlib.adler32(header + body))
+
+
+def encode_m3g(objects, compress=True, level=6):
+    """
+    Returns the encoded file of a list of objects, the first of which has to be
+    the Header. The header goes in its own uncompressed section, followed by the
+    external references (uncompressed too) and one section with all other
+    objects. Objects are written in list order, so their ids stay the same and
+    references have to point at earlier objects (see validation.validate).
+
+    The total file size and, when there are no external references, the
+    approximate content size of the written header are filled in; the Header
+    object itself is not changed.
+    """
+    if not objects or not isinstance(objects[0], Header):
+        raise ValueError("The first object has to be a Header")
+    count = 1
+    while count < len(objects) and isinstance(objects[count], ExternalReference):
+        count += 1
+    sections = []
+    if count > 1:
+        data = b"".join(encode_object(obj) for obj in objects[1:count])
+        sections.append(encode_section(data, False))
+    data = b"".join(encode_object(obj) for obj in objects[count:])
+    sections.append(encode_section(data, compress, level))
+    return encode_file(objects[0], sections, count > 1)
+
+
+def encode_file(header, sections, external=False):
+    """
+    Returns the encoded file of a Header and the encoded sections that follow
+    it. The header goes in its own uncompressed section, with the total file
+    size and, when there are no external references, the approximate content
+    size filled in; the Header object itself is not changed.
+    """
+    header = copy(header)
+    header.has_external_references = external
+    header.total_file_size = 0
+    size = len(M3G_SIGNATURE) + len(encode_section(encode_object(header), False))
+    header.total_file_size = size + sum(len(section) for section in sections)
+    if not external:
+        header.approximate_content_size = header.total_file_size
+    else:
+        header.approximate_content_size = max(
+            header.approximate_content_size or 0, header.total_file_size
+        )
+    sections = [encode_section(encode_object(header), False)] + list(sections)
+    return M3G_SIGNATURE + b"".join(sections)
+
+
+def write_m3g(path, objects, compress=True, level=6):
+    """Write a list of objects (such as M3GReader.objects) to an m3g file"""
+    with open(path, "wb") as file:
+        file.write(encode_m3g(objects, compress, level))